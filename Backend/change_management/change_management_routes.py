@@ -2,6 +2,7 @@ import os
 import traceback
 
 from fastapi import APIRouter
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional
 from pydantic import Field, BaseModel, model_validator
 from fastapi.responses import JSONResponse
@@ -44,9 +45,9 @@ class CreateChangewithImapactPayload(BaseModel):
 async def create_ctask_for_change_request(payload: CtaskPayload) -> list:
     response = {}
     try:
-        ctask_obj  = ServiceNowChangeRequests()
+        ctask_obj  = await run_in_threadpool(ServiceNowChangeRequests)
 
-        output = ctask_obj.get_response_vector_db(payload.chg_number)
+        output = await run_in_threadpool(ctask_obj.get_response_vector_db, payload.chg_number)
 
         response["code"]=200
         if output:
@@ -67,9 +68,9 @@ async def create_ctask_for_change_request(payload: CtaskPayload) -> list:
 async def draft_change_prompt(payload: DraftChangePayload) -> dict:
     response = {}
     try:
-        chg_obj = ChangeManagement()
+        chg_obj = await run_in_threadpool(ChangeManagement)
 
-        output = chg_obj.draft_change_prompt(change_title = payload.change_title, change_purpose = payload.change_purpose , os_info = payload.os_info, uploaded_files = payload.uploaded_files, config_items = payload.config_items)
+        output = await run_in_threadpool(chg_obj.draft_change_prompt, change_title = payload.change_title, change_purpose = payload.change_purpose , os_info = payload.os_info, uploaded_files = payload.uploaded_files, config_items = payload.config_items)
 
         response['output'] = {"data": output, "message":'Prompt created successfully'}
         response['code'] = 200
@@ -88,9 +89,9 @@ async def draft_change_prompt(payload: DraftChangePayload) -> dict:
 async def create_change_with_impact(payload: CreateChangewithImapactPayload) -> dict:
     response = {}
     try:
-        chg_obj = ChangeManagement()
+        chg_obj = await run_in_threadpool(ChangeManagement)
 
-        output = chg_obj.create_change_with_impact(uploaded_files = payload.uploaded_files, change = payload.change, config_items = payload.config_items)
+        output = await run_in_threadpool(chg_obj.create_change_with_impact, uploaded_files = payload.uploaded_files, change = payload.change, config_items = payload.config_items)
 
         response['output'] = {"data": output, "message":'Change Request with Impact Created Successfully'}
         response['code'] = 200
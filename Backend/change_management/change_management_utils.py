@@ -4,6 +4,7 @@ import os
 import sys
 import datetime
 import base64
+from concurrent.futures import ThreadPoolExecutor
 
 from .change_assistant import ChangeAssistant
 from .itsm_connector import ITSM
@@ -17,10 +18,14 @@ SCRIPT_PATH = os.path.dirname(__file__)
 ROOT_PATH = os.path.dirname(SCRIPT_PATH.split('/change_management/')[0])
 sys.path.append(ROOT_PATH)
 sys.path.append(SCRIPT_PATH)
-from vault import Vault
+from vault import get_vault
+from itsm.ci_index import SUBSTRING_SCORE
 import tech_buddy_autogen
 import visual_analyzer
 
+# Upper bound on CIs analysed concurrently
+SERVICE_MAP_WORKERS = 8
+
 class ChangeManagement:
     def __init__(self):
         """Initialize the Change Management system."""
@@ -39,14 +44,7 @@ class ChangeManagement:
             self.snow_url = self.snow_url[:-1]
 
         # Initiate vault
-        vault_path = ROOT_PATH + '/config/.vault_token'
-
-        vault_file = open(vault_path, 'r')
-        vault_token = vault_file.read().strip()
-        vault_file.close()
-
-        vault_url = mim_conf['vault_url']
-        self.vault_session = Vault(vault_url, vault_token)
+        self.vault_session = get_vault(mim_conf['vault_url'])
 
         self.ke_category = mim_conf["ke_category_name"]
 
@@ -212,31 +210,21 @@ class ChangeManagement:
 
     def analyze_change_impact_with_service_map(self, short_description, description, ci_items):
         """Analyze the impact of change on service maps of configuration items."""
-        service_map_explanations = []
         itsm_obj = ITSM()
-        ci_items = ci_items.split(",")
+        ci_items = [ci.strip() for ci in ci_items.split(",") if ci.strip() != ""]
 
         print(ci_items)
-        for ci in ci_items:
-            if ci.strip() == "":
-                continue
-
-            ci_obj = itsm_obj.get_cmdb_ci(ci.strip())
-            print(ci_obj)
-            if ci_obj != []:
-                ci_obj = ci_obj[0]
-            else:
-                continue
 
-            service_map = itsm_obj.get_parents_children(ci_obj["sys_id"], "parent")
-            service_map = service_map[::-1]
-            service_map = itsm_obj.get_parents_children(ci_obj["sys_id"], "child", service_map)
+        # All CIs are resolved in one call, then walked concurrently; results keep the order the user typed
+        resolved = itsm_obj.resolve_cmdb_cis(ci_items, limit = 1) if ci_items else {}
+
+        # Only what nameLIKE would have found: a fuzzy near-miss is a different CI
+        resolved = {ci: [match for match in matches if match['score'] >= SUBSTRING_SCORE] for (ci, matches) in resolved.items()}
 
-            service_map_explanation = "Service Map For CI " + ci.strip() + "-\n"
-            for line in service_map:
-                service_map_explanation += line.strip() + "\n"
+        with ThreadPoolExecutor(max_workers = max(1, min(len(ci_items), SERVICE_MAP_WORKERS))) as executor:
+            explanations = list(executor.map(lambda ci: self.explain_service_map(itsm_obj, ci, resolved[ci]), ci_items))
 
-            service_map_explanations.append(service_map_explanation)
+        service_map_explanations = [explanation for explanation in explanations if explanation is not None]
 
         if service_map_explanations != []:
             prompt = "Below are the explanations of service maps associated to various configuration items -\n\n"
@@ -251,6 +239,27 @@ class ChangeManagement:
 
         return ""
     
+    def explain_service_map(self, itsm_obj, ci, ci_obj):
+        """Service map narrative of a single CI from its resolve_cmdb_cis matches, or None when the CI is not found."""
+        print(ci_obj)
+        if ci_obj != []:
+            ci_obj = ci_obj[0]
+        else:
+            return None
+
+        # Both directions are walked at the same time
+        with ThreadPoolExecutor(max_workers = 2) as executor:
+            parents = executor.submit(itsm_obj.get_parents_children, ci_obj["sys_id"], "parent")
+            children = executor.submit(itsm_obj.get_parents_children, ci_obj["sys_id"], "child")
+
+            service_map = parents.result()[::-1] + children.result()
+
+        service_map_explanation = "Service Map For CI " + ci + "-\n"
+        for line in service_map:
+            service_map_explanation += line.strip() + "\n"
+
+        return service_map_explanation
+
     def encode_image(self, image):
         """Encodes an image to base64."""
         image_path = SCRIPT_PATH + "/static/" + image
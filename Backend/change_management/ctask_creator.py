@@ -8,7 +8,7 @@ from .kb_manager import KBManager
 from .change_assistant import ChangeAssistant
 from .snow_ctask import ServiceNowTasks
 
-from .vault import Vault
+from vault import get_vault
 
 import split_impl
 
@@ -24,14 +24,7 @@ class ServiceNowChangeRequests:
         app_conf = json.load(app_conf_file)
         app_conf_file.close()
         # Initiate vault
-        vault_path = SCRIPT_PATH + '/config/.vault_token'
-
-        vault_file = open(vault_path, 'r')
-        vault_token = vault_file.read().strip()
-        vault_file.close()
-
-        vault_url = app_conf['vault_url']
-        self.vault_session = Vault(vault_url, vault_token)
+        self.vault_session = get_vault(app_conf['vault_url'], SCRIPT_PATH + '/config/.vault_token')
 
         # Fetch ServiceNow credentials
         self.snow_url = app_conf['snow_url']
@@ -120,10 +113,8 @@ class ServiceNowChangeRequests:
             answer = split_impl.get_suggestions(curr_chg, historical_change)
             extract_object = split_impl.ChangeTask()
             ctask_json = extract_object.extract_json(answer)
-            ctask_list = []
-            for ctask_data in ctask_json:
-                ctask = curr_chg_obj.create_task(short_description = ctask_data['short_description'], number = change_number.upper(), sys_id = curr_chg[0]['sys_id'], description = ctask_data['description'],assignment_group = ctask_data['assignment_group'])
-                ctask_list.append(ctask)
+            # All generated tasks go out in one batched write
+            ctask_list = curr_chg_obj.create_tasks(ctask_json, sys_id = curr_chg[0]['sys_id'])
             return ctask_list
 #snow_obj = ServiceNowChangeRequests()
 #snow_obj.get_response_vector_db()
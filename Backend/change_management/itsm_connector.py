@@ -6,14 +6,23 @@ import sys
 import datetime
 
 import json
-import requests
 
 SCRIPT_PATH = os.path.dirname(__file__)
 ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
 
+BACKEND_PATH = SCRIPT_PATH.split('/change_management')[0]
+
 sys.path.append(ROOT_PATH)
+sys.path.append(BACKEND_PATH)
 
-from vault import Vault
+from vault import get_vault
+from itsm.snow_client import CustomError, get_snow_client
+from itsm.snow_attachments import upload_file, upload_files
+from itsm.cmdb_graph import render_service_map, DEFAULT_MAX_DEPTH, DEFAULT_MAX_FANOUT
+from itsm.cmdb_lookup import get_cmdb_ci, resolve_cmdb_cis, get_service_map_graph
+from itsm.ci_index import DEFAULT_RESOLVE_LIMIT
+from itsm.snow_cache import get_snow_cache, cache_key
+from itsm.reference_data import to_sys_id
 
 class ITSM:
     def __init__(self):
@@ -29,14 +38,7 @@ class ITSM:
             self.snow_url = self.snow_url[:-1]
 
         # Initiate vault
-        vault_path = ROOT_PATH + '/config/.vault_token'
-
-        vault_file = open(vault_path, 'r')
-        vault_token = vault_file.read().strip()
-        vault_file.close()
-
-        vault_url = app_conf['vault_url']
-        self.vault_session = Vault(vault_url, vault_token)
+        self.vault_session = get_vault(app_conf['vault_url'])
 
         snow_tag = app_conf['snow_tag']
 
@@ -60,6 +62,12 @@ class ITSM:
 
         self.headers = {'content-type': 'application/json'}
 
+        # Pooled session shared with every other ITSM code path
+        self.client = get_snow_client(self.snow_url, self.snow_username, self.snow_password)
+
+        # Read-through cache shared by every client in the process
+        self.cache = get_snow_cache()
+
         
     # Fetch list of incidents
     def get_ticket_details(self, table = 'incident', start_ts = None, end_ts = None, conditions = []):
@@ -106,8 +114,7 @@ class ITSM:
         try:
             print(target_url)
             print(self.headers)
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    headers = self.headers, verify = False)
+            response = self.client.get(target_url)
         except Exception as e:
             print(str(e))
             return tickets
@@ -136,11 +143,12 @@ class ITSM:
         if work_notes.strip() != '':
             payload['work_notes'] = work_notes
 
+        # sys_ids from the local dictionary save the instance a name lookup per reference
         if assignment_group.strip() != '':
-            payload['assignment_group'] = assignment_group
+            payload['assignment_group'] = to_sys_id('sys_user_group', assignment_group.strip(), self.client)
 
         if assigned_to.strip() != '':
-            payload['assigned_to'] = assigned_to
+            payload['assigned_to'] = to_sys_id('sys_user', assigned_to.strip(), self.client)
 
         if resolve and resolution_notes.strip() != '':
             payload['close_notes'] = resolution_notes
@@ -148,13 +156,21 @@ class ITSM:
             payload['close_code'] = 'Solved (Permanently)'
 
         try:
-            response = requests.put(target_url, auth = (self.snow_username, self.snow_password), \
-                    data = json.dumps(payload), headers = self.headers, verify = False)
+            response = self.client.put(target_url, data = json.dumps(payload))
         except Exception as e:
             print(str(e))
 
     # Fetch Change Request Details
     def get_change_request_details(self, start_ts = None, end_ts = None, conditions = [], change = None):
+        load = lambda: self._load_change_request_details(start_ts = start_ts, end_ts = end_ts, conditions = conditions, change = change)
+
+        # Lookups by number or condition are cached; time-window listings can be large
+        if change is None and not conditions:
+            return load()
+
+        return self.cache.cached('change_request', cache_key(self.client, 'change_requests', start_ts, end_ts, conditions, change), load)
+
+    def _load_change_request_details(self, start_ts = None, end_ts = None, conditions = [], change = None):
         
         change_requests = []
         target_url = self.snow_url + '/api/now/table/change_request'
@@ -208,8 +224,7 @@ class ITSM:
         target_url = target_url[:-1]
         
         try:
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    headers = self.headers, verify = False)
+            response = self.client.get(target_url)
             
         except Exception as e:
             print(e)
@@ -247,20 +262,29 @@ class ITSM:
         payload['end_date'] = payload['end_date'].strftime('%Y-%m-%d %H:%M:%S')
 
         try:
-            response = requests.post(target_url, auth = (self.snow_username, self.snow_password), \
-                    data = json.dumps(payload), headers = self.headers, verify = False)
-            output = {'number': response.json()['result']['number']}
-            output['target_link'] = self.snow_url + '/now/nav/ui/classic/params/target/change_request.do%3Fsys_id%3D' + response.json()['result']['sys_id']
+            response = self.client.post(target_url, data = json.dumps(payload))
+            result = response.json()['result']
+            output = {'number': result['number']}
+            output['target_link'] = self.snow_url + '/now/nav/ui/classic/params/target/change_request.do%3Fsys_id%3D' + result['sys_id']
         except Exception as e:
             output = {}
 
-        file_types = {'png': 'image/png'}
-        for attachment in attachments:
-            file_extension = attachment.split('.')[-1].lower().strip()
-            self.attach_file(response.json()['result']['sys_id'], attachment, file_types[file_extension])
+        self.cache.invalidate('change_request')
+
+        if output and attachments:
+            self.attach_files(result['sys_id'], attachments)
 
         return output
 
+    # Attach files from static/ concurrently, one result per file
+    def attach_files(self, sys_id, file_names, table = 'change_request'):
+        results = upload_files(self.client, table, sys_id, [SCRIPT_PATH + '/static/' + file_name for file_name in file_names])
+        for (file_name, result) in zip(file_names, results):
+            if result['error']:
+                print(file_name + ' - ' + result['error'])
+
+        return results
+
     # Create Problem Ticket
     def create_problem_request(self, short_description, description = '', incidents = []):
         target_url = self.snow_url + '/api/now/table/problem'
@@ -270,8 +294,7 @@ class ITSM:
         payload['description'] = description
 
         try:
-            response = requests.post(target_url, auth = (self.snow_username, self.snow_password), \
-                    data = json.dumps(payload), headers = self.headers, verify = False)
+            response = self.client.post(target_url, data = json.dumps(payload))
             output = {'number': response.json()['result']['number']}
             output['target_link'] = self.snow_url + '/now/nav/ui/classic/params/target/problem.do%3Fsys_id%3D' + response.json()['result']['sys_id']
         except Exception as e:
@@ -280,17 +303,12 @@ class ITSM:
         return output
 
     # Attach files in ticket
-    def attach_file(self, sys_id, file_name, file_type):
-        target_url = self.snow_url + '/api/now/attachment/upload'
-        payload = {'table_name': 'change_request', 'table_sys_id': sys_id}
+    def attach_file(self, sys_id, file_name, file_type, table = 'change_request'):
+        result = upload_file(self.client, table, sys_id, SCRIPT_PATH + '/static/' + file_name, content_type = file_type)
+        if result['error']:
+            print(file_name + ' - ' + result['error'])
 
-        files = {'file': (file_name, open(SCRIPT_PATH + '/static/' + file_name, 'rb'), file_type, {'Expires': '0'})}
-
-        try:
-            response = requests.post(target_url, auth = (self.snow_username, self.snow_password),
-                                     data = payload, files = files)
-        except Exception:
-            pass
+        return result
 
     # Create Knowledge Article
     def create_knowledge_article(self, short_description = '', text = ''):
@@ -303,93 +321,43 @@ class ITSM:
         payload['workflow_state'] = 'draft'
 
         try:
-            response = requests.post(target_url, auth = (self.snow_username, self.snow_password), \
-                    data = json.dumps(payload), headers = self.headers, verify = False)
+            response = self.client.post(target_url, data = json.dumps(payload))
             output = {'number': response.json()['result']['number']}
             output['target_link'] = self.snow_url + '/now/nav/ui/classic/params/target/kb_knowledge.do%3Fsys_id%3D' + response.json()['result']['sys_id']
         except Exception:
             output = {}
 
+        self.cache.invalidate('kb_knowledge')
+
         return output
 
     # Fetch configuration item details
     def get_cmdb_ci(self, ci):
-        target_url = self.snow_url + '/api/now/table/cmdb_ci'
+        return get_cmdb_ci(self.client, self.cache, ci)
 
-        params = {}
-        params['sysparm_query'] = 'nameLIKE' + ci + '^ORip_address=' + ci
-        params['sysparm_display_value'] = 'true'
-
-        try:
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    params = params, headers = self.headers, verify = False)
-            output = response.json()['result']
-
-            if type(output) == dict:
-                output = [output]
-        except Exception:
-            output = []
-
-        return output
+    # Resolve several CI names or IPs at once, {ci: ranked matches}
+    def resolve_cmdb_cis(self, cis, limit = DEFAULT_RESOLVE_LIMIT):
+        return resolve_cmdb_cis(self.client, self.cache, cis, limit = limit)
 
 
     # Obtain child or parent hierarchy of any CMDB element
-    def get_parents_children(self, sys_id, target, service_map = []):
-        data = ''
-
-        target_url = self.snow_url + '/api/now/table/cmdb_rel_ci'
-        params = {
-                'sysparm_query': 'parent=' + sys_id + '^ORchild=' + sys_id,
-                'sysparm_fields': 'parent,child,type,parent.name,parent.sys_class_name,parent.ip_address,child.name,child.sys_class_name,child.ip_address,type.name'
-                }
-
-        if target == 'parent':
-            relation = 'child'
-        elif target == 'child':
-            relation = 'parent'
-
-        try:
-            direct_targets = []
-
-            output = requests.get(target_url, auth = (self.snow_username, self.snow_password), 
-                                  params = params, headers = self.headers)
-            output = output.json()['result']
+    def get_parents_children(self, sys_id, target, service_map = None, max_depth = None, max_fanout = None):
+        if service_map is None:
+            service_map = []
 
-            for entry in output:
-                if (entry['parent.name'] == '' and entry['parent.sys_class_name'] == '') or (entry['child.name'] == '' and entry['child.sys_class_name'] == ''):
-                    continue
+        graph = self.get_service_map_graph([sys_id], target, max_depth = max_depth, max_fanout = max_fanout)
+        service_map += render_service_map(graph)
 
-                if entry[relation]['value'] == sys_id:
-                    direct_targets.append(entry[target])
-                    if 'parent.sys_class_name' in entry and entry['parent.sys_class_name'] != '':
-                        data += entry['parent.sys_class_name'] + ' '
-                    data += entry['parent.name'] + ' '
+        return service_map
 
-                    if 'parent.ip_address' in entry and entry['parent.ip_address'] != '':
-                        data += 'with IP address ' + entry['parent.ip_address'] + ' '
-                        data += entry['type.name'].split(':')[0] + ' '
+    # Nodes and edges reachable from the CIs in one direction, walked level by level
+    def get_service_map_graph(self, sys_ids, target, max_depth = None, max_fanout = None):
+        if max_depth is None:
+            max_depth = DEFAULT_MAX_DEPTH
+        if max_fanout is None:
+            max_fanout = DEFAULT_MAX_FANOUT
 
-                    if 'child.sys_class_name' in entry and entry['child.sys_class_name'] != '':
-                        data += entry['child.sys_class_name'] + ' '
-                    data += entry['child.name'] + ' '
-
-                    if 'child.ip_address' in entry and entry["child.ip_address"] != '':
-                        data += 'with IP address ' + entry['child.ip_address']
-
-                    if data.strip() != '':
-                        data += '\n'
-
-            # service_map.append({sys_id: direct_targets})
-            if data.strip() != '':
-                service_map.append(data)
-
-            for tg in direct_targets:
-                self.get_parents_children(tg['value'], target, service_map)
-
-            return service_map
-        except Exception as e:
-            print(str(e))
-            return []
+        return get_service_map_graph(self.client, self.cache, sys_ids, target, max_depth, max_fanout)
 
 
 '''
@@ -2,15 +2,18 @@
 # Created On - April 11, 2024
 
 import os
+import sys
 from pathlib import Path
 
 import chromadb
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from transformers import AutoTokenizer, AutoModel
 
 # Path to this script
 SCRIPT_PATH = Path(__file__).parent
+ROOT_PATH = str(SCRIPT_PATH.parent)
+sys.path.append(ROOT_PATH)
+
+from database.embedding_registry import get_embedding_model
 
 # Ensure Transformers works offline
 os.environ['TRANSFORMERS_OFFLINE'] = '1'
@@ -23,16 +26,8 @@ class KBManager:
         """
         model_dir = SCRIPT_PATH / "model"
 
-        # Load tokenizer and model locally
-        tokenizer = AutoTokenizer.from_pretrained(model_dir, local_files_only=True)
-        model = AutoModel.from_pretrained(model_dir, local_files_only=True)
-
-        # Initialize HuggingFaceEmbeddings with local model
-        self.em_model = HuggingFaceEmbeddings(
-            model_name=str(model_dir),
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': False}
-        )
+        # Shared HuggingFaceEmbeddings for the local model, loaded once per process
+        self.em_model = get_embedding_model(str(model_dir))
 
     def insert_documents(self, documents, kb_name='', collection_name=''):
         """
@@ -1,11 +1,20 @@
 import os
+import sys
 import datetime
 import json
-import requests
 from dotenv import load_dotenv
 
 load_dotenv()
 
+SCRIPT_PATH = os.path.dirname(__file__)
+sys.path.append(SCRIPT_PATH.split('/change_management')[0])
+
+from itsm.snow_client import get_snow_client
+from itsm.snow_batch import execute_batch, table_insert
+from itsm.snow_cache import get_snow_cache, cache_key
+from itsm.reference_data import fresh_reference_data, to_sys_id
+from itsm.records import ChangeTask
+
 
 class ServiceNowTasks:
     snow_url = os.getenv('SNOW_URL')
@@ -13,14 +22,28 @@ class ServiceNowTasks:
     snow_password = os.getenv('SNOW_PWD')
     
     headers = {'content-type': 'application/json'}
-    
+
+    def __init__(self):
+        # Pooled session shared with every other ITSM code path; without SNOW_URL in the
+        # environment, the instance and credentials come from mim_conf.json and Vault
+        if self.snow_url:
+            self.client = get_snow_client(self.snow_url, self.snow_username, self.snow_password)
+        else:
+            self.client = get_snow_client()
+            self.snow_url = self.client.snow_url
+
+        # Read-through cache shared by every client in the process
+        self.cache = get_snow_cache()
 
     def get_change_details(self, number):
+        return self.cache.cached('change_request', cache_key(self.client, 'change_details', number), lambda: self._load_change_details(number))
+
+    def _load_change_details(self, number):
         change_url = self.snow_url + '/api/now/table/change_request?number=' +number
         #task_url = self.snow_url + '/api/now/table/change_task?change_request='
 
         try:
-            change_response = requests.get(change_url, auth = (self.snow_username, self.snow_password), headers = self.headers, verify = False)
+            change_response = self.client.get(change_url)
         #print(due_date)
             data = change_response.json()['result']
             impl_plan = data[0]['implementation_plan']
@@ -51,8 +74,30 @@ class ServiceNowTasks:
         task_url = self.snow_url + '/api/now/table/change_task?number=' +number
         print(task_url)
         
+        payload = self._task_payload(short_description = short_description, sys_id = sys_id, description = description, assignment_group = assignment_group)
+
+        try:
+            response = self.client.post(task_url, data = json.dumps(payload))
+            output = {'number': response.json()['result']['number']}
+            result_value = response.json()['result']
+            output['target_link'] = self.snow_url + '/api/now/table/change_task?sys_id=' + response.json()['result']['sys_id']
+            
+            print(output['target_link'])
+        except Exception as e:
+            print(str(e))
+            output = {}
+
+        self.cache.invalidate('change_task')
+
+        #print(output)
+        return output
+
+    def _task_payload(self, short_description = "", sys_id = "", description = "", assignment_group = ""):
         payload = {}
 
+        # Send the group's sys_id when the local dictionary knows it, so the instance skips the name lookup
+        assignment_group = to_sys_id('sys_user_group', assignment_group, self.client)
+
         if short_description == "":
             payload['short_description'] = 'Change Task Creation'
             payload['change_request'] = sys_id
@@ -71,30 +116,65 @@ class ServiceNowTasks:
             #payload['cmdb_ci'] = cmdb_ci
             #payload['due_date'] = due_date
 
+        return payload
 
-        try:
-            response = requests.post(task_url, auth = (self.snow_username, self.snow_password), \
-                    data = json.dumps(payload), headers = self.headers, verify = False)
-            output = {'number': response.json()['result']['number']}
-            result_value = response.json()['result']
-            output['target_link'] = self.snow_url + '/api/now/table/change_task?sys_id=' + response.json()['result']['sys_id']
-            
-            print(output['target_link'])
-        except Exception as e:
-            print(str(e))
-            output = {}
+    # Create several change tasks in one or a few round trips, one output per task
+    def create_tasks(self, tasks, sys_id = ""):
+        items = []
+        for task in tasks:
+            payload = self._task_payload(short_description = task.get('short_description', ''), sys_id = sys_id,
+                                         description = task.get('description', ''), assignment_group = task.get('assignment_group', ''))
+            items.append(table_insert('change_task', payload))
 
-        #print(output)
-        return output
+        outputs = []
+        for result in execute_batch(self.client, items):
+            if result['error'] or not result['result']:
+                print(result['error'])
+                outputs.append({})
+                continue
+
+            output = {'number': result['result']['number']}
+            output['target_link'] = self.snow_url + '/api/now/table/change_task?sys_id=' + result['result']['sys_id']
+            outputs.append(output)
+
+        self.cache.invalidate('change_task')
+
+        return outputs
 
     def get_historical_ctasks(self, change_sys_id):
+        return self.cache.cached('change_task', cache_key(self.client, 'ctasks', change_sys_id), lambda: self._load_historical_ctasks(change_sys_id))
+
+    def _load_historical_ctasks(self, change_sys_id):
+        reference_data = fresh_reference_data(self.client)
+
+        # Raw group sys_ids are named from the local dictionary instead of dot-walking on the instance
+        if reference_data is not None:
+            ctask_url = self.snow_url + '/api/now/table/change_task?change_request=' + change_sys_id + \
+                        '&sysparm_fields=number,short_description,assignment_group&sysparm_display_value=false&sysparm_exclude_reference_link=true'
+
+            try:
+                ctask_response = self.client.get(ctask_url)
+                data = ctask_response.json()['result']
+
+                names = [reference_data.name_for('sys_user_group', ctask.get('assignment_group')) for ctask in data]
+                if all([name is not None or not ctask.get('assignment_group') for (ctask, name) in zip(data, names)]):
+                    for (ctask, name) in zip(data, names):
+                        ctask['assignment_group.name'] = name or ''
+                        ctask.pop('assignment_group', None)
+
+                    return [ChangeTask.from_dict(ctask) for ctask in data]
+
+            # Fall through to the dot-walked read
+            except Exception as e:
+                print(str(e))
+
         ctask_url =  self.snow_url + '/api/now/table/change_task?change_request=' +change_sys_id+'&sysparm_fields=number,short_description,assignment_group.name'
 
-    
+        data = []
         try:
-            ctask_response = requests.get(ctask_url, auth = (self.snow_username, self.snow_password), headers = self.headers, verify = False)
+            ctask_response = self.client.get(ctask_url)
         #print(due_date)
-            data = ctask_response.json()['result'] 
+            data = [ChangeTask.from_dict(ctask) for ctask in ctask_response.json()['result']]
 
             #print("\n",str(ctask_result))
             #print(f"{data[0]['sys_id']}\n")
@@ -22,7 +22,7 @@ from vertexai.generative_models import HarmBlockThreshold, HarmCategory
 from llm_app.configuration import config
 
 
-#from vault import Vault
+#from vault import get_vault
 
 # VertexAI - Google Gemini
 # Safety settings for VertexAI
@@ -54,7 +54,7 @@ LLM_PATH = ROOT_PATH + "/llm_app/"
 print(LLM_PATH)
 sys.path.append(LLM_PATH)
 sys.path.append(ROOT_PATH)
-from vault import Vault
+from vault import get_vault
 
 from configuration import config
 
@@ -89,10 +89,6 @@ app_conf_file.close()
 # Initiate vault
 vault_path = SCRIPT_PATH + "/config/.vault_token"
 
-vault_file = open(vault_path, "r")
-vault_token = vault_file.read().strip()
-vault_file.close()
-
 vault_url = app_conf["vault_url"]
 
 # Initiate assistant agent
@@ -156,13 +152,9 @@ generic_agent = ConversableAgent(
 def chat_with_llm(prompt, history_list, username = ""):
     cred_details = ""
     if username != "":
-        vault_session = Vault(vault_url, vault_token)
-        secrets = vault_session.list_secrets("/")
-
-        allowed_secrets = []
-        for secret in secrets:
-            if secret.startswith(username):
-                allowed_secrets.append(secret)
+        # Secret names are indexed by prefix and the user's secrets read concurrently, mostly from the cache
+        credentials = get_vault(vault_url, vault_path).credential_catalogue().credentials(username)
+        allowed_secrets = [user_path for (user_path, creds) in credentials]
 
         '''
         if allowed_secrets != []:
@@ -182,8 +174,7 @@ def chat_with_llm(prompt, history_list, username = ""):
         if allowed_secrets != []:
             cred_details += "\n********Here are credentials if required. Choose relevant for relevant actions********"
 
-        for user_path in allowed_secrets:
-            (status, creds) = vault_session.retrieve_secret(user_path)
+        for (user_path, creds) in credentials:
             purpose = user_path.split(username + "_")[-1].strip()
             if purpose == "":
                 cred_details += "\n\nUser credentials - "
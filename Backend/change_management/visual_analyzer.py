@@ -30,6 +30,9 @@ LLM_PATH = ROOT_PATH + "/llm_app/"
 print(LLM_PATH)
 sys.path.append(LLM_PATH)
 sys.path.append(ROOT_PATH)
+
+BACKEND_PATH = SCRIPT_PATH.split("/change_management")[0]
+sys.path.append(BACKEND_PATH)
 from vault import Vault
 
 from configuration import config
@@ -0,0 +1,336 @@
+import os
+import sys
+import json
+import time
+import array
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/database')[0]
+sys.path.append(ROOT_PATH)
+
+# Cache defaults, overridable from mim_conf.json
+DEFAULT_CACHE_PATH = SCRIPT_PATH + '/embedding_cache.sqlite3'
+DEFAULT_MEMORY_MB = 64
+DEFAULT_DISK_MB = 1024
+
+# Disk tier is trimmed to this share of its limit, so eviction does not run on every write
+DISK_EVICT_TARGET = 0.9
+
+# SQLite bound-parameter limit per lookup
+LOOKUP_CHUNK = 500
+
+# A disk hit only rewrites last_used once it is older than this, in seconds
+LAST_USED_RESOLUTION = 60
+
+
+def normalize_text(text):
+    """Unicode NFC with runs of whitespace collapsed, so cosmetic differences share a cache entry."""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def cache_key(model_id, kind, text):
+    return hashlib.sha256('\0'.join([model_id, kind, normalize_text(text)]).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+        Two-tier store of embeddings keyed by model id, query/document kind and
+        a hash of the normalized text.
+
+        The first tier is an in-process LRU capped at memory_mb. The second is a
+        SQLite file of float32 blobs capped at disk_mb, shared by every worker
+        and kept across restarts; once it grows past the cap the least recently
+        used rows are deleted. A disk hit is promoted to memory. Disk errors are
+        reported and treated as misses.
+    """
+    def __init__(self, path = DEFAULT_CACHE_PATH, memory_mb = DEFAULT_MEMORY_MB, disk_mb = DEFAULT_DISK_MB):
+        self.path = path
+        self.memory_bytes = int(memory_mb * 1024 * 1024)
+        self.disk_bytes = int(disk_mb * 1024 * 1024)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_used = 0
+        self._local = threading.local()
+
+        self._stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'memory_evictions': 0, 'disk_evictions': 0,
+                       'disk_errors': 0}
+
+        self._disk_used = None
+        if self.disk_bytes:
+            try:
+                with self.connection() as conn:
+                    conn.execute('PRAGMA journal_mode=WAL')
+                    conn.execute('''
+                        CREATE TABLE IF NOT EXISTS embeddings (
+                            key TEXT PRIMARY KEY,
+                            model TEXT,
+                            vector BLOB,
+                            bytes INTEGER,
+                            last_used REAL
+                        )
+                    ''')
+                    conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used_idx ON embeddings (last_used)')
+                self._disk_used = self._disk_size()
+            except Exception as e:
+                print(f"Embedding disk cache disabled - {str(e)}")
+                self.disk_bytes = 0
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout = 30)
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+
+        return conn
+
+    def _disk_size(self):
+        return self.connection().execute('SELECT COALESCE(SUM(bytes), 0) FROM embeddings').fetchone()[0]
+
+    def _remember(self, key, vector):
+        size = vector.itemsize * len(vector)
+        if size > self.memory_bytes:
+            return
+
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_used -= previous.itemsize * len(previous)
+
+            self._memory[key] = vector
+            self._memory_used += size
+
+            while self._memory_used > self.memory_bytes:
+                (_, evicted) = self._memory.popitem(last = False)
+                self._memory_used -= evicted.itemsize * len(evicted)
+                self._stats['memory_evictions'] += 1
+
+    def _disk_get(self, keys):
+        found = {}
+        if not self.disk_bytes or not keys:
+            return found
+
+        now = time.time()
+        stale = []
+
+        try:
+            conn = self.connection()
+            for ind in range(0, len(keys), LOOKUP_CHUNK):
+                chunk = keys[ind:ind + LOOKUP_CHUNK]
+                rows = conn.execute(f"SELECT key, vector, last_used FROM embeddings WHERE key IN ({', '.join(['?'] * len(chunk))})",
+                                    chunk).fetchall()
+                for (key, blob, last_used) in rows:
+                    vector = array.array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector
+
+                    if (last_used or 0) < now - LAST_USED_RESOLUTION:
+                        stale.append(key)
+
+            # Eviction order only needs last_used to the minute, so hot keys are not rewritten on every read
+            if stale:
+                with conn:
+                    conn.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?', [(now, key) for key in stale])
+
+        except Exception as e:
+            print(f"Embedding disk cache read failed - {str(e)}")
+            with self._lock:
+                self._stats['disk_errors'] += 1
+
+        return found
+
+    def _disk_put(self, model_id, items):
+        if not self.disk_bytes or not items:
+            return
+
+        now = time.time()
+        rows = [(key, model_id, vector.tobytes(), vector.itemsize * len(vector), now) for (key, vector) in items]
+
+        try:
+            # Rows that are only replaced give back the bytes they held
+            replaced = 0
+            with self.connection() as conn:
+                for ind in range(0, len(rows), LOOKUP_CHUNK):
+                    chunk = [row[0] for row in rows[ind:ind + LOOKUP_CHUNK]]
+                    replaced += conn.execute(f"SELECT COALESCE(SUM(bytes), 0) FROM embeddings WHERE key IN ({', '.join(['?'] * len(chunk))})",
+                                             chunk).fetchone()[0]
+
+                conn.executemany('INSERT OR REPLACE INTO embeddings (key, model, vector, bytes, last_used) VALUES (?, ?, ?, ?, ?)', rows)
+
+            with self._lock:
+                self._disk_used += sum([row[3] for row in rows]) - replaced
+                over = self._disk_used > self.disk_bytes
+
+            if over:
+                self._evict_disk()
+
+        except Exception as e:
+            print(f"Embedding disk cache write failed - {str(e)}")
+            with self._lock:
+                self._stats['disk_errors'] += 1
+
+    def _evict_disk(self):
+        conn = self.connection()
+
+        # Other workers write to the same file, so measure instead of trusting the running total
+        used = self._disk_size()
+        excess = used - int(self.disk_bytes * DISK_EVICT_TARGET)
+
+        keys = []
+        if excess > 0:
+            for (key, size) in conn.execute('SELECT key, bytes FROM embeddings ORDER BY last_used'):
+                keys.append(key)
+                excess -= size
+                if excess <= 0:
+                    break
+
+            with conn:
+                conn.executemany('DELETE FROM embeddings WHERE key = ?', [(key,) for key in keys])
+
+        with self._lock:
+            self._disk_used = self._disk_size()
+            self._stats['disk_evictions'] += len(keys)
+
+    def get_many(self, keys):
+        """{key: float32 array} for the keys held in either tier."""
+        found = {}
+        missing = []
+
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self._stats['memory_hits'] += len(found)
+
+        from_disk = self._disk_get(missing)
+        for (key, vector) in from_disk.items():
+            self._remember(key, vector)
+        found.update(from_disk)
+
+        with self._lock:
+            self._stats['disk_hits'] += len(from_disk)
+            self._stats['misses'] += len(missing) - len(from_disk)
+
+        return found
+
+    def put_many(self, model_id, items):
+        """Stores [(key, embedding)] in both tiers."""
+        items = [(key, array.array('f', embedding)) for (key, embedding) in items]
+
+        for (key, vector) in items:
+            self._remember(key, vector)
+
+        self._disk_put(model_id, items)
+
+    def clear(self, model_id = None):
+        """Drops the memory tier and the disk rows of one model, or of every model."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_used = 0
+
+        if self.disk_bytes:
+            with self.connection() as conn:
+                if model_id is None:
+                    conn.execute('DELETE FROM embeddings')
+                else:
+                    conn.execute('DELETE FROM embeddings WHERE model = ?', (model_id,))
+
+            with self._lock:
+                self._disk_used = self._disk_size()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+
+            stats.update(
+                lookups = lookups,
+                hit_ratio = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 3) if lookups else None,
+                memory_entries = len(self._memory),
+                memory_mb = round(self._memory_used / 1024 / 1024, 2),
+                memory_limit_mb = round(self.memory_bytes / 1024 / 1024, 2),
+                disk_mb = round(self._disk_used / 1024 / 1024, 2) if self._disk_used is not None else None,
+                disk_limit_mb = round(self.disk_bytes / 1024 / 1024, 2),
+                path = self.path if self.disk_bytes else None
+            )
+
+        return stats
+
+
+class CachedEmbeddings(Embeddings):
+    """
+        Embeddings wrapper that serves repeated texts from an EmbeddingCache
+        and sends only the misses, deduplicated, to the wrapped model.
+    """
+    def __init__(self, model, model_id, cache):
+        self.model = model
+        self.model_id = model_id
+        self.cache = cache
+
+    def embed_documents(self, texts):
+        keys = [cache_key(self.model_id, 'document', text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        pending = OrderedDict()
+        for (key, text) in zip(keys, texts):
+            if key not in found and key not in pending:
+                pending[key] = text
+
+        if pending:
+            embeddings = self.model.embed_documents(list(pending.values()))
+            computed = list(zip(pending.keys(), embeddings))
+            self.cache.put_many(self.model_id, computed)
+
+            found.update(computed)
+
+        return [list(found[key]) for key in keys]
+
+    def embed_query(self, text):
+        key = cache_key(self.model_id, 'query', text)
+
+        found = self.cache.get_many([key])
+        if key in found:
+            return list(found[key])
+
+        embedding = self.model.embed_query(text)
+        self.cache.put_many(self.model_id, [(key, embedding)])
+
+        return embedding
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache():
+    global _embedding_cache
+
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            try:
+                with open(ROOT_PATH + '/config/mim_conf.json', 'r') as mim_conf_file:
+                    mim_conf = json.load(mim_conf_file)
+            except Exception:
+                mim_conf = {}
+
+            _embedding_cache = EmbeddingCache(path = mim_conf.get('embedding_cache_path') or DEFAULT_CACHE_PATH,
+                                              memory_mb = mim_conf.get('embedding_cache_memory_mb', DEFAULT_MEMORY_MB),
+                                              disk_mb = mim_conf.get('embedding_cache_disk_mb', DEFAULT_DISK_MB))
+
+        return _embedding_cache
+
+
+def embedding_cache_stats():
+    return get_embedding_cache().stats()
@@ -0,0 +1,167 @@
+import os
+import sys
+import json
+import time
+import threading
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/database')[0]
+sys.path.append(ROOT_PATH)
+
+from database.embedding_cache import CachedEmbeddings, get_embedding_cache
+
+# Models loaded at startup, relative to the Backend root; overridable from mim_conf.json
+DEFAULT_MODEL_PATH = ROOT_PATH + '/model'
+DEFAULT_STARTUP_MODELS = ['model', 'change_management/model']
+DEFAULT_DEVICE = 'cpu'
+
+WARM_UP_TEXT = 'Warm-up query for the embedding model'
+
+
+class CustomError(Exception):
+    """Custom exception for application-specific errors."""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def _load_mim_conf():
+    try:
+        with open(ROOT_PATH + '/config/mim_conf.json', 'r') as mim_conf_file:
+            return json.load(mim_conf_file)
+    except Exception:
+        return {}
+
+
+class EmbeddingRegistry:
+    """
+        One HuggingFaceEmbeddings instance per model directory for the whole
+        process.
+
+        get() loads a model on first use and runs a warm-up encode before
+        handing it out, so the first real query does not pay for lazy
+        initialisation; concurrent callers wait for the same load.
+        start_warm_up() does this for the startup models on a background thread,
+        and status() reports each model's state for the readiness probe. With
+        cache set, models are handed out wrapped in CachedEmbeddings.
+    """
+    def __init__(self, device = DEFAULT_DEVICE, startup_models = DEFAULT_STARTUP_MODELS, cache = None):
+        self.device = device
+        self.cache = cache
+        self.startup_models = [self._resolve(path) for path in startup_models]
+
+        self._lock = threading.Lock()
+        self._models = {}
+        self._loading = {}
+        self._status = {}
+        self._thread = None
+
+    def _resolve(self, model_path):
+        if not os.path.isabs(model_path):
+            model_path = os.path.join(ROOT_PATH, model_path)
+
+        return os.path.realpath(model_path)
+
+    def _load(self, model_path):
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        started = time.monotonic()
+        model = HuggingFaceEmbeddings(model_name = model_path,
+                                      model_kwargs = {'device': self.device},
+                                      encode_kwargs = {'normalize_embeddings': False})
+        loaded = time.monotonic()
+
+        dimension = len(model.embed_query(WARM_UP_TEXT))
+
+        # Cache entries are scoped to the model directory
+        if self.cache is not None:
+            model = CachedEmbeddings(model, model_path, self.cache)
+
+        return (model, {'state': 'ready', 'dimension': dimension, 'load_s': round(loaded - started, 3),
+                        'warm_up_s': round(time.monotonic() - loaded, 3), 'loaded_at': time.time()})
+
+    def get(self, model_path = DEFAULT_MODEL_PATH):
+        model_path = self._resolve(model_path)
+
+        with self._lock:
+            model = self._models.get(model_path)
+            if model is not None:
+                return model
+
+            # The first caller loads; the rest wait on its event
+            loading = self._loading.get(model_path)
+            if loading is None:
+                loading = self._loading[model_path] = threading.Event()
+                self._status[model_path] = {'state': 'loading'}
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            loading.wait()
+            with self._lock:
+                model = self._models.get(model_path)
+                if model is None:
+                    raise CustomError(f'Error: Unable to load embedding model {model_path} - {self._status[model_path].get("error")}')
+                return model
+
+        try:
+            (model, status) = self._load(model_path)
+        except Exception as e:
+            with self._lock:
+                self._status[model_path] = {'state': 'failed', 'error': str(e)}
+                del self._loading[model_path]
+            loading.set()
+            raise CustomError(f'Error: Unable to load embedding model {model_path} - {str(e)}')
+
+        with self._lock:
+            self._models[model_path] = model
+            self._status[model_path] = status
+            del self._loading[model_path]
+        loading.set()
+
+        return model
+
+    def warm_up(self):
+        for model_path in self.startup_models:
+            try:
+                self.get(model_path)
+            except Exception as e:
+                print(f"Embedding model warm-up failed - {str(e)}")
+
+    def start_warm_up(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target = self.warm_up, name = 'embedding-warm-up', daemon = True)
+                self._thread.start()
+
+        return self._thread
+
+    def status(self):
+        with self._lock:
+            models = {path: dict(self._status.get(path, {'state': 'pending'})) for path in self.startup_models}
+            for (path, status) in self._status.items():
+                models.setdefault(path, dict(status))
+
+        return {'ready': all([models[path]['state'] == 'ready' for path in self.startup_models]), 'models': models}
+
+
+_embedding_registry = None
+_embedding_registry_lock = threading.Lock()
+
+
+def get_embedding_registry():
+    global _embedding_registry
+
+    with _embedding_registry_lock:
+        if _embedding_registry is None:
+            mim_conf = _load_mim_conf()
+            _embedding_registry = EmbeddingRegistry(device = mim_conf.get('embedding_device', DEFAULT_DEVICE),
+                                                    startup_models = mim_conf.get('embedding_startup_models', DEFAULT_STARTUP_MODELS),
+                                                    cache = get_embedding_cache() if mim_conf.get('embedding_cache_enabled', True) else None)
+
+        return _embedding_registry
+
+
+def get_embedding_model(model_path = DEFAULT_MODEL_PATH):
+    return get_embedding_registry().get(model_path)
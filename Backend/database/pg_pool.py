@@ -0,0 +1,292 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+from contextlib import contextmanager
+
+import psycopg2
+import psycopg2.extensions
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/database')[0]
+sys.path.append(ROOT_PATH)
+
+from vault import get_vault
+
+# Pool defaults, overridable from mim_conf.json
+DEFAULT_MIN_SIZE = 1
+DEFAULT_MAX_SIZE = 10
+DEFAULT_ACQUIRE_TIMEOUT = 30
+DEFAULT_CHECK_IDLE = 60
+DEFAULT_STATEMENT_TIMEOUT_MS = 60000
+
+# Seconds pool settings (and the Vault credentials in them) are reused before being read again
+DEFAULT_SETTINGS_TTL = 60
+
+
+class CustomError(Exception):
+    """Custom exception for application-specific errors."""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+def _load_mim_conf():
+    with open(ROOT_PATH + '/config/mim_conf.json', 'r') as mim_conf_file:
+        return json.load(mim_conf_file)
+
+
+def pool_settings(mim_conf = None):
+    """Connection arguments and pool sizing for the PostgreSQL database named in mim_conf.json."""
+    mim_conf = mim_conf or _load_mim_conf()
+
+    db_name = mim_conf['pg_db_name']
+    db_creds = get_vault(mim_conf['vault_url']).retrieve_secret(db_name)
+
+    db_username = None
+    db_password = None
+    if db_creds[0]:
+        for k, v in db_creds[1].items():
+            db_username = k
+            db_password = v
+
+    statement_timeout = mim_conf.get('pg_statement_timeout_ms', DEFAULT_STATEMENT_TIMEOUT_MS)
+
+    return {
+        'connect': {
+            'dbname': db_name,
+            'user': db_username,
+            'password': db_password,
+            'host': mim_conf['pg_db_host'],
+            'port': mim_conf['pg_db_port'],
+            # Applied server-side to every statement on pooled connections; 0 disables it
+            'options': f'-c statement_timeout={int(statement_timeout)}'
+        },
+        'min_size': mim_conf.get('pg_pool_min_size', DEFAULT_MIN_SIZE),
+        'max_size': mim_conf.get('pg_pool_max_size', DEFAULT_MAX_SIZE),
+        'timeout': mim_conf.get('pg_pool_timeout', DEFAULT_ACQUIRE_TIMEOUT),
+        'check_idle': mim_conf.get('pg_pool_check_idle', DEFAULT_CHECK_IDLE),
+        'settings_ttl': mim_conf.get('pg_pool_settings_ttl', DEFAULT_SETTINGS_TTL)
+    }
+
+
+def _settings_key(settings):
+    connect = settings['connect']
+    secret = hashlib.sha256((connect['password'] or '').encode('utf-8')).hexdigest()
+
+    return (connect['host'], str(connect['port']), connect['dbname'], connect['user'], secret, connect['options'])
+
+
+class PgPool:
+    """
+        Process-wide pool of psycopg2 connections.
+
+        getconn() blocks up to timeout seconds for a free slot once max_size
+        connections are checked out, instead of failing at once like
+        ThreadedConnectionPool. Returned connections stay open for reuse, most
+        recently used first. A connection idle for longer than check_idle
+        seconds is pinged before it is handed out and replaced if the ping
+        fails. putconn() rolls back any open transaction so the next borrower
+        starts clean. stats() reports saturation and wait times.
+    """
+    def __init__(self, connect, min_size = DEFAULT_MIN_SIZE, max_size = DEFAULT_MAX_SIZE, timeout = DEFAULT_ACQUIRE_TIMEOUT,
+                 check_idle = DEFAULT_CHECK_IDLE):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.check_idle = check_idle
+
+        self._slots = threading.BoundedSemaphore(self.max_size)
+        self._lock = threading.Lock()
+        self._retired = False
+
+        # (connection, returned at) of the connections not checked out, oldest first
+        self._idle = [(psycopg2.connect(**connect), None) for ind in range(min(min_size, self.max_size))]
+
+        self._stats = {'acquired': 0, 'waiting': 0, 'in_use': 0, 'peak_in_use': 0, 'timeouts': 0, 'discarded': 0,
+                       'wait_ms_total': 0.0, 'wait_ms_max': 0.0}
+
+    def _healthy(self, conn, returned_at):
+        if conn.closed:
+            return False
+
+        # Just opened, or used recently enough to trust
+        if returned_at is None or time.monotonic() - returned_at < self.check_idle:
+            return True
+
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except Exception:
+            return False
+
+    def _checkout(self):
+        while True:
+            with self._lock:
+                (conn, returned_at) = self._idle.pop() if self._idle else (None, None)
+
+            if conn is None:
+                return psycopg2.connect(**self.connect)
+
+            if self._healthy(conn, returned_at):
+                return conn
+
+            # Dead server-side (restart, idle timeout, network); drop it and try the next one
+            with self._lock:
+                self._stats['discarded'] += 1
+            conn.close()
+
+    def getconn(self):
+        started = time.monotonic()
+
+        with self._lock:
+            self._stats['waiting'] += 1
+
+        acquired = self._slots.acquire(timeout = self.timeout)
+        waited_ms = (time.monotonic() - started) * 1000
+
+        with self._lock:
+            self._stats['waiting'] -= 1
+            self._stats['wait_ms_total'] += waited_ms
+            self._stats['wait_ms_max'] = max(self._stats['wait_ms_max'], waited_ms)
+            if not acquired:
+                self._stats['timeouts'] += 1
+
+        if not acquired:
+            raise CustomError(f'Error: No database connection free after {self.timeout}s ({self.max_size} in use)')
+
+        try:
+            conn = self._checkout()
+        except Exception as e:
+            self._slots.release()
+            raise CustomError(f'Error: Unable to open database connection - {str(e)}')
+
+        with self._lock:
+            self._stats['acquired'] += 1
+            self._stats['in_use'] += 1
+            self._stats['peak_in_use'] = max(self._stats['peak_in_use'], self._stats['in_use'])
+
+        return conn
+
+    def putconn(self, conn):
+        close = conn.closed
+
+        if not close and conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except Exception:
+                close = True
+
+        with self._lock:
+            self._stats['in_use'] -= 1
+
+            close = close or self._retired
+            if not close:
+                self._idle.append((conn, time.monotonic()))
+
+        try:
+            if close:
+                conn.close()
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        conn = self.getconn()
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def retire(self):
+        """Close idle connections now and the rest as they are returned."""
+        with self._lock:
+            self._retired = True
+            (idle, self._idle) = (self._idle, [])
+
+        for (conn, returned_at) in idle:
+            conn.close()
+
+    def close(self):
+        self.retire()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            idle = len(self._idle)
+
+        stats.update(
+            min_size = self.min_size,
+            max_size = self.max_size,
+            idle = idle,
+            saturation = round(stats['in_use'] / self.max_size, 3),
+            wait_ms_avg = round(stats['wait_ms_total'] / stats['acquired'], 2) if stats['acquired'] else None,
+            wait_ms_total = round(stats['wait_ms_total'], 2),
+            wait_ms_max = round(stats['wait_ms_max'], 2)
+        )
+
+        return stats
+
+
+_pg_pool = None
+_pg_pool_key = None
+_pg_pool_settings = None
+_pg_pool_settings_at = None
+_pg_pool_lock = threading.Lock()
+
+
+# pool_settings() reused for settings_ttl seconds, so a rotated password is still noticed
+def _cached_pool_settings():
+    global _pg_pool_settings, _pg_pool_settings_at
+
+    with _pg_pool_lock:
+        if _pg_pool_settings is not None and time.monotonic() - _pg_pool_settings_at < _pg_pool_settings['settings_ttl']:
+            return _pg_pool_settings
+
+    # mim_conf.json and Vault are read outside the lock, so pool lookups never wait behind them
+    settings = pool_settings()
+
+    with _pg_pool_lock:
+        (_pg_pool_settings, _pg_pool_settings_at) = (settings, time.monotonic())
+
+    return settings
+
+
+def get_pg_pool():
+    """Shared PgPool; rebuilt (and the old one retired) when the Vault credentials change."""
+    global _pg_pool, _pg_pool_key
+
+    settings = _cached_pool_settings()
+    key = _settings_key(settings)
+
+    with _pg_pool_lock:
+        if _pg_pool is not None and _pg_pool_key == key:
+            return _pg_pool
+
+        previous = _pg_pool
+        _pg_pool = PgPool(settings['connect'], min_size = settings['min_size'], max_size = settings['max_size'],
+                          timeout = settings['timeout'], check_idle = settings['check_idle'])
+        _pg_pool_key = key
+
+    if previous is not None:
+        previous.retire()
+
+    return _pg_pool
+
+
+def pg_pool_stats():
+    return _pg_pool.stats() if _pg_pool is not None else None
+
+
+def close_pg_pools():
+    global _pg_pool
+
+    with _pg_pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.close()
+            _pg_pool = None
@@ -3,9 +3,8 @@
 
 import os 
 import json
-import psycopg2
 import traceback
-from vault import Vault
+from database.pg_pool import get_pg_pool
 
 SCRIPT_PATH = os.path.dirname(__file__)
 
@@ -17,56 +16,13 @@ class CustomError(Exception):
 
 class SQLDatabase:
     def __init__(self):
-        #Fetch Credentials from Vault
-        mim_conf_path = SCRIPT_PATH.split('/database')[0] + '/config/mim_conf.json'
-
-        mim_conf_file = open(mim_conf_path, 'r')
-        mim_conf = json.load(mim_conf_file)
-        mim_conf_file.close()
-
-        # Initiate vault
-        vault_path = SCRIPT_PATH.split('/database')[0] + '/config/.vault_token'
-
-        vault_file = open(vault_path, 'r')
-        vault_token = vault_file.read().strip()
-        vault_file.close()
-
-        vault_url = mim_conf['vault_url']
-        self.vault_session = Vault(vault_url, vault_token)
-
-        # Fetch Database credentials
-        db_name = mim_conf['pg_db_name']
-        db_host = mim_conf['pg_db_host']
-        db_port = mim_conf['pg_db_port']
-
-        db_creds = self.vault_session.retrieve_secret(db_name)
-        if db_creds[0]:
-            for k, v in db_creds[1].items():
-                db_username = k
-                db_password = v
-        else:
-            db_username = None
-            db_password = None
-
         try:
-            # Establish database connection
-            self.connection = psycopg2.connect(
-                dbname = db_name,
-                user = db_username,
-                password = db_password,
-                host = db_host,
-                port = db_port
-            )
-
-            # self.cursor = self.connection.cursor()
+            # Connections are borrowed from the shared pool per operation
+            self.pool = get_pg_pool()
 
         except Exception as e:
             raise CustomError(str(e))
 
-    def __del__(self):
-        # self.cursor.close()
-        self.connection.close()
-
     # Retrieve required data from database table
     def retrieve_data(self, table_name, columns = [], conditions = []):
             
@@ -83,15 +39,17 @@ class SQLDatabase:
             query += ' WHERE ' + conditional_query
      
         # Execute query on database and obtain output
-        cursor = self.connection.cursor()
         try:
-            if params == []:
-                cursor.execute(query)
-            else:
-                cursor.execute(query, params)
-
-            data = cursor.fetchall()
-            cursor.close()
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                if params == []:
+                    cursor.execute(query)
+                else:
+                    cursor.execute(query, params)
+
+                data = cursor.fetchall()
+                cursor.close()
+                connection.commit()
             return data
 
         except Exception as e:
@@ -109,18 +67,19 @@ class SQLDatabase:
         for key in data[0]:
             values.append('%(' + key + ')s')
         query += ', '.join(values) + ')'
-        cursor = self.connection.cursor()
 
         # Execute a query on database
         try:
-            cursor.executemany(query, data)
-            self.connection.commit()
-            row_count = cursor.rowcount
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.executemany(query, data)
+                connection.commit()
+                row_count = cursor.rowcount
+                cursor.close()
         except Exception as e:
             traceback.print_exc()
-            CustomError(str(e))
+            raise CustomError(str(e))
 
-        cursor.close()
         return row_count
 
     # Update entries from database table
@@ -137,16 +96,17 @@ class SQLDatabase:
         print(query)
         # Execute query on database
         try:
-            cursor = self.connection.cursor()
-            cursor.execute(query, [update_val] + params)
-            self.connection.commit()
-            row_count = cursor.rowcount
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(query, [update_val] + params)
+                connection.commit()
+                row_count = cursor.rowcount
 
-            cursor.close()
+                cursor.close()
             return row_count
 
         except Exception as e:
-            CustomError(str(e))
+            raise CustomError(str(e))
 
         
 
@@ -161,15 +121,16 @@ class SQLDatabase:
             query += ' WHERE ' + conditional_query
 
         # Execute query on database
-        cursor = self.connection.cursor()
         try:
-            cursor.execute(query, params)
-            self.connection.commit()
-            row_count = cursor.rowcount
-        except Exception:
-            CustomError(str(e))
+            with self.pool.connection() as connection:
+                cursor = connection.cursor()
+                cursor.execute(query, params)
+                connection.commit()
+                row_count = cursor.rowcount
+                cursor.close()
+        except Exception as e:
+            raise CustomError(str(e))
 
-        cursor.close()
         return row_count
 
     # Handle parameterised conditions
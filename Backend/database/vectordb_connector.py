@@ -1,20 +1,36 @@
 import sys
 import os
 import json
+import threading
 
-import psycopg2
+from psycopg2.extras import execute_values
+from concurrent.futures import ThreadPoolExecutor
 
 import traceback
 
 
-from langchain_huggingface import HuggingFaceEmbeddings
-
-
-
 SCRIPT_PATH = os.path.dirname(__file__)
 ROOT_PATH=SCRIPT_PATH.split('/database')[0]
 sys.path.append(ROOT_PATH)
-from vault import Vault
+from database.pg_pool import get_pg_pool
+from database.embedding_registry import get_embedding_model
+
+# insert_data defaults, overridable from mim_conf.json
+DEFAULT_EMBED_BATCH_SIZE = 256
+DEFAULT_COMMIT_ROWS = 5000
+
+# ANN index defaults, overridable from mim_conf.json (pgvector's own defaults where it has one)
+INDEX_METHODS = ('hnsw', 'ivfflat')
+DEFAULT_INDEX_METHOD = 'hnsw'
+DEFAULT_HNSW_M = 16
+DEFAULT_HNSW_EF_CONSTRUCTION = 64
+DEFAULT_HNSW_EF_SEARCH = 40
+DEFAULT_IVFFLAT_LISTS = 0
+DEFAULT_IVFFLAT_PROBES = 10
+
+# Collections whose ANN index is built at startup, overridable from mim_conf.json
+DEFAULT_INDEX_COLLECTIONS = ['kb_articles']
+
 class CustomError(Exception):
     """Custom exception for application-specific errors."""
     def __init__(self, message):
@@ -31,59 +47,36 @@ class VectorDatabase:
         mim_conf = json.load(mim_conf_file)
         mim_conf_file.close()
 
-        # Initiate vault
-        vault_path = SCRIPT_PATH.split('/database')[0] + '/config/.vault_token'
-
-        vault_file = open(vault_path, 'r')
-        vault_token = vault_file.read().strip()
-        vault_file.close()
-
-        vault_url = mim_conf['vault_url']
-        self.vault_session = Vault(vault_url, vault_token)
-
-        # Establish database session
-        db_name = mim_conf['pg_db_name']
-        db_host = mim_conf['pg_db_host']
-        db_port = mim_conf['pg_db_port']
+        # Collection settings
         self.dimention = mim_conf['vector_dimention']
         self.similarity_threshould = mim_conf['kb_similarity_threshold_score']
 
-        db_creds = self.vault_session.retrieve_secret(db_name)
+        # insert_data batching: texts per embed_documents call, rows per transaction
+        self.embed_batch_size = mim_conf.get('vector_embed_batch_size', DEFAULT_EMBED_BATCH_SIZE)
+        self.commit_rows = mim_conf.get('vector_commit_rows', DEFAULT_COMMIT_ROWS)
 
-        if db_creds[0]:
-            for k, v in db_creds[1].items():
-                db_username = k
-                db_password = v
-        else:
-            db_username = None
-            db_password = None
+        # ANN index build and search parameters; ivfflat lists 0 sizes the index from the row count
+        self.index_method = mim_conf.get('vector_index_method', DEFAULT_INDEX_METHOD)
+        self.hnsw_m = mim_conf.get('vector_hnsw_m', DEFAULT_HNSW_M)
+        self.hnsw_ef_construction = mim_conf.get('vector_hnsw_ef_construction', DEFAULT_HNSW_EF_CONSTRUCTION)
+        self.hnsw_ef_search = mim_conf.get('vector_hnsw_ef_search', DEFAULT_HNSW_EF_SEARCH)
+        self.ivfflat_lists = mim_conf.get('vector_ivfflat_lists', DEFAULT_IVFFLAT_LISTS)
+        self.ivfflat_probes = mim_conf.get('vector_ivfflat_probes', DEFAULT_IVFFLAT_PROBES)
+        self.index_collections = mim_conf.get('vector_index_collections', DEFAULT_INDEX_COLLECTIONS)
+        self._indexed = set()
 
         #Embeddings, these are necessary to vectorize the text and store in database
-        encode_kwargs = {'normalize_embeddings': False}
-        model_kwargs = {'device': 'cpu'}
         try:
-            self.em_model = HuggingFaceEmbeddings(model_name = ROOT_PATH + "/model",
-                                                model_kwargs = model_kwargs,
-                                                encode_kwargs = encode_kwargs)
-            
+            # Loaded once per process and shared with every other user of the model
+            self.em_model = get_embedding_model(ROOT_PATH + "/model")
 
-            self.connection = psycopg2.connect(
-                dbname = db_name,
-                user = db_username,
-                password = db_password,
-                host = db_host,
-                port = db_port
-            )
-
-            self.cursor = self.connection.cursor()
+            # Connections are borrowed from the shared pool per operation, so a long-lived
+            # object never holds one the pool has not health-checked
+            self.pool = get_pg_pool()
 
         except Exception as e:
             raise CustomError(str(e))
 
-    def __del__(self):
-        self.cursor.close()
-        self.connection.close()
-
     def ensure_collection_exists(self, collection):
         """
             Ensures that a collection (table) exists in the PostgreSQL vector database.
@@ -99,42 +92,149 @@ class VectorDatabase:
                     - 'embedding': A vector column with the specified dimension.
                     - 'metadata': A JSONB column to store associated metadata.
                 - Commits the changes to the database if a new table is created.
+                - Does not build the ANN index, which is left to ensure_vector_index from the
+                  vector_index route, startup or the ingest CLI.
             """
-        output = {}
-        # Check if the table exists
-        try:
-            self.cursor.execute("""
-                SELECT EXISTS (
-                    SELECT FROM information_schema.tables 
-                    WHERE table_name = %s
-                );
-            """, (collection,))
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            # Check if the table exists
+            try:
+                cursor.execute("""
+                    SELECT EXISTS (
+                        SELECT FROM information_schema.tables 
+                        WHERE table_name = %s
+                    );
+                """, (collection,))
 
-            exists = self.cursor.fetchone()[0]
+                exists = cursor.fetchone()[0]
 
-        except Exception as e:
-            raise CustomError(f'Error: Unable to ensure the exsistance of collection {collection} - {str(e)}')
+            except Exception as e:
+                raise CustomError(f'Error: Unable to ensure the exsistance of collection {collection} - {str(e)}')
+
+            # Create the table if it doesn't exist
+            if not exists:
+                try:
+                    cursor.execute(f"""
+                        CREATE TABLE {collection} (
+                            id SERIAL PRIMARY KEY,
+                            content TEXT,
+                            embedding VECTOR({self.dimention}),
+                            metadata JSONB
+                        );
+                    """)
+
+                except Exception as e:
+                    raise CustomError(f'Error: Unable to create collection - {str(e)}')
+
+                connection.commit()
+
+        return
+
+    def _index_name(self, collection, method):
+        return f"{collection}_embedding_{method}_idx"
+
+    def _ivfflat_lists(self, cursor, collection):
+        if self.ivfflat_lists:
+            return self.ivfflat_lists
+
+        # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond
+        cursor.execute(f"SELECT count(*) FROM {collection}")
+        rows = cursor.fetchone()[0]
+
+        return max(int(rows / 1000) if rows <= 1000000 else int(rows ** 0.5), 1)
+
+    def ensure_vector_index(self, collection, method = None, rebuild = False):
+        """
+            Purpose:
+                Creates the cosine-distance ANN index on a collection's embedding column.
+
+            Expected Input:
+                collection (str): The name of the collection (table) to index.
+                method (str): 'hnsw' or 'ivfflat', vector_index_method by default.
+                rebuild (bool): Drop and recreate the index, e.g. after the data has grown
+                                or changed shape; also drops an index of the other method.
+
+            Returns:
+                bool: True if an index was created.
+
+            Functionality:
+                HNSW is built with vector_hnsw_m and vector_hnsw_ef_construction and can be
+                created on an empty table. IVFFlat clusters the rows present at build time,
+                so it is deferred until the collection has rows and should be rebuilt as it
+                grows; vector_ivfflat_lists 0 sizes the lists from the row count.
+
+                Indexes are built and dropped CONCURRENTLY, so reads and writes on the
+                collection carry on during a long build. An invalid index left by an
+                interrupted build is dropped and rebuilt.
+        """
+        method = method or self.index_method
+        if method not in INDEX_METHODS:
+            raise CustomError(f'Error: Unsupported vector index method {method}, expected one of {", ".join(INDEX_METHODS)}')
+
+        if not rebuild and (collection, method) in self._indexed:
+            return False
+
+        index_name = self._index_name(collection, method)
+
+        with self.pool.connection() as connection:
+            # CONCURRENTLY cannot run inside a transaction block
+            connection.autocommit = True
+            cursor = connection.cursor()
 
-        # Create the table if it doesn't exist
-        if not exists:
             try:
-                self.cursor.execute(f"""
-                    CREATE TABLE {collection} (
-                        id SERIAL PRIMARY KEY,
-                        content TEXT,
-                        embedding VECTOR({self.dimention}),
-                        metadata JSONB
-                    );
-                """)
+                cursor.execute("""
+                    SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s
+                """, (index_name,))
+                existing = cursor.fetchone()
+
+                if existing is not None and existing[0] and not rebuild:
+                    self._indexed.add((collection, method))
+                    return False
+
+                # Index builds on large collections, and concurrent drops waiting on open
+                # transactions, outlast the pool's statement_timeout
+                cursor.execute("SET statement_timeout = 0")
+
+                if rebuild:
+                    for name in [self._index_name(collection, other) for other in INDEX_METHODS]:
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {name}")
+                elif existing is not None:
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+
+                if method == 'hnsw':
+                    cursor.execute(f"""
+                        CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {collection}
+                        USING hnsw (embedding vector_cosine_ops) WITH (m = %s, ef_construction = %s)
+                    """, (self.hnsw_m, self.hnsw_ef_construction))
+                else:
+                    cursor.execute(f"SELECT EXISTS (SELECT FROM {collection})")
+                    if not cursor.fetchone()[0]:
+                        return False
+
+                    cursor.execute(f"""
+                        CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {collection}
+                        USING ivfflat (embedding vector_cosine_ops) WITH (lists = %s)
+                    """, (self._ivfflat_lists(cursor, collection),))
+
+                # Fresh planner statistics so the new index is picked up
+                cursor.execute(f"ANALYZE {collection}")
 
             except Exception as e:
-                raise CustomError(f'Error: Unable to create collection - {str(e)}')
-              
-            self.connection.commit()
+                raise CustomError(f'Error: Unable to create {method} index on collection {collection} - {str(e)}')
 
-        return
+            finally:
+                # Back to the pool's session settings before the connection is returned
+                try:
+                    cursor.execute("RESET statement_timeout")
+                    cursor.close()
+                    connection.autocommit = False
+                except Exception:
+                    connection.close()
+
+        self._indexed.add((collection, method))
 
-    def insert_data(self, data = [], collection = ''):
+        return True
+
+    def insert_data(self, data = [], collection = '', batch_size = None, commit_rows = None):
         """
             Purpose:
             Inserts data into a PostgreSQL vector database (pgvector).
@@ -146,57 +246,157 @@ class VectorDatabase:
                 metadata (dict/JSON): Associated metadata in JSON format.
 
                 [{"metadata": {"number": "INC00001"},"content": "The function validates and processes each dictionary in the list, ensuring the required structure, and inserts the data into the pgvector database for efficient vector-based querying."}]
+            batch_size (int): Rows embedded per embed_documents call, vector_embed_batch_size by default.
+            commit_rows (int): Rows written per transaction, vector_commit_rows by default.
 
             Returns:
             int: The number of rows successfully inserted into the database.
 
             Functionality:
-            The function validates and processes each dictionary in the list, ensuring the required structure, and inserts the data into the pgvector database for efficient vector-based querying.
+            Rows are embedded batch_size at a time and each batch is written with one
+            multi-row INSERT on a background thread while the next batch is embedded,
+            committing every commit_rows rows. A failure rolls back the open
+            transaction only; earlier chunks stay committed.
         """
 
         if not data and not collection:
             raise CustomError("record and collection parameter should not be empty")
-    
+
+        batch_size = max(batch_size or self.embed_batch_size, 1)
+        commit_rows = max(commit_rows or self.commit_rows, batch_size)
 
         self.ensure_collection_exists(collection)
 
-        query = f'''
-            INSERT INTO {collection} (content, embedding, metadata)
-            VALUES (%s, %s, %s)
-        '''
-        try:
-            for row in data:
-                self.cursor.execute(query, (row['content'], self.em_model.embed_query(row['content']), json.dumps(row['metadata'])))
+        query = f"INSERT INTO {collection} (content, embedding, metadata) VALUES %s"
+        state = {'inserted': 0, 'uncommitted': 0}
 
-        except Exception as e:
-            raise CustomError(f'Error: Unable to execute insert query - {str(e)}')
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            def write(rows):
+                execute_values(cursor, query, rows, page_size = len(rows))
+
+                state['uncommitted'] += len(rows)
+                if state['uncommitted'] >= commit_rows:
+                    connection.commit()
+                    state['inserted'] += state['uncommitted']
+                    state['uncommitted'] = 0
+
+            # One writer thread, so the next batch is embedded while this one is inserted
+            with ThreadPoolExecutor(max_workers = 1) as writer:
+                pending = None
+                try:
+                    for ind in range(0, len(data), batch_size):
+                        batch = data[ind:ind + batch_size]
+                        embeddings = self.em_model.embed_documents([row['content'] for row in batch])
+                        rows = [(row['content'], embedding, json.dumps(row['metadata'])) for (row, embedding) in zip(batch, embeddings)]
+
+                        if pending is not None:
+                            pending.result()
+                        pending = writer.submit(write, rows)
+
+                    if pending is not None:
+                        pending.result()
+
+                except Exception as e:
+                    if pending is not None and not pending.done():
+                        pending.exception()
 
-        self.connection.commit() 
+                    connection.rollback()
+                    raise CustomError(f'Error: Unable to execute insert query after {state["inserted"]} committed rows - {str(e)}')
 
-        return self.cursor.rowcount
+            connection.commit()
 
-    def retrieve_data(self, query = '', collection = '', columns = '', limit = 3):
-        print(columns)
+        return state['inserted'] + state['uncommitted']
+
+    def replace_embeddings(self, rows = [], collection = '', key = 'number'):
+        """
+            Purpose:
+                Bulk-writes rows whose embeddings are already computed, replacing earlier copies.
+
+            Expected Input:
+                rows (list): (content, embedding, metadata) tuples.
+                collection (str): The name of the collection (table) to write to.
+                key (str): Metadata field identifying a source document; existing rows
+                           with the same values are deleted first, so re-ingesting a
+                           document does not duplicate it.
+
+            Returns:
+                int: The number of rows inserted.
+
+            Functionality:
+                Deletes and inserts in one transaction, with a single multi-row INSERT.
+        """
+        if not rows or not collection:
+            return 0
+
+        self.ensure_collection_exists(collection)
+
+        values = sorted(set([str(row[2][key]) for row in rows if row[2].get(key) is not None]))
+
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            try:
+                if values:
+                    cursor.execute(f"DELETE FROM {collection} WHERE metadata->>%s = ANY(%s)", (key, values))
+
+                execute_values(cursor, f"INSERT INTO {collection} (content, embedding, metadata) VALUES %s",
+                               [(content, embedding, json.dumps(metadata)) for (content, embedding, metadata) in rows],
+                               page_size = len(rows))
+            except Exception as e:
+                connection.rollback()
+                raise CustomError(f'Error: Unable to execute insert query - {str(e)}')
+
+            connection.commit()
+
+        return len(rows)
+
+    def delete_documents(self, collection = '', key = 'number', values = []):
+        """
+            Purpose:
+                Deletes every row whose metadata field key has one of the given values.
+
+            Returns:
+                int: The number of rows deleted.
+        """
+        if not values or not collection:
+            return 0
+
+        self.ensure_collection_exists(collection)
+
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            try:
+                cursor.execute(f"DELETE FROM {collection} WHERE metadata->>%s = ANY(%s)", (key, [str(value) for value in values]))
+            except Exception as e:
+                connection.rollback()
+                raise CustomError(f'Error: Unable to execute delete query - {str(e)}')
+
+            connection.commit()
+
+            return cursor.rowcount
+
+    def retrieve_data(self, query = '', collection = '', columns = '', limit = 3, threshold = None, ef_search = None, probes = None):
         """
-            Purpose:
-                Retrieves relevant data from a PostgreSQL vector database (pgvector) based on semantic similarity.
+            Purpose:
+                Retrieves relevant data from a PostgreSQL vector database (pgvector) based on semantic similarity.
 
-            Expected Input:
-                query (str): The textual query to be converted into an embedding.
+            Expected Input:
+                query (str): The textual query to be converted into an embedding.
                 collection (str): The name of the collection (table) from where the data should be retrieved.
                 limit: Maximum number of similar results to return. Default 3
+                threshold (float): Minimum cosine similarity of a result, kb_similarity_threshold_score
+                                   by default; 0 returns the nearest rows whatever their score.
+                ef_search (int): HNSW candidate list size for this query, vector_hnsw_ef_search by default.
+                probes (int): IVFFlat lists scanned for this query, vector_ivfflat_probes by default.
 
-            Returns:
-                list of dict: A list of dictionaries, each containing:
-                    - 'metadata' (dict): The associated metadata stored with the content.
-                    - 'content' (str): The matched content from the database.
-                    - 'similarity_score' (float): The similarity score between the query and the content.
-
-            Functionality:
-                - Converts the input query into a vector embedding.
-                - Performs a similarity search against stored embeddings in the database.
-                - Filters results based on the provided similarity threshold.
-                - Returns the matching entries as a list of dictionaries with content, INC number, and similarity score.
+            Returns:
+                list of dict: A list of dictionaries, each containing:
+                    - 'metadata' (dict): The associated metadata stored with the content.
+                    - 'content' (str): The matched content from the database.
+                    - 'similarity' (float): The cosine distance between the query and the content (lower is closer).
+
+            Functionality:
+                - Converts the input query into a vector embedding.
+                - Orders by the <=> operator so the collection's ANN index serves the search.
+                - Filters results on the similarity threshold in the same query.
+                - Returns the matching entries as a list of dictionaries with content, INC number, and similarity score.
         """
 
         if not query and not collection:
@@ -204,37 +404,63 @@ class VectorDatabase:
 
         query_embedding = self.em_model.embed_query(query)
 
+        if threshold is None:
+            threshold = self.similarity_threshould
+
         select_clause = ', '.join(columns) if columns else '*'
-        
-        query = f'SELECT {select_clause}'
-        
-        if query_embedding:
-            vector_str = ','.join(map(str, query_embedding))
-            query += ", cosine_distance(embedding, %s::vector) AS similarity"
 
-        query += f" FROM {collection}"
-        
-        if query_embedding:
-            query += " ORDER BY similarity ASC"
+        query = f"SELECT {select_clause}, embedding <=> %(embedding)s::vector AS similarity FROM {collection}"
+        params = {'embedding': query_embedding, 'limit': int(limit)}
 
-        query += f" LIMIT {limit};"
+        # Cosine similarity is 1 - cosine distance
+        if threshold:
+            query += " WHERE embedding <=> %(embedding)s::vector <= %(max_distance)s"
+            params['max_distance'] = 1 - threshold
 
-        try:
-            self.cursor.execute(query, ([query_embedding]))#, query_embedding, limit))
-            rows = self.cursor.fetchall()
+        query += " ORDER BY embedding <=> %(embedding)s::vector LIMIT %(limit)s"
+
+        with self.pool.connection() as connection, connection.cursor() as cursor:
+            try:
+                # Search-time recall knobs, scoped to this transaction
+                cursor.execute("SELECT set_config('hnsw.ef_search', %s, true), set_config('ivfflat.probes', %s, true)",
+                               (str(ef_search or self.hnsw_ef_search), str(probes or self.ivfflat_probes)))
+
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+
+                if not columns:
+                    columns = [desc[0] for desc in cursor.description]
+                else:
+                    columns = list(columns) + ['similarity']
 
-            if not columns:
-                columns = [desc[0] for desc in self.cursor.description]
+                results = []
+                for row in rows:
+                    result_dict = dict(zip(columns, row))
+                    result_dict.pop('embedding', None)
+                    results.append(result_dict)
 
-            results = []
-            for row in rows:
-                result_dict = dict(zip(columns, row))
-                del result_dict['embedding']
-                results.append(result_dict)
-    
-            return results
+                connection.commit()
 
+                return results
+
+            except Exception as e:
+                connection.rollback()
+                raise CustomError(f'Error: Unable to execute retrieve query - {str(e)}')
+
+
+def start_vector_index_build(collections = None):
+    """Build missing ANN indexes for collections (vector_index_collections by default) on a background thread."""
+    def run():
+        try:
+            db_obj = VectorDatabase()
+            for collection in collections or db_obj.index_collections:
+                db_obj.ensure_collection_exists(collection)
+                if db_obj.ensure_vector_index(collection):
+                    print(f"Vector index built on {collection}")
         except Exception as e:
-            raise CustomError(f'Error: Unable to execute retrieve query - {str(e)}')
+            print(f"Vector index build failed - {str(e)}")
+
+    thread = threading.Thread(target = run, name = 'vector-index-build', daemon = True)
+    thread.start()
 
-        
+    return thread
@@ -4,8 +4,11 @@ import json
 import traceback
 
 from .vectordb_connector import *
+from .pg_pool import pg_pool_stats
+from .embedding_cache import embedding_cache_stats
 
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from fastapi.responses import JSONResponse
 
@@ -29,6 +32,14 @@ class RetrievePayload(BaseModel):
     collection: str
     columns:Optional[List] = []
     limit: Optional[int] = 3
+    threshold: Optional[float] = None
+    ef_search: Optional[int] = None
+    probes: Optional[int] = None
+
+class IndexPayload(BaseModel):
+    collection: str
+    method: Optional[str] = None
+    rebuild: Optional[bool] = True
 
 @router.post(f"/api/{mim_conf['api_version']}/insert_data/", status_code = 200)
 async def insert_data(payload: InsertPayload) -> dict:
@@ -64,7 +75,10 @@ async def retrieve_data(payload: RetrievePayload) -> dict:
             query = payload.query, 
             collection = payload.collection, 
             columns = payload.columns,
-            limit = payload.limit
+            limit = payload.limit,
+            threshold = payload.threshold,
+            ef_search = payload.ef_search,
+            probes = payload.probes
         )
         response['output'] = {"data": data, "message": "Data retrieved successfully"}
         response['code'] = 200
@@ -78,3 +92,67 @@ async def retrieve_data(payload: RetrievePayload) -> dict:
         # traceback.print_exc()
 
         return JSONResponse(status_code = 500, content = response)
+
+@router.post(f"/api/{mim_conf['api_version']}/vector_index/", status_code = 200)
+async def vector_index(payload: IndexPayload) -> dict:
+    response = {}
+    try:
+        db_obj = VectorDatabase()
+
+        # Long builds run on a worker thread, not the event loop
+        created = await run_in_threadpool(lambda: db_obj.ensure_vector_index(
+            collection = payload.collection,
+            method = payload.method,
+            rebuild = payload.rebuild
+        ))
+
+        response['output'] = {"data": created, "message": f"Vector index on {payload.collection} " + ("built" if created else "already present")}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": 0, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_pg_pool_stats/", status_code = 200)
+async def get_pg_pool_stats() -> dict:
+    response = {}
+    try:
+        stats = pg_pool_stats()
+
+        response['output'] = {"data": stats, "message": "Database pool stats retrieved successfully"}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_embedding_cache_stats/", status_code = 200)
+async def get_embedding_cache_stats() -> dict:
+    response = {}
+    try:
+        stats = embedding_cache_stats()
+
+        response['output'] = {"data": stats, "message": "Embedding cache stats retrieved successfully"}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
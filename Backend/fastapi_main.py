@@ -1,5 +1,6 @@
 import secrets
 import uvicorn
+from contextlib import asynccontextmanager
 from fastapi import Depends, FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
@@ -17,11 +18,83 @@ from resolution_management.resolution_assist_routes import router as resolution_
 from change_management.change_management_routes import router as change_management_router
 from change_management.file_upload_routes import router as upload_router
 from llm_app.llm_routes import router as llm_router
+from itsm.snow_client import get_snow_client, close_snow_clients
+from itsm.snow_async_client import get_async_snow_client, close_async_snow_clients
+from itsm.cmdb_mirror import get_cmdb_mirror, DEFAULT_SYNC_INTERVAL
+from itsm.ticket_mirror import get_ticket_mirror, DEFAULT_SYNC_INTERVAL as DEFAULT_TICKET_SYNC_INTERVAL
+from itsm.reference_data import get_reference_data, DEFAULT_SYNC_INTERVAL as DEFAULT_REFERENCE_SYNC_INTERVAL
+from itsm.snow_client import get_mim_conf
+from database.pg_pool import close_pg_pools
+from database.embedding_registry import get_embedding_registry
+from database.vectordb_connector import start_vector_index_build
+from itsm.html_text import get_html_converter
 
 
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI(docs = "/documentation", redoc_url = None)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open the shared ServiceNow connection pool once per worker
+    try:
+        get_snow_client()
+        get_async_snow_client()
+    except Exception as e:
+        print(f"ServiceNow client initialisation deferred - {str(e)}")
+
+    # Load and warm up the embedding models in the background; /ready reports when they are usable
+    get_embedding_registry().start_warm_up()
+
+    # Build missing ANN indexes in the background, so no request waits on one
+    start_vector_index_build()
+
+    # Keep the local CMDB mirror current in the background; 0 disables it
+    mirror = None
+    try:
+        interval = get_mim_conf().get('cmdb_mirror_sync_interval', DEFAULT_SYNC_INTERVAL)
+        if interval:
+            mirror = get_cmdb_mirror()
+            mirror.start_background_sync(interval)
+    except Exception as e:
+        print(f"CMDB mirror not started - {str(e)}")
+
+    # Same for the incident and change_request mirror
+    ticket_mirror = None
+    try:
+        interval = get_mim_conf().get('ticket_mirror_sync_interval', DEFAULT_TICKET_SYNC_INTERVAL)
+        if interval:
+            ticket_mirror = get_ticket_mirror()
+            ticket_mirror.start_background_sync(interval)
+    except Exception as e:
+        print(f"Ticket mirror not started - {str(e)}")
+
+    # And for the user, group and CI class dictionary
+    reference_data = None
+    try:
+        interval = get_mim_conf().get('reference_data_sync_interval', DEFAULT_REFERENCE_SYNC_INTERVAL)
+        if interval:
+            reference_data = get_reference_data()
+            reference_data.start_background_sync(interval)
+    except Exception as e:
+        print(f"Reference data sync not started - {str(e)}")
+
+    yield
+
+    if mirror is not None:
+        mirror.stop_background_sync()
+
+    if ticket_mirror is not None:
+        ticket_mirror.stop_background_sync()
+
+    if reference_data is not None:
+        reference_data.stop_background_sync()
+
+    get_html_converter().close()
+
+    close_snow_clients()
+    await close_async_snow_clients()
+    close_pg_pools()
+
+app = FastAPI(docs = "/documentation", redoc_url = None, lifespan = lifespan)
 security = HTTPBasic()
 
 # Replace with your actual frontend origin
@@ -77,6 +150,16 @@ app.include_router(change_management_router, prefix  = '/change_management', tag
 app.include_router(upload_router, prefix  = '/remote_file_management', tags = ['File Upload Management'], dependencies=[Depends(authenticate)])
 app.include_router(llm_router, prefix  = '/llm', tags = ['LLM Responses'], dependencies=[Depends(authenticate)])
 
+# Readiness probe: 503 until the startup embedding models are loaded and warmed up
+@app.get("/ready")
+async def readiness():
+    status = get_embedding_registry().status()
+
+    if status['ready']:
+        return JSONResponse(status_code = 200, content = {'output': {"data": status, "message": "Ready"}, 'code': 200})
+
+    return JSONResponse(status_code = 503, content = {'error': {"data": status, "message": "Embedding models not ready"}, 'code': 503})
+
 # Handling Pydantic Validation exceptions
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
@@ -0,0 +1,151 @@
+import threading
+from collections import Counter
+
+CMDB_CI_PATH = '/api/now/table/cmdb_ci'
+
+# Matches returned per input string
+DEFAULT_RESOLVE_LIMIT = 5
+
+# Minimum trigram similarity (Dice coefficient) for a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+# Scores by kind of match; fuzzy matches score below every substring match
+EXACT_SCORE = 1.0
+PREFIX_SCORE = 0.9
+SUBSTRING_SCORE = 0.8
+FUZZY_SCORE = 0.7
+
+
+def _trigrams(text):
+    return set([text[ind:ind + 3] for ind in range(len(text) - 2)])
+
+
+class CINameIndex:
+    """
+        In-memory lookup of CIs by name or IP address.
+
+        Names are indexed by lower-case trigrams, so a query finds exact,
+        prefix and substring matches (what nameLIKE returns) as well as near
+        misses such as typos, ranked in that order. IP addresses match exactly.
+        The CMDB mirror keeps it in step with its cmdb_ci table.
+    """
+    def __init__(self):
+        self._cis = {}
+        self._names = {}
+        self._ips = {}
+        self._grams = {}
+        self._lock = threading.RLock()
+
+    def add(self, sys_id, name, sys_class_name = '', ip_address = ''):
+        with self._lock:
+            self.remove(sys_id)
+
+            key = (name or '').lower()
+            self._cis[sys_id] = (name or '', sys_class_name or '', ip_address or '')
+            self._names.setdefault(key, set()).add(sys_id)
+            if ip_address:
+                self._ips.setdefault(ip_address, set()).add(sys_id)
+
+            for gram in _trigrams(key):
+                self._grams.setdefault(gram, set()).add(sys_id)
+
+    def remove(self, sys_id):
+        with self._lock:
+            previous = self._cis.pop(sys_id, None)
+            if previous is None:
+                return
+
+            (name, _, ip_address) = previous
+            key = name.lower()
+
+            for (index, index_key) in [(self._names, key), (self._ips, ip_address)] + [(self._grams, gram) for gram in _trigrams(key)]:
+                ids = index.get(index_key)
+                if ids is not None:
+                    ids.discard(sys_id)
+                    if not ids:
+                        del index[index_key]
+
+    def __len__(self):
+        return len(self._cis)
+
+    def _entry(self, sys_id, score):
+        (name, sys_class_name, ip_address) = self._cis[sys_id]
+        return {'sys_id': sys_id, 'name': name, 'sys_class_name': sys_class_name, 'ip_address': ip_address, 'score': round(score, 3)}
+
+    def search(self, value, limit = DEFAULT_RESOLVE_LIMIT):
+        """Best matches for one name or IP, highest score first."""
+        query = value.strip().lower()
+        if not query:
+            return []
+
+        scores = {}
+        with self._lock:
+            for sys_id in self._ips.get(value.strip(), set()) | self._names.get(query, set()):
+                scores[sys_id] = EXACT_SCORE
+
+            grams = _trigrams(query)
+            if grams:
+                # Every name containing the query holds all of its trigrams
+                postings = sorted([self._grams.get(gram, set()) for gram in grams], key = len)
+                candidates = set.intersection(*postings) if postings[0] else set()
+                overlaps = Counter([sys_id for posting in postings for sys_id in posting])
+            else:
+                candidates = set([sys_id for (sys_id, ci) in self._cis.items() if query in ci[0].lower()])
+                overlaps = Counter()
+
+            for sys_id in candidates:
+                name = self._cis[sys_id][0].lower()
+                if sys_id in scores or query not in name:
+                    continue
+
+                # Shorter names that contain the query rank higher
+                score = PREFIX_SCORE if name.startswith(query) else SUBSTRING_SCORE
+                scores[sys_id] = score + 0.09 * len(query) / len(name)
+
+            for (sys_id, overlap) in overlaps.items():
+                if sys_id in scores:
+                    continue
+
+                similarity = 2 * overlap / (len(grams) + len(_trigrams(self._cis[sys_id][0].lower())))
+                if similarity >= FUZZY_THRESHOLD:
+                    scores[sys_id] = FUZZY_SCORE * similarity
+
+            ranked = sorted(scores.items(), key = lambda item: (-item[1], len(self._cis[item[0]][0])))
+
+            return [self._entry(sys_id, score) for (sys_id, score) in ranked[:limit]]
+
+    def resolve(self, values, limit = DEFAULT_RESOLVE_LIMIT):
+        """{value: matches} for a batch of names or IPs; values without a match map to []."""
+        return {value: self.search(value, limit) for value in values}
+
+
+# Encoded query matching any of the values exactly by name or IP
+def remote_ci_query(values):
+    # ^ is escaped as ^^; a comma would split an IN list, so such names get their own name= term
+    values = [value.strip().replace('^', '^^') for value in values if value.strip()]
+    listed = ','.join([value for value in values if ',' not in value])
+
+    terms = ['nameIN' + listed, 'ip_addressIN' + listed] if listed else []
+    terms += ['name=' + value for value in values if ',' in value]
+
+    return '^OR'.join(terms)
+
+
+# Index entry shape for a cmdb_ci record read from the instance
+def ci_entry(record, score = EXACT_SCORE):
+    return {'sys_id': record.get('sys_id', ''), 'name': record.get('name', ''), 'sys_class_name': record.get('sys_class_name', ''),
+            'ip_address': record.get('ip_address', ''), 'score': score}
+
+
+# {value: matches} from a remote read with remote_ci_query()
+def match_remote_cis(records, values):
+    output = {value: [] for value in values}
+
+    for record in records:
+        entry = ci_entry(record)
+
+        for value in values:
+            if value.strip().lower() == (entry['name'] or '').lower() or value.strip() == entry['ip_address']:
+                output[value].append(entry)
+
+    return output
@@ -0,0 +1,219 @@
+import asyncio
+
+from itsm.records import CMDBRelation
+
+# Traversal limits, overridable from mim_conf.json
+DEFAULT_MAX_DEPTH = 10
+DEFAULT_MAX_FANOUT = 50
+
+# sys_ids per cmdb_rel_ci query, keeps the encoded query well within URL limits
+FRONTIER_CHUNK_SIZE = 100
+
+RELATION_FIELDS = 'parent,child,type,parent.name,parent.sys_class_name,parent.ip_address,child.name,child.sys_class_name,child.ip_address,type.name'
+
+
+def _ref_value(value):
+    if isinstance(value, dict):
+        return value.get('value', '')
+
+    return value or ''
+
+
+# Encoded query matching every relation one hop away from the frontier
+def relation_query(frontier, target):
+    # Walking towards parents means the frontier sits on the child side of the relation
+    column = 'child' if target == 'parent' else 'parent'
+
+    return column + 'IN' + ','.join(frontier)
+
+
+class ServiceMapWalker:
+    """
+        Level-by-level (BFS) walk of cmdb_rel_ci in one direction.
+
+        The walker does no I/O: callers fetch the relations of next_frontier()
+        in one batched query and hand them to add_relations(). Visited CIs are
+        never expanded twice, so cycles terminate, and depth and per-CI fan-out
+        are capped.
+    """
+    def __init__(self, sys_ids, target, max_depth = DEFAULT_MAX_DEPTH, max_fanout = DEFAULT_MAX_FANOUT):
+        if target not in ['parent', 'child']:
+            raise ValueError('target should be parent or child')
+
+        self.target = target
+        self.relation = 'child' if target == 'parent' else 'parent'
+        self.max_depth = max_depth
+        self.max_fanout = max_fanout
+
+        self.roots = list(dict.fromkeys(sys_ids))
+        self.visited = set(self.roots)
+        self.frontier = list(self.roots)
+        self.depth = 0
+        self.truncated = False
+
+        self.nodes = {}
+        self.order = []
+        for sys_id in self.roots:
+            self._add_node(sys_id, 0)
+
+        self.edges = []
+        self._edge_keys = set()
+
+    def _add_node(self, sys_id, depth):
+        self.nodes[sys_id] = {'sys_id': sys_id, 'name': '', 'sys_class_name': '', 'ip_address': '', 'depth': depth}
+        self.order.append(sys_id)
+
+    def _describe(self, sys_id, entry, side):
+        node = self.nodes[sys_id]
+        for field in ['name', 'sys_class_name', 'ip_address']:
+            value = entry.get(side + '.' + field, '')
+            if value:
+                node[field] = value
+
+    def next_frontier(self):
+        if self.frontier and self.depth >= self.max_depth:
+            self.truncated = True
+            self.frontier = []
+
+        return self.frontier
+
+    def add_relations(self, entries):
+        frontier = set(self.frontier)
+        next_frontier = []
+        fanout = {}
+
+        self.depth += 1
+
+        for entry in entries:
+            # Skip relations to CIs without a name or class, as the narrative did
+            if (entry.get('parent.name', '') == '' and entry.get('parent.sys_class_name', '') == '') or \
+                    (entry.get('child.name', '') == '' and entry.get('child.sys_class_name', '') == ''):
+                continue
+
+            source = _ref_value(entry[self.relation])
+            dest = _ref_value(entry[self.target])
+
+            if source not in frontier or dest == '':
+                continue
+
+            edge_key = (_ref_value(entry['parent']), _ref_value(entry['child']), entry.get('type.name', ''))
+            if edge_key in self._edge_keys:
+                continue
+
+            if fanout.get(source, 0) >= self.max_fanout:
+                self.truncated = True
+                continue
+
+            fanout[source] = fanout.get(source, 0) + 1
+            self._edge_keys.add(edge_key)
+
+            if dest not in self.nodes:
+                self._add_node(dest, self.depth)
+
+            self._describe(edge_key[0], entry, 'parent')
+            self._describe(edge_key[1], entry, 'child')
+
+            self.edges.append({'parent': edge_key[0], 'child': edge_key[1], 'type': edge_key[2], 'source': source})
+
+            if dest not in self.visited:
+                self.visited.add(dest)
+                next_frontier.append(dest)
+
+        self.frontier = next_frontier
+
+    def graph(self):
+        return {
+            'roots': self.roots,
+            'target': self.target,
+            'nodes': [self.nodes[sys_id] for sys_id in self.order],
+            'edges': self.edges,
+            'depth': self.depth,
+            'truncated': self.truncated
+        }
+
+
+# Text narrative of a service map graph, one block per CI in BFS order
+def render_service_map(graph):
+    nodes = {node['sys_id']: node for node in graph['nodes']}
+
+    edges_by_source = {}
+    for edge in graph['edges']:
+        edges_by_source.setdefault(edge['source'], []).append(edge)
+
+    service_map = []
+    for node in graph['nodes']:
+        data = ''
+        for edge in edges_by_source.get(node['sys_id'], []):
+            parent = nodes[edge['parent']]
+            child = nodes[edge['child']]
+
+            if parent['sys_class_name'] != '':
+                data += parent['sys_class_name'] + ' '
+            data += parent['name'] + ' '
+
+            if parent['ip_address'] != '':
+                data += 'with IP address ' + parent['ip_address'] + ' '
+                data += edge['type'].split(':')[0] + ' '
+
+            if child['sys_class_name'] != '':
+                data += child['sys_class_name'] + ' '
+            data += child['name'] + ' '
+
+            if child['ip_address'] != '':
+                data += 'with IP address ' + child['ip_address']
+
+            if data.strip() != '':
+                data += '\n'
+
+        if data.strip() != '':
+            service_map.append(data)
+
+    return service_map
+
+
+def _chunks(items, size):
+    for ind in range(0, len(items), size):
+        yield items[ind:ind + size]
+
+
+# One batched, paged cmdb_rel_ci read per frontier chunk using a SnowClient
+def fetch_relations(client, frontier, target):
+    entries = []
+    for chunk in _chunks(frontier, FRONTIER_CHUNK_SIZE):
+        entries += [CMDBRelation.from_dict(entry) for entry in client.iter_table('cmdb_rel_ci', query = relation_query(chunk, target),
+                                                                                fields = RELATION_FIELDS, display_value = 'false')]
+
+    return entries
+
+
+# Same as fetch_relations with the chunks read concurrently on an AsyncSnowClient
+async def async_fetch_relations(client, frontier, target):
+    async def fetch_chunk(chunk):
+        return [CMDBRelation.from_dict(entry) async for entry in client.iter_table('cmdb_rel_ci', query = relation_query(chunk, target),
+                                                                                   fields = RELATION_FIELDS, display_value = 'false')]
+
+    results = await asyncio.gather(*[fetch_chunk(chunk) for chunk in _chunks(frontier, FRONTIER_CHUNK_SIZE)])
+
+    return [entry for result in results for entry in result]
+
+
+def build_service_map(fetch, sys_ids, target, max_depth = DEFAULT_MAX_DEPTH, max_fanout = DEFAULT_MAX_FANOUT):
+    walker = ServiceMapWalker(sys_ids, target, max_depth = max_depth, max_fanout = max_fanout)
+
+    frontier = walker.next_frontier()
+    while frontier:
+        walker.add_relations(fetch(frontier, target))
+        frontier = walker.next_frontier()
+
+    return walker.graph()
+
+
+async def async_build_service_map(fetch, sys_ids, target, max_depth = DEFAULT_MAX_DEPTH, max_fanout = DEFAULT_MAX_FANOUT):
+    walker = ServiceMapWalker(sys_ids, target, max_depth = max_depth, max_fanout = max_fanout)
+
+    frontier = walker.next_frontier()
+    while frontier:
+        walker.add_relations(await fetch(frontier, target))
+        frontier = walker.next_frontier()
+
+    return walker.graph()
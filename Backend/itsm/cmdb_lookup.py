@@ -0,0 +1,185 @@
+import os
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import CustomError
+from itsm.cmdb_graph import ServiceMapWalker, build_service_map, async_build_service_map, fetch_relations, async_fetch_relations
+from itsm.cmdb_mirror import mirror_relation_fetcher, mirror_ci_index
+from itsm.ci_index import CMDB_CI_PATH, DEFAULT_RESOLVE_LIMIT, SUBSTRING_SCORE, ci_entry, remote_ci_query, match_remote_cis
+from itsm.snow_cache import cache_key
+
+# CMDB lookups shared by ITSM, AsyncITSM and the change management ITSM.
+#
+# Lookups degrade instead of raising: a failed nameLIKE read returns [], a failed
+# nameIN read falls back to per-CI nameLIKE reads, and a failed service map walk
+# returns the roots-only graph with an 'error' key. Degraded results are not cached.
+
+CI_FIELDS = 'sys_id,name,sys_class_name,ip_address'
+
+
+def _cmdb_ci_params(ci):
+    params = {}
+    params['sysparm_query'] = 'nameLIKE' + ci + '^ORip_address=' + ci
+    params['sysparm_display_value'] = 'true'
+
+    return params
+
+
+def _ci_match_params(cis):
+    params = {}
+    params['sysparm_query'] = remote_ci_query(cis)
+    params['sysparm_fields'] = CI_FIELDS
+    params['sysparm_display_value'] = 'false'
+    params['sysparm_exclude_reference_link'] = 'true'
+
+    return params
+
+
+def _records(response):
+    output = response.json()['result']
+
+    if type(output) == dict:
+        output = [output]
+
+    return output
+
+
+def _ci_matches(response, cis):
+    if response.status_code >= 400:
+        raise CustomError('ServiceNow returned ' + str(response.status_code) + ' - ' + response.text)
+
+    return match_remote_cis(response.json()['result'], cis)
+
+
+# CIs whose best local match is missing or fuzzy; the CI may be newer than the mirror
+def _remote_misses(cis, resolved):
+    return [ci for ci in cis if not resolved[ci] or resolved[ci][0]['score'] < SUBSTRING_SCORE]
+
+
+def _failed_graph(sys_ids, target, error):
+    print(str(error))
+
+    graph = ServiceMapWalker(sys_ids, target).graph()
+    graph['error'] = str(error)
+
+    return graph
+
+
+# CIs whose name contains ci or whose IP is ci, [] when the read fails
+def get_cmdb_ci(client, cache, ci):
+    try:
+        return cache.cached('cmdb_ci', cache_key(client, 'cmdb_ci', ci), lambda: _records(client.get(CMDB_CI_PATH, params = _cmdb_ci_params(ci))))
+    except Exception:
+        return []
+
+
+# Resolve several CI names or IPs at once, {ci: ranked matches}
+def resolve_cmdb_cis(client, cache, cis, limit = DEFAULT_RESOLVE_LIMIT):
+    cis = list(dict.fromkeys(cis))
+
+    # Local index when the CMDB mirror is fresh; only its misses go to the instance, in one nameIN read
+    index = mirror_ci_index()
+    resolved = index.resolve(cis, limit) if index is not None else {ci: [] for ci in cis}
+
+    misses = _remote_misses(cis, resolved)
+    remote_failed = False
+    if misses:
+        try:
+            remote = cache.cached('cmdb_ci', cache_key(client, 'ci_matches', sorted(misses)),
+                                  lambda: _ci_matches(client.get(CMDB_CI_PATH, params = _ci_match_params(misses)), misses))
+            resolved.update(dict([(ci, matches) for (ci, matches) in remote.items() if matches]))
+        except Exception as e:
+            print(str(e))
+            remote_failed = True
+
+    # Without the index (or the batched read), partial names still get the nameLIKE lookup
+    misses = [ci for ci in cis if not resolved[ci]]
+    if (index is None or remote_failed) and misses:
+        with ThreadPoolExecutor(max_workers = min(len(misses), client.batch_workers)) as executor:
+            for (ci, records) in zip(misses, executor.map(lambda ci: get_cmdb_ci(client, cache, ci), misses)):
+                resolved[ci] = [ci_entry(record, SUBSTRING_SCORE) for record in records[:limit]]
+
+    return resolved
+
+
+# Nodes and edges reachable from the CIs in one direction, walked level by level
+def get_service_map_graph(client, cache, sys_ids, target, max_depth, max_fanout):
+    def load():
+        # Walk the local CMDB mirror when it is fresh, live cmdb_rel_ci reads otherwise
+        fetch = mirror_relation_fetcher()
+        if fetch is None:
+            fetch = lambda frontier, direction: fetch_relations(client, frontier, direction)
+
+        return build_service_map(fetch, sys_ids, target, max_depth = max_depth, max_fanout = max_fanout)
+
+    try:
+        return cache.cached('cmdb_rel_ci', cache_key(client, 'service_map', sys_ids, target, max_depth, max_fanout), load)
+    except Exception as e:
+        return _failed_graph(sys_ids, target, e)
+
+
+# asyncio versions of the above for an AsyncSnowClient
+async def async_get_cmdb_ci(client, cache, ci):
+    async def load():
+        return _records(await client.get(CMDB_CI_PATH, params = _cmdb_ci_params(ci)))
+
+    try:
+        return await cache.async_cached('cmdb_ci', cache_key(client, 'cmdb_ci', ci), load)
+    except Exception:
+        return []
+
+
+async def async_resolve_cmdb_cis(client, cache, cis, limit = DEFAULT_RESOLVE_LIMIT):
+    cis = list(dict.fromkeys(cis))
+
+    # Loading and searching the mirror index run on a worker thread
+    def resolve_local():
+        index = mirror_ci_index()
+        return (index, index.resolve(cis, limit) if index is not None else {ci: [] for ci in cis})
+
+    (index, resolved) = await asyncio.to_thread(resolve_local)
+
+    misses = _remote_misses(cis, resolved)
+    remote_failed = False
+    if misses:
+        async def load():
+            return _ci_matches(await client.get(CMDB_CI_PATH, params = _ci_match_params(misses)), misses)
+
+        try:
+            remote = await cache.async_cached('cmdb_ci', cache_key(client, 'ci_matches', sorted(misses)), load)
+            resolved.update(dict([(ci, matches) for (ci, matches) in remote.items() if matches]))
+        except Exception as e:
+            print(str(e))
+            remote_failed = True
+
+    misses = [ci for ci in cis if not resolved[ci]]
+    if (index is None or remote_failed) and misses:
+        for (ci, records) in zip(misses, await asyncio.gather(*[async_get_cmdb_ci(client, cache, ci) for ci in misses])):
+            resolved[ci] = [ci_entry(record, SUBSTRING_SCORE) for record in records[:limit]]
+
+    return resolved
+
+
+async def async_get_service_map_graph(client, cache, sys_ids, target, max_depth, max_fanout):
+    async def load():
+        # The first call loads the mirror index from SQLite, and hops wait on the mirror lock while a
+        # sync reloads it, so both run on a worker thread
+        mirror_fetch = await asyncio.to_thread(mirror_relation_fetcher)
+        if mirror_fetch is not None:
+            async def fetch(frontier, direction):
+                return await asyncio.to_thread(mirror_fetch, frontier, direction)
+        else:
+            fetch = lambda frontier, direction: async_fetch_relations(client, frontier, direction)
+
+        return await async_build_service_map(fetch, sys_ids, target, max_depth = max_depth, max_fanout = max_fanout)
+
+    try:
+        return await cache.async_cached('cmdb_rel_ci', cache_key(client, 'service_map', sys_ids, target, max_depth, max_fanout), load)
+    except Exception as e:
+        return _failed_graph(sys_ids, target, e)
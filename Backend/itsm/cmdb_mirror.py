@@ -0,0 +1,327 @@
+import os
+import sys
+import time
+import threading
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import get_snow_client, get_mim_conf
+from itsm.local_store import get_local_store
+from itsm.cmdb_graph import _ref_value
+from itsm.ci_index import CINameIndex
+from itsm.records import CMDBRelation
+
+# Mirror older than this falls back to live cmdb_rel_ci reads
+DEFAULT_MAX_STALENESS = 900
+DEFAULT_SYNC_INTERVAL = 300
+
+CI_FIELDS = 'sys_id,name,sys_class_name,ip_address,sys_updated_on'
+REL_FIELDS = 'sys_id,parent,child,type.name,sys_updated_on'
+
+# Rows written per transaction while syncing
+SYNC_BATCH_SIZE = 1000
+
+# sys_ids per sys_idIN query when refreshing single records
+REFRESH_BATCH_SIZE = 100
+
+
+class CMDBMirror:
+    """
+        Local copy of cmdb_ci and cmdb_rel_ci with an in-memory adjacency index.
+
+        sync() pulls only rows whose sys_updated_on is at or after the stored
+        watermark. Deleted rows are not visible to an incremental sync, so
+        sync(full = True) reconciles them, and webhook events can remove them
+        as they happen. fetch_relations() answers service-map walks from memory
+        in the same row shape as a live cmdb_rel_ci read, and ci_index resolves
+        CI names and IPs.
+    """
+    def __init__(self, store = None, client = None, max_staleness = DEFAULT_MAX_STALENESS):
+        self.store = store or get_local_store()
+        self.client = client or get_snow_client()
+        self.max_staleness = max_staleness
+
+        with self.store.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cmdb_ci (
+                    sys_id TEXT PRIMARY KEY,
+                    name TEXT,
+                    sys_class_name TEXT,
+                    ip_address TEXT,
+                    sys_updated_on TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cmdb_ci_name ON cmdb_ci (name)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cmdb_ci_ip_address ON cmdb_ci (ip_address)')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS cmdb_rel_ci (
+                    sys_id TEXT PRIMARY KEY,
+                    parent TEXT,
+                    child TEXT,
+                    type_name TEXT,
+                    sys_updated_on TEXT
+                )
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cmdb_rel_ci_parent ON cmdb_rel_ci (parent)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_cmdb_rel_ci_child ON cmdb_rel_ci (child)')
+
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+        self._stop_event = threading.Event()
+
+        self._load_index()
+
+    def _load_index(self):
+        conn = self.store.connection()
+
+        with self._lock:
+            self._cis = {}
+            self._relations = {}
+            self._children = {}
+            self._parents = {}
+            self.ci_index = CINameIndex()
+
+            for row in conn.execute('SELECT sys_id, name, sys_class_name, ip_address FROM cmdb_ci'):
+                self._cis[row['sys_id']] = (row['name'] or '', row['sys_class_name'] or '', row['ip_address'] or '')
+                self.ci_index.add(row['sys_id'], *self._cis[row['sys_id']])
+
+            for row in conn.execute('SELECT sys_id, parent, child, type_name FROM cmdb_rel_ci'):
+                self._index_relation(row['sys_id'], row['parent'], row['child'], row['type_name'] or '')
+
+    def _index_relation(self, rel_id, parent, child, type_name):
+        self._unindex_relation(rel_id)
+
+        self._relations[rel_id] = (parent, child, type_name)
+        self._children.setdefault(parent, {})[rel_id] = child
+        self._parents.setdefault(child, {})[rel_id] = parent
+
+    def _unindex_relation(self, rel_id):
+        previous = self._relations.pop(rel_id, None)
+        if previous is None:
+            return
+
+        (parent, child, _) = previous
+        self._children.get(parent, {}).pop(rel_id, None)
+        self._parents.get(child, {}).pop(rel_id, None)
+
+    def apply_cis(self, records):
+        rows = [(_ref_value(record['sys_id']), record.get('name', ''), record.get('sys_class_name', ''),
+                 record.get('ip_address', ''), record.get('sys_updated_on', '')) for record in records]
+
+        with self.store.connection() as conn:
+            conn.executemany('''
+                INSERT INTO cmdb_ci (sys_id, name, sys_class_name, ip_address, sys_updated_on) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(sys_id) DO UPDATE SET name = excluded.name, sys_class_name = excluded.sys_class_name,
+                    ip_address = excluded.ip_address, sys_updated_on = excluded.sys_updated_on
+            ''', rows)
+
+        with self._lock:
+            for row in rows:
+                self._cis[row[0]] = (row[1] or '', row[2] or '', row[3] or '')
+                self.ci_index.add(row[0], *self._cis[row[0]])
+
+    def apply_relations(self, records):
+        rows = [(_ref_value(record['sys_id']), _ref_value(record.get('parent')), _ref_value(record.get('child')),
+                 record.get('type.name', ''), record.get('sys_updated_on', '')) for record in records]
+
+        with self.store.connection() as conn:
+            conn.executemany('''
+                INSERT INTO cmdb_rel_ci (sys_id, parent, child, type_name, sys_updated_on) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(sys_id) DO UPDATE SET parent = excluded.parent, child = excluded.child,
+                    type_name = excluded.type_name, sys_updated_on = excluded.sys_updated_on
+            ''', rows)
+
+        with self._lock:
+            for row in rows:
+                self._index_relation(row[0], row[1], row[2], row[3] or '')
+
+    def delete(self, table, sys_ids):
+        if table not in ['cmdb_ci', 'cmdb_rel_ci']:
+            return
+
+        with self.store.connection() as conn:
+            conn.executemany('DELETE FROM ' + table + ' WHERE sys_id = ?', [(sys_id,) for sys_id in sys_ids])
+
+        with self._lock:
+            for sys_id in sys_ids:
+                if table == 'cmdb_ci':
+                    self._cis.pop(sys_id, None)
+                    self.ci_index.remove(sys_id)
+                else:
+                    self._unindex_relation(sys_id)
+
+    def refresh(self, table, sys_ids):
+        """Re-read the given cmdb_ci or cmdb_rel_ci rows, e.g. after a webhook reported them changed."""
+        (fields, apply) = {'cmdb_ci': (CI_FIELDS, self.apply_cis), 'cmdb_rel_ci': (REL_FIELDS, self.apply_relations)}[table]
+
+        sys_ids = list(sys_ids)
+        for ind in range(0, len(sys_ids), REFRESH_BATCH_SIZE):
+            records = list(self.client.iter_table(table, query = 'sys_idIN' + ','.join(sys_ids[ind:ind + REFRESH_BATCH_SIZE]),
+                                                  fields = fields, display_value = 'false',
+                                                  params = {'sysparm_exclude_reference_link': 'true'}))
+            if records:
+                apply(records)
+
+    def sync(self, full = False):
+        """Pull changes since the last watermark, or everything when full is set."""
+        with self._sync_lock:
+            for (table, fields, apply) in [('cmdb_ci', CI_FIELDS, self.apply_cis),
+                                           ('cmdb_rel_ci', REL_FIELDS, self.apply_relations)]:
+                (watermark, _) = self.store.get_watermark(table)
+                started = time.time()
+
+                query = ''
+                if watermark and not full:
+                    query = 'sys_updated_on>=' + watermark
+
+                seen = set()
+                batch = []
+                for record in self.client.iter_table(table, query = query, fields = fields, display_value = 'false',
+                                                     params = {'sysparm_exclude_reference_link': 'true'}):
+                    batch.append(record)
+                    seen.add(record['sys_id'])
+
+                    if record.get('sys_updated_on', '') > (watermark or ''):
+                        watermark = record['sys_updated_on']
+
+                    if len(batch) >= SYNC_BATCH_SIZE:
+                        apply(batch)
+                        batch = []
+
+                if batch:
+                    apply(batch)
+
+                # A full pass also removes rows deleted on the instance
+                if full:
+                    stale = [row['sys_id'] for row in self.store.connection().execute('SELECT sys_id FROM ' + table)
+                             if row['sys_id'] not in seen]
+                    self.delete(table, stale)
+
+                self.store.set_watermark(table, watermark, synced_at = started)
+
+        return self.status()
+
+    def age(self):
+        """Seconds since the older of the two tables was last synced, None if never synced."""
+        synced = [self.store.get_watermark(table)[1] for table in ['cmdb_ci', 'cmdb_rel_ci']]
+        if None in synced:
+            return None
+
+        return time.time() - min(synced)
+
+    def is_fresh(self):
+        age = self.age()
+
+        return age is not None and age <= self.max_staleness
+
+    def status(self):
+        tables = {}
+        conn = self.store.connection()
+        for table in ['cmdb_ci', 'cmdb_rel_ci']:
+            (watermark, synced_at) = self.store.get_watermark(table)
+            tables[table] = {
+                'rows': conn.execute('SELECT COUNT(*) FROM ' + table).fetchone()[0],
+                'watermark': watermark,
+                'synced_at': synced_at
+            }
+
+        age = self.age()
+        return {
+            'tables': tables,
+            'age_seconds': round(age, 1) if age is not None else None,
+            'max_staleness': self.max_staleness,
+            'fresh': self.is_fresh()
+        }
+
+    def _describe(self, entry, side, sys_id):
+        (name, sys_class_name, ip_address) = self._cis.get(sys_id, ('', '', ''))
+        entry[side + '.name'] = name
+        entry[side + '.sys_class_name'] = sys_class_name
+        entry[side + '.ip_address'] = ip_address
+
+    def fetch_relations(self, frontier, target):
+        """In-memory equivalent of cmdb_graph.fetch_relations."""
+        entries = []
+
+        with self._lock:
+            # Walking towards parents means the frontier sits on the child side of the relation
+            index = self._parents if target == 'parent' else self._children
+
+            for sys_id in frontier:
+                for rel_id in list(index.get(sys_id, {}).keys()):
+                    (parent, child, type_name) = self._relations[rel_id]
+
+                    entry = {'parent': parent, 'child': child, 'type.name': type_name}
+                    self._describe(entry, 'parent', parent)
+                    self._describe(entry, 'child', child)
+                    entries.append(CMDBRelation.from_dict(entry))
+
+        return entries
+
+    def start_background_sync(self, interval = DEFAULT_SYNC_INTERVAL):
+        if self._sync_thread is not None and self._sync_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"CMDB mirror sync failed - {str(e)}")
+
+                self._stop_event.wait(interval)
+
+        self._sync_thread = threading.Thread(target = run, name = 'cmdb-mirror-sync', daemon = True)
+        self._sync_thread.start()
+
+    def stop_background_sync(self):
+        self._stop_event.set()
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_cmdb_mirror():
+    global _mirror
+
+    with _mirror_lock:
+        if _mirror is None:
+            mim_conf = get_mim_conf()
+            _mirror = CMDBMirror(max_staleness = mim_conf.get('cmdb_mirror_max_staleness', DEFAULT_MAX_STALENESS))
+
+        return _mirror
+
+
+# Relation fetcher for a service-map walk: the mirror when fresh, otherwise None
+def mirror_relation_fetcher():
+    try:
+        mirror = get_cmdb_mirror()
+    except Exception as e:
+        print(f"CMDB mirror unavailable - {str(e)}")
+        return None
+
+    if mirror.is_fresh():
+        return mirror.fetch_relations
+
+    return None
+
+
+# CI name/IP index of the mirror when fresh, otherwise None
+def mirror_ci_index():
+    try:
+        mirror = get_cmdb_mirror()
+    except Exception as e:
+        print(f"CMDB mirror unavailable - {str(e)}")
+        return None
+
+    if mirror.is_fresh():
+        return mirror.ci_index
+
+    return None
@@ -33,7 +33,7 @@ class Configuration:
 
     # Function to update configuration to the database.
     def update_config(self, update_key, update_val, conditions):
-        data = self.db.update_data(
+        data = self.db_obj.update_data(
             table_name = "config",
             update_key = update_key,
             update_val = update_val,
@@ -43,7 +43,7 @@ class Configuration:
 
     # Function to delete configuration from the database.
     def delete_config(self, conditions):
-        data = self.db.delete_data(
+        data = self.db_obj.delete_data(
             table_name = "config",
             conditions = conditions
         )
@@ -0,0 +1,215 @@
+import os
+import threading
+import multiprocessing
+from html.parser import HTMLParser
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    from unstructured.partition.html import partition_html
+except ImportError:
+    partition_html = None
+
+DEFAULT_CACHE_SIZE = 5000
+
+# Below this many uncached articles a process pool costs more than it saves
+PROCESS_POOL_THRESHOLD = 32
+
+BLOCK_TAGS = ['p', 'div', 'br', 'li', 'tr', 'table', 'ul', 'ol', 'pre', 'blockquote', 'section', 'article',
+              'h1', 'h2', 'h3', 'h4', 'h5', 'h6']
+
+
+class _TextExtractor(HTMLParser):
+    """Plain-text fallback used when unstructured is missing or cannot parse the document."""
+    def __init__(self):
+        super().__init__(convert_charrefs = True)
+        self.blocks = []
+        self.current = []
+        self.skip = 0
+
+    def _flush(self):
+        text = ' '.join(''.join(self.current).split())
+        if text:
+            self.blocks.append(text)
+        self.current = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ['script', 'style']:
+            self.skip += 1
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_endtag(self, tag):
+        if tag in ['script', 'style']:
+            self.skip = max(self.skip - 1, 0)
+        elif tag in BLOCK_TAGS:
+            self._flush()
+
+    def handle_data(self, data):
+        if not self.skip:
+            self.current.append(data)
+
+    def text(self):
+        self._flush()
+        return '\n\n'.join(self.blocks)
+
+
+# Text of an HTML document, laid out as UnstructuredHTMLLoader does (elements separated by blank lines)
+def html_to_text(html):
+    if not html:
+        return ''
+
+    if partition_html is not None:
+        try:
+            return '\n\n'.join([str(element) for element in partition_html(text = html)])
+        except Exception as e:
+            print(f"HTML partitioning failed, using plain parser - {str(e)}")
+
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+
+    return parser.text()
+
+
+class HTMLTextConverter:
+    """
+        html_to_text with an LRU cache keyed by (sys_id, sys_updated_on).
+
+        An article is only converted again after it is edited on the instance.
+        Bulk conversions of uncached articles are spread over a process pool
+        since partitioning is CPU bound; the pool is started on first use and
+        kept for the life of the process, until close().
+    """
+    def __init__(self, cache_size = DEFAULT_CACHE_SIZE, workers = None):
+        self.cache_size = cache_size
+        self.workers = workers or os.cpu_count() or 1
+
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._pool = None
+        self._pool_pid = None
+        self._pool_lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return self._cache[key]
+
+            self.misses += 1
+            return None
+
+    def _put(self, key, text):
+        with self._lock:
+            self._cache[key] = text
+            self._cache.move_to_end(key)
+
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last = False)
+
+    def _process_pool(self):
+        with self._pool_lock:
+            # A forked child cannot use its parent's workers
+            if self._pool is None or self._pool_pid != os.getpid():
+                # spawn keeps worker start-up safe when called from a server thread
+                self._pool = ProcessPoolExecutor(max_workers = self.workers, mp_context = multiprocessing.get_context('spawn'))
+                self._pool_pid = os.getpid()
+
+            return self._pool
+
+    def _discard_pool(self, pool):
+        with self._pool_lock:
+            if self._pool is pool:
+                self._pool = None
+
+        pool.shutdown(wait = False, cancel_futures = True)
+
+    def close(self):
+        """Stop the worker processes; a later bulk conversion starts new ones."""
+        with self._pool_lock:
+            (pool, self._pool) = (self._pool, None)
+
+        if pool is not None and self._pool_pid == os.getpid():
+            pool.shutdown()
+
+    def convert(self, html, sys_id = None, sys_updated_on = None):
+        key = (sys_id, sys_updated_on) if sys_id else None
+
+        if key is not None:
+            text = self._get(key)
+            if text is not None:
+                return text
+
+        text = html_to_text(html)
+        if key is not None:
+            self._put(key, text)
+
+        return text
+
+    def convert_articles(self, articles, field = 'text', executor = None):
+        """
+            Replace the HTML in each article's field with its text, in place. Articles without HTML are left as is.
+
+            Large batches run on the converter's own process pool unless an
+            executor is passed.
+        """
+        pending = []
+        for article in articles:
+            if article.get(field) is None:
+                continue
+
+            key = (article.get('sys_id'), article.get('sys_updated_on'))
+            text = self._get(key) if key[0] else None
+
+            if text is None:
+                pending.append((article, key))
+            else:
+                article[field] = text
+
+        htmls = [article[field] for (article, _) in pending]
+
+        if executor is not None and htmls:
+            texts = list(executor.map(html_to_text, htmls, chunksize = max(len(htmls) // (self.workers * 4), 1)))
+        elif len(pending) >= PROCESS_POOL_THRESHOLD and self.workers > 1:
+            pool = self._process_pool()
+            try:
+                texts = list(pool.map(html_to_text, htmls, chunksize = max(len(htmls) // (self.workers * 4), 1)))
+            except BrokenProcessPool as e:
+                # A worker died; convert here and start a fresh pool next time
+                print(f"HTML conversion pool failed, converting in process - {str(e)}")
+                self._discard_pool(pool)
+                texts = [html_to_text(html) for html in htmls]
+        else:
+            texts = [html_to_text(html) for html in htmls]
+
+        for ((article, key), text) in zip(pending, texts):
+            article[field] = text
+            if key[0]:
+                self._put(key, text)
+
+        return articles
+
+    def stats(self):
+        with self._lock:
+            return {'size': len(self._cache), 'capacity': self.cache_size, 'hits': self.hits, 'misses': self.misses}
+
+
+_converter = None
+_converter_lock = threading.Lock()
+
+
+def get_html_converter():
+    global _converter
+
+    with _converter_lock:
+        if _converter is None:
+            _converter = HTMLTextConverter()
+
+        return _converter
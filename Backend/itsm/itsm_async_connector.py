@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import asyncio
+import datetime
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import CustomError, get_snow_settings
+from itsm.snow_async_client import get_async_snow_client
+from itsm.snow_attachments import async_upload_file
+from itsm.snow_query import build_time_window_query, build_range_query, build_conditions_query, is_valid_window, record_link
+from itsm.snow_stats import STATS_PATH, time_buckets, stats_params, parse_stats, merge_buckets
+from itsm.cmdb_graph import render_service_map, DEFAULT_MAX_DEPTH, DEFAULT_MAX_FANOUT
+from itsm.cmdb_lookup import async_get_cmdb_ci, async_resolve_cmdb_cis, async_get_service_map_graph
+from itsm.ci_index import DEFAULT_RESOLVE_LIMIT
+from itsm.ticket_mirror import mirror_ticket_records
+from itsm.snow_cache import get_snow_cache, cache_key
+from itsm.records import ticket_record
+
+# Mirror rows read per hop off the event loop
+MIRROR_FETCH_SIZE = 500
+
+# Ticket mirror reads share one thread, so every cursor is used on the connection that opened it
+_mirror_executor = None
+_mirror_executor_lock = threading.Lock()
+
+
+def _get_mirror_executor():
+    global _mirror_executor
+
+    with _mirror_executor_lock:
+        if _mirror_executor is None:
+            _mirror_executor = ThreadPoolExecutor(max_workers = 1, thread_name_prefix = 'ticket-mirror-read')
+
+        return _mirror_executor
+
+class AsyncITSM:
+    """
+        asyncio version of ITSM for async routes; method names and outputs match ITSM.
+
+        Build it with await AsyncITSM.create() on the event loop, so the
+        settings read (mim_conf.json and Vault) runs on a worker thread.
+    """
+    def __init__(self, settings = None):
+        if settings is None:
+            settings = get_snow_settings()
+        mim_conf = settings['mim_conf']
+
+        self.client = get_async_snow_client(settings['snow_url'], settings['snow_username'], settings['snow_password'],
+                                            proxies = settings['proxies'])
+
+        self.snow_url = self.client.snow_url
+        self.ke_category = mim_conf['ke_category_name']
+
+        self.cmdb_max_depth = mim_conf.get('cmdb_max_depth', DEFAULT_MAX_DEPTH)
+        self.cmdb_max_fanout = mim_conf.get('cmdb_max_fanout', DEFAULT_MAX_FANOUT)
+
+        # Same process-wide cache as ITSM
+        self.cache = get_snow_cache()
+
+    @classmethod
+    async def create(cls):
+        # Credentials may need a Vault read, so the constructor gets settings read off the loop
+        return cls(await asyncio.to_thread(get_snow_settings))
+
+    # Fetch list of incidents
+    async def get_ticket_details(self, table = 'incident', start_ts = None, end_ts = None, conditions = []):
+        return [ticket async for ticket in self.iter_ticket_details(table = table, start_ts = start_ts, end_ts = end_ts, conditions = conditions)]
+
+    # Stream incidents page by page
+    async def iter_ticket_details(self, table = 'incident', start_ts = None, end_ts = None, conditions = []):
+        fields = 'sys_id,number,short_description,description,close_notes'
+
+        async for ticket in self._iter_records(table, fields, start_ts, end_ts, conditions):
+            yield ticket
+
+    # Fetch list of change_request
+    async def get_change_request_details(self, table = 'change_request', start_ts = None, end_ts = None, conditions = []):
+        async def load():
+            return [ticket async for ticket in self.iter_change_request_details(table = table, start_ts = start_ts, end_ts = end_ts, conditions = conditions)]
+
+        # Only lookups by condition are cached; time-window listings can be large
+        if not conditions:
+            return await load()
+
+        return await self.cache.async_cached(table, cache_key(self.client, 'change_requests', start_ts, end_ts, conditions), load)
+
+    # Stream change requests page by page
+    async def iter_change_request_details(self, table = 'change_request', start_ts = None, end_ts = None, conditions = []):
+        fields = 'sys_id,number,short_description,description,implementation_plan,backout_plan,test_plan,assignment_group,start_date,end_date,state,chg_model,approval'
+
+        async for ticket in self._iter_records(table, fields, start_ts, end_ts, conditions):
+            yield ticket
+
+    async def _iter_records(self, table, fields, start_ts, end_ts, conditions):
+        query = ''
+
+        if start_ts != None and end_ts != None:
+            if not is_valid_window(start_ts, end_ts):
+                return
+
+            query = build_time_window_query(start_ts, end_ts)
+
+        if conditions:
+            query = build_conditions_query(conditions)
+
+        # Served from the local mirror when it is fresh and can answer the query. SQLite connections are
+        # per thread, so the query and its cursor stay on the mirror read thread, off the event loop
+        loop = asyncio.get_running_loop()
+        executor = _get_mirror_executor()
+
+        records = await loop.run_in_executor(executor, lambda: mirror_ticket_records(table, fields, start_ts = start_ts,
+                                                                                      end_ts = end_ts, conditions = conditions))
+        if records is not None:
+            try:
+                while True:
+                    batch = await loop.run_in_executor(executor, lambda: list(itertools.islice(records, MIRROR_FETCH_SIZE)))
+                    for ticket in batch:
+                        yield ticket_record(table, ticket, self.snow_url)
+
+                    if len(batch) < MIRROR_FETCH_SIZE:
+                        return
+            finally:
+                # An abandoned stream releases its cursor on the thread that opened it
+                await loop.run_in_executor(executor, records.close)
+
+        try:
+            async for ticket in self.client.iter_table(table, query = query, fields = fields):
+                yield ticket_record(table, ticket, self.snow_url)
+
+        except Exception as e:
+            raise CustomError(str(e))
+
+    # Ticket counts from the Aggregate API, see ITSM.get_ticket_stats
+    async def get_ticket_stats(self, table = 'incident', group_by = [], interval = None, start_ts = None, end_ts = None, conditions = []):
+        return await self.cache.async_cached(table, cache_key(self.client, 'stats', group_by, interval, start_ts, end_ts, conditions),
+                                             lambda: self._load_ticket_stats(table, group_by, interval, start_ts, end_ts, conditions))
+
+    async def _load_ticket_stats(self, table, group_by, interval, start_ts, end_ts, conditions):
+        query = build_conditions_query(conditions)
+
+        if start_ts != None and end_ts != None and not is_valid_window(start_ts, end_ts):
+            raise CustomError('end_ts should not be before start_ts')
+
+        output = {'table': table, 'group_by': group_by or [], 'interval': interval}
+
+        if interval:
+            if start_ts == None or end_ts == None:
+                raise CustomError('start_ts and end_ts are required with interval')
+
+            async def count(window):
+                stats = await self._count_tickets(table, build_range_query(window[0], window[1]) + query, group_by)
+                return dict({'start_ts': window[0], 'end_ts': window[1]}, **stats)
+
+            # The client scheduler bounds how many of these run at once
+            buckets = await asyncio.gather(*[count(window) for window in time_buckets(start_ts, end_ts, interval)])
+
+            output.update(merge_buckets(buckets))
+            output['buckets'] = list(buckets)
+        else:
+            if start_ts != None and end_ts != None:
+                query = build_time_window_query(start_ts, end_ts) + query
+
+            output.update(await self._count_tickets(table, query, group_by))
+
+        return output
+
+    async def _count_tickets(self, table, query, group_by):
+        response = await self.client.get(STATS_PATH + table, params = stats_params(query, group_by))
+        if response.status_code >= 400:
+            raise CustomError('ServiceNow returned ' + str(response.status_code) + ' - ' + response.text)
+
+        return parse_stats(response.json().get('result'), group_by)
+
+    # Update knowledge article
+    async def update_knowledge_article(self, sys_id, short_description = '', text = ''):
+        target_url = self.snow_url + '/api/now/table/kb_knowledge/'+ sys_id
+
+        payload = {}
+        payload['text'] = text
+
+        try:
+            response = await self.client.patch(target_url, content = json.dumps(payload))
+            result = response.json()['result']
+            output = {'number': result['number']}
+            output['target_link'] = record_link(self.snow_url, 'kb_knowledge', result['sys_id'])
+        except Exception as e:
+            raise CustomError(str(e))
+
+        self.cache.invalidate('kb_knowledge')
+
+        return output
+
+    # Obtain child or parent hierarchy of any CMDB element
+    async def get_parents_children(self, sys_id, target, service_map = None, max_depth = None, max_fanout = None):
+        if service_map is None:
+            service_map = []
+
+        graph = await self.get_service_map_graph([sys_id], target, max_depth = max_depth, max_fanout = max_fanout)
+        service_map += render_service_map(graph)
+
+        return service_map
+
+    # Nodes and edges reachable from the CIs in one direction, walked level by level
+    async def get_service_map_graph(self, sys_ids, target, max_depth = None, max_fanout = None):
+        if max_depth is None:
+            max_depth = self.cmdb_max_depth
+        if max_fanout is None:
+            max_fanout = self.cmdb_max_fanout
+
+        return await async_get_service_map_graph(self.client, self.cache, sys_ids, target, max_depth, max_fanout)
+
+    # Create Change Request
+    async def create_change_request(self, short_description, description = '', ci = '', chg_model = 'normal', implementation_plan = '', backout_plan = '', test_plan = '', risk_impact_analysis = '', attachments = []):
+        target_url = self.snow_url + '/api/now/table/change_request'
+
+        payload = {}
+        payload['short_description'] = short_description
+        payload['description'] = description
+        payload['cmdb_ci'] = ci
+        payload['chg_model'] = chg_model
+        payload['implementation_plan'] = implementation_plan
+        payload['backout_plan'] = backout_plan
+        payload['test_plan'] = test_plan
+        payload['risk_impact_analysis'] = risk_impact_analysis
+
+        payload['start_date'] = datetime.datetime.utcnow() + datetime.timedelta(minutes = 30)
+        payload['end_date'] = payload['start_date'] + datetime.timedelta(hours = 1)
+        payload['start_date'] = payload['start_date'].strftime('%Y-%m-%d %H:%M:%S')
+        payload['end_date'] = payload['end_date'].strftime('%Y-%m-%d %H:%M:%S')
+
+        try:
+            response = await self.client.post(target_url, content = json.dumps(payload))
+            result = response.json()['result']
+            output = {'number': result['number']}
+            output['target_link'] = record_link(self.snow_url, 'change_request', result['sys_id'])
+        except Exception as e:
+            return {}
+
+        self.cache.invalidate('change_request')
+
+        # Uploads stream concurrently on the shared connection pool
+        await asyncio.gather(*[self.attach_file(result['sys_id'], attachment) for attachment in attachments])
+
+        return output
+
+    async def attach_file(self, sys_id, file_name, file_type = None, table = 'change_request'):
+        result = await async_upload_file(self.client, table, sys_id, SCRIPT_PATH + '/static/' + file_name, content_type = file_type)
+        if result['error']:
+            print(file_name + ' - ' + result['error'])
+
+        return result
+
+    async def get_cmdb_ci(self, ci):
+        return await async_get_cmdb_ci(self.client, self.cache, ci)
+
+    # Resolve several CI names or IPs at once, see ITSM.resolve_cmdb_cis
+    async def resolve_cmdb_cis(self, cis, limit = DEFAULT_RESOLVE_LIMIT):
+        return await async_resolve_cmdb_cis(self.client, self.cache, cis, limit = limit)
@@ -2,220 +2,176 @@ import os
 
 import datetime
 import sys, traceback
+from concurrent.futures import ThreadPoolExecutor
 
 import json
-import requests
-
-from langchain_community.document_loaders import UnstructuredHTMLLoader
 
 SCRIPT_PATH = os.path.dirname(__file__)
 ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
 
 sys.path.append(ROOT_PATH)
 
-from vault import Vault
-
-class CustomError(Exception):
-    """Custom exception for application-specific errors."""
-    def __init__(self, message):
-        super().__init__(message)
-        self.message = message
+from itsm.snow_client import CustomError, get_snow_client, get_snow_settings
+from itsm.snow_attachments import upload_file, upload_files
+from itsm.snow_query import build_time_window_query, build_range_query, build_conditions_query, is_valid_window
+from itsm.snow_stats import STATS_PATH, time_buckets, stats_params, parse_stats, merge_buckets
+from itsm.html_text import get_html_converter
+from itsm.cmdb_graph import render_service_map, DEFAULT_MAX_DEPTH, DEFAULT_MAX_FANOUT
+from itsm.cmdb_lookup import get_cmdb_ci, resolve_cmdb_cis, get_service_map_graph
+from itsm.ci_index import DEFAULT_RESOLVE_LIMIT
+from itsm.ticket_mirror import mirror_ticket_records
+from itsm.snow_cache import get_snow_cache, cache_key
+from itsm.records import KBArticle, ticket_record
 
 class ITSM:
     def __init__(self):
-        conf_f_path = ROOT_PATH + '/config/mim_conf.json'
-
-        # Read configuration file
-        with open(conf_f_path) as conf_f:
-            mim_conf = json.load(conf_f)
-
-        self.snow_url = mim_conf['snow_url']
-
-        if self.snow_url.endswith('/'):
-            self.snow_url = self.snow_url[:-1]
-
-        # Initiate vault
-        vault_path = ROOT_PATH + '/config/.vault_token'
+        # Configuration, credentials and the pooled HTTP session are shared process-wide
+        settings = get_snow_settings()
+        mim_conf = settings['mim_conf']
 
-        vault_file = open(vault_path, 'r')
-        vault_token = vault_file.read().strip()
-        vault_file.close()
+        self.client = get_snow_client(settings['snow_url'], settings['snow_username'], settings['snow_password'],
+                                      proxies = settings['proxies'])
 
-        vault_url = mim_conf['vault_url']
-        self.vault_session = Vault(vault_url, vault_token)
+        self.snow_url = self.client.snow_url
+        self.snow_username = self.client.snow_username
+        self.snow_password = self.client.snow_password
 
         self.ke_category = mim_conf['ke_category_name']
+        self.proxies = settings['proxies']
 
-        if mim_conf['proxy_url']:
-            self.proxies = { 
-              "http"  : mim_conf['proxy_url'], 
-              "https" : mim_conf['proxy_url']
-            }
-        else:
-            self.proxies = None
-
-        snow_tag = mim_conf['snow_tag']
-
-        if self.snow_url.endswith('/'):
-            self.snow_url = self.snow_url[:-1]
-
-        snow_creds = self.vault_session.retrieve_secret(snow_tag)
-        if snow_creds[0]:
-            for k, v in snow_creds[1].items():
-                self.snow_username = k
-                self.snow_password = v
-        else:
-            self.snow_username = None
-            self.snow_password = None
-        
-        # self.snow_username = username
-        # self.snow_password = password
+        self.cmdb_max_depth = mim_conf.get('cmdb_max_depth', DEFAULT_MAX_DEPTH)
+        self.cmdb_max_fanout = mim_conf.get('cmdb_max_fanout', DEFAULT_MAX_FANOUT)
 
         self.headers = {'content-type': 'application/json'}
 
+        # Read-through cache shared by every client in the process
+        self.cache = get_snow_cache()
+
         
     # Fetch list of incidents
     def get_ticket_details(self, table = 'incident', start_ts = None, end_ts = None, conditions = []):
-        tickets = []
-        target_url = self.snow_url + '/api/now/table/' + table
+        return list(self.iter_ticket_details(table = table, start_ts = start_ts, end_ts = end_ts, conditions = conditions))
+
+    # Stream incidents page by page
+    def iter_ticket_details(self, table = 'incident', start_ts = None, end_ts = None, conditions = []):
+        fields = 'sys_id,number,short_description,description,close_notes'
 
-        filters = {}
+        yield from self._iter_records(table, fields, start_ts, end_ts, conditions)
 
+    def _iter_records(self, table, fields, start_ts, end_ts, conditions):
         query = ''
-        for condition in conditions:
-            query += '^' + condition['param'] + condition['op'] + condition['val']
 
         if start_ts != None and end_ts != None:
-            start_ts_obj = datetime.datetime.strptime(start_ts, '%Y-%m-%d %H:%M:%S')
-            end_ts_obj = datetime.datetime.strptime(end_ts, '%Y-%m-%d %H:%M:%S')
+            if not is_valid_window(start_ts, end_ts):
+                return
+
+            query = build_time_window_query(start_ts, end_ts)
 
-            if end_ts_obj < start_ts_obj:
-                return tickets
+        if conditions:
+            query = build_conditions_query(conditions)
 
-            [start_date, start_time] = start_ts.split(' ')
-            [end_date, end_time] = end_ts.split(' ')
+        # Served from the local mirror when it is fresh and can answer the query
+        records = mirror_ticket_records(table, fields, start_ts = start_ts, end_ts = end_ts, conditions = conditions)
 
-            filters['sysparm_query'] = 'sys_created_onBETWEEN' + \
-                    'javascript:gs.dateGenerate(\'' + start_date + '\',\'' + start_time + '\')@' + \
-                    'javascript:gs.dateGenerate(\'' + end_date + '\',\'' + end_time + '\')'
+        try:
+            if records is None:
+                records = self.client.iter_table(table, query = query, fields = fields)
 
-        if conditions != []:
-            filters['sysparm_query'] = query
+            for ticket in records:
+                yield ticket_record(table, ticket, self.snow_url)
 
-        filters['sysparm_fields'] = 'sys_id,number,short_description,description,close_notes'
+        except Exception as e:
+            raise CustomError(str(e))
 
-        filters['sysparm_display_value'] = 'true'
-        # filters['sysparm_exclude_reference_link'] = 'true'
 
-        if filters != {}:
-            target_url += '?'
+    def get_ticket_stats(self, table = 'incident', group_by = [], interval = None, start_ts = None, end_ts = None, conditions = []):
+        """
+            Ticket counts from the Aggregate API, without downloading the records.
 
-        for fl_nm, fl_val in filters.items():
-            target_url += fl_nm + '=' + fl_val + '&'
+            Counts are grouped by the group_by fields and, with interval
+            (hour/day/week/month), split into time buckets of sys_created_on
+            between start_ts and end_ts. Buckets are counted concurrently, one
+            call each.
+        """
+        return self.cache.cached(table, cache_key(self.client, 'stats', group_by, interval, start_ts, end_ts, conditions),
+                                 lambda: self._load_ticket_stats(table, group_by, interval, start_ts, end_ts, conditions))
 
-        target_url = target_url[:-1]
-    
-        try:
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    headers = self.headers, verify = False)
+    def _load_ticket_stats(self, table, group_by, interval, start_ts, end_ts, conditions):
+        query = build_conditions_query(conditions)
 
-        except Exception as e:
-            raise CustomError(str(e))
+        if start_ts != None and end_ts != None and not is_valid_window(start_ts, end_ts):
+            raise CustomError('end_ts should not be before start_ts')
 
-        try:
-            for ticket in response.json()['result']:
-                ticket['ticket_link'] = self.snow_url + '/now/nav/ui/classic/params/target/' + table + '.do%3Fsys_id%3D' + ticket['sys_id']
-                tickets.append(ticket)
-                
-        except Exception:
-            raise CustomError(str(e))
+        output = {'table': table, 'group_by': group_by or [], 'interval': interval}
 
-        return tickets
+        if interval:
+            if start_ts == None or end_ts == None:
+                raise CustomError('start_ts and end_ts are required with interval')
+
+            windows = time_buckets(start_ts, end_ts, interval)
+
+            def count(window):
+                stats = self._count_tickets(table, build_range_query(window[0], window[1]) + query, group_by)
+                return dict({'start_ts': window[0], 'end_ts': window[1]}, **stats)
+
+            with ThreadPoolExecutor(max_workers = max(min(self.client.batch_workers, len(windows)), 1)) as executor:
+                buckets = list(executor.map(count, windows))
+
+            output.update(merge_buckets(buckets))
+            output['buckets'] = buckets
+        else:
+            if start_ts != None and end_ts != None:
+                query = build_time_window_query(start_ts, end_ts) + query
+
+            output.update(self._count_tickets(table, query, group_by))
+
+        return output
+
+    def _count_tickets(self, table, query, group_by):
+        response = self.client.get(STATS_PATH + table, params = stats_params(query, group_by))
+        if response.status_code >= 400:
+            raise CustomError('ServiceNow returned ' + str(response.status_code) + ' - ' + response.text)
+
+        return parse_stats(response.json().get('result'), group_by)
 
 
     def get_kb_articles_details(self, conditions = []):
+        return self.cache.cached('kb_knowledge', cache_key(self.client, 'kb_articles', conditions),
+                                 lambda: self._load_kb_articles_details(conditions))
+
+    def _load_kb_articles_details(self, conditions):
         ke_sysid = ''
         query = ''
-        filters = {}
-        print("--------INSIDE GET KB ARTICLE ----------------")
 
         if conditions:
-            print("Inside CONDITIONS")
-            target_url = self.snow_url + '/api/now/table/kb_knowledge'
-            
-            for condition in conditions:
-                query += '^' + condition['param'] + condition['op'] + condition['val']
-            
-            filters['sysparm_query'] = query
+            query = build_conditions_query(conditions)
 
         else:    
             ke_url = self.snow_url + '/api/now/table/kb_knowledge_base?sysparm_query=title='+ self.ke_category + '&sysparm_fields=sys_id' 
             try:
-                response = requests.get(ke_url, auth = (self.snow_username, self.snow_password), \
-                    headers = self.headers, verify = False)
+                response = self.client.get(ke_url)
             
                 sysid = response.json()['result']
                 ke_sysid = sysid[0]['sys_id']
             except Exception as e:
-                #print(str(e))
                 raise CustomError(str(e))
 
-                #if number == None:
-        
-            target_url = self.snow_url + '/api/now/table/kb_knowledge?sysparm_query=kb_knowledge_base=' + ke_sysid
-
-        
-        if filters != {}:
-            target_url += '?'
-
-        filters['sysparm_fields'] = 'number,sys_id,category,short_description,text'
-
-        filters['sysparm_display_value'] = 'true'
-        #filters['sysparm_exclude_reference_link'] = 'true'
+            query = 'kb_knowledge_base=' + ke_sysid
 
+        fields = 'number,sys_id,category,short_description,text,sys_updated_on'
 
-        for fl_nm, fl_val in filters.items():
-            target_url += '&' + fl_nm + '=' + fl_val
-        
         try:
-            
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    headers = self.headers, verify = False)
-            
-            kb_articles = response.json()['result']
-            print(kb_articles)
-            
-        
+            kb_articles = list(self.client.iter_table('kb_knowledge', query = query, fields = fields))
         except Exception as e:
-            print("--/n EXCEPTION IN LINE 190-----")
             raise CustomError(str(e))
-        print("---/n/n BEFORE FOR LOOP -----")
-        for ind in range(len(kb_articles)):
-            f_path = SCRIPT_PATH + '/' + kb_articles[ind]['number'] + '.html'
-            f = open(f_path, 'w+')
-            try:
-                f.write(kb_articles[ind]['text'])
 
-                f.close()
-            except:
-                os.remove(f_path)
-                continue
-            # Parse HTML content of the document using langchain document loader
-            try:
-                print("/n line 205-------")
-                print(f"206---------{f_path}-------------")
-                loader = UnstructuredHTMLLoader(f_path)
-                data = loader.load()
-            except Exception as e:
-                print(f"------/n EXCEPTION FOR 209 {str(e)}---------")
-            print("\n\n")
-            print(data)
-            kb_articles[ind]['text'] = data[0].page_content
-            kb_articles[ind]['kb_link'] = self.snow_url + '/now/nav/ui/classic/params/target/kb_view.do%3Fsys_kb_id%3D' + kb_articles[ind]['sys_id']
+        # Convert the HTML bodies in memory; unchanged articles come from the cache
+        get_html_converter().convert_articles(kb_articles)
 
-            os.remove(f_path)
+        for kb_article in kb_articles:
+            kb_article.pop('sys_updated_on', None)
 
-        return kb_articles
+        return [KBArticle.from_dict(kb_article, self.snow_url) for kb_article in kb_articles]
 
 
     # Update knowledge article
@@ -229,8 +185,7 @@ class ITSM:
         
         print(target_url)
         try:
-            response = requests.patch(target_url, auth = (self.snow_username, self.snow_password), \
-                    data = json.dumps(payload), headers = self.headers, verify = False)
+            response = self.client.patch(target_url, data = json.dumps(payload))
             print(response.json())
             output = {'number': response.json()['result']['number']}
             output['target_link'] = self.snow_url + '/now/nav/ui/classic/params/target/kb_knowledge.do%3Fsys_id%3D' + response.json()['result']['sys_id']
@@ -238,132 +193,47 @@ class ITSM:
             raise CustomError(str(e))
             #output = {}
 
+        self.cache.invalidate('kb_knowledge')
+
         return output
 
 
     # Obtain child or parent hierarchy of any CMDB element
-    def get_parents_children(self, sys_id, target, service_map = []):
-        data = ''
-
-        target_url = self.snow_url + '/api/now/table/cmdb_rel_ci'
-        params = {
-                'sysparm_query': 'parent=' + sys_id + '^ORchild=' + sys_id,
-                'sysparm_fields': 'parent,child,type,parent.name,parent.sys_class_name,parent.ip_address,child.name,child.sys_class_name,child.ip_address,type.name'
-                }
-
-        if target == 'parent':
-            relation = 'child'
-        elif target == 'child':
-            relation = 'parent'
-
-        try:
-            direct_targets = []
-
-            output = requests.get(target_url, auth = (self.snow_username, self.snow_password),
-                                  params = params, headers = self.headers)
-
-            print(output)
-            output = output.json()['result']
-
-            for entry in output:
-                if (entry['parent.name'] == '' and entry['parent.sys_class_name'] == '') or (entry['child.name'] == '' and entry['child.sys_class_name'] == ''):
-                    continue
-
-                if entry[relation]['value'] == sys_id:
-                    direct_targets.append(entry[target])
-                    if 'parent.sys_class_name' in entry and entry['parent.sys_class_name'] != '':
-                        data += entry['parent.sys_class_name'] + ' '
-                    data += entry['parent.name'] + ' '
-
-                    if 'parent.ip_address' in entry and entry['parent.ip_address'] != '':
-                        data += 'with IP address ' + entry['parent.ip_address'] + ' '
-                        data += entry['type.name'].split(':')[0] + ' '
+    def get_parents_children(self, sys_id, target, service_map = None, max_depth = None, max_fanout = None):
+        if service_map is None:
+            service_map = []
 
-                    if 'child.sys_class_name' in entry and entry['child.sys_class_name'] != '':
-                        data += entry['child.sys_class_name'] + ' '
-                    data += entry['child.name'] + ' '
+        graph = self.get_service_map_graph([sys_id], target, max_depth = max_depth, max_fanout = max_fanout)
+        service_map += render_service_map(graph)
 
-                    if 'child.ip_address' in entry and entry["child.ip_address"] != '':
-                        data += 'with IP address ' + entry['child.ip_address']
+        return service_map
 
-                    if data.strip() != '':
-                        data += '\n'
+    # Nodes and edges reachable from the CIs in one direction, walked level by level
+    def get_service_map_graph(self, sys_ids, target, max_depth = None, max_fanout = None):
+        if max_depth is None:
+            max_depth = self.cmdb_max_depth
+        if max_fanout is None:
+            max_fanout = self.cmdb_max_fanout
 
-            # service_map.append({sys_id: direct_targets})
-            if data.strip() != '':
-                service_map.append(data)
-            for tg in direct_targets:
-                self.get_parents_children(tg['value'], target, service_map)
-
-            return service_map
-
-        except Exception as e:
-            #print(str(e))
-            #return []
-            raise CustomError(str(e))
+        return get_service_map_graph(self.client, self.cache, sys_ids, target, max_depth, max_fanout)
 
         
     # Fetch list of change_request
     def get_change_request_details(self, table = 'change_request', start_ts = None, end_ts = None, conditions = []):
-        change_requests = []
-        target_url = self.snow_url + '/api/now/table/' + table
-
-        filters = {}
-
-        query = ''
-        #for condition in conditions:
-        #    query += '^' + condition['param'] + condition['op'] + condition['val']
-
-        if start_ts != None and end_ts != None:
-            start_ts_obj = datetime.datetime.strptime(start_ts, '%Y-%m-%d %H:%M:%S')
-            end_ts_obj = datetime.datetime.strptime(end_ts, '%Y-%m-%d %H:%M:%S')
+        load = lambda: list(self.iter_change_request_details(table = table, start_ts = start_ts, end_ts = end_ts, conditions = conditions))
 
-            if end_ts_obj < start_ts_obj:
-                return change_requests
+        # Only lookups by condition are cached; time-window listings can be large
+        if not conditions:
+            return load()
 
-            [start_date, start_time] = start_ts.split(' ')
-            [end_date, end_time] = end_ts.split(' ')
-
-            filters['sysparm_query'] = 'sys_created_onBETWEEN' + \
-                    'javascript:gs.dateGenerate(\'' + start_date + '\',\'' + start_time + '\')@' + \
-                    'javascript:gs.dateGenerate(\'' + end_date + '\',\'' + end_time + '\')'
-
-        if conditions:
-            #filters['sysparm_query'] = query
-            for condition in conditions:
-                query += '^' + condition['param'] + condition['op'] + condition['val']
-            filters['sysparm_query'] = query
+        return self.cache.cached(table, cache_key(self.client, 'change_requests', start_ts, end_ts, conditions), load)
 
+    # Stream change requests page by page
+    def iter_change_request_details(self, table = 'change_request', start_ts = None, end_ts = None, conditions = []):
+        fields = 'sys_id,number,short_description,description,implementation_plan,backout_plan,test_plan,assignment_group,start_date,end_date,state,chg_model,approval'
 
-        filters['sysparm_fields'] = 'sys_id,number,short_description,description,implementation_plan,backout_plan,test_plan,assignment_group,start_date,end_date,state,chg_model,approval'
+        yield from self._iter_records(table, fields, start_ts, end_ts, conditions)
 
-        filters['sysparm_display_value'] = 'true'
-        # filters['sysparm_exclude_reference_link'] = 'true'
-
-        if filters != {}:
-            target_url += '?'
-
-        for fl_nm, fl_val in filters.items():
-            target_url += fl_nm + '=' + fl_val + '&'
-
-        target_url = target_url[:-1]
-        
-        try:
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    headers = self.headers, verify = False, proxies = self.proxies)
-
-        except Exception as e:
-            raise CustomError(str(e))
-
-        try:
-            for ticket in response.json()['result']:
-                ticket['ticket_link'] = self.snow_url + '/now/nav/ui/classic/params/target/' + table + '.do%3Fsys_id%3D' + ticket['sys_id']
-                change_requests.append(ticket)
-
-        except Exception:
-            raise CustomError(str(e))
-
-        return change_requests
 
     # Create Change Request
     def create_change_request(self, short_description, description = '', ci = '', chg_model = 'normal', implementation_plan = '', backout_plan = '', test_plan = '', risk_impact_analysis = '', attachments = []):
@@ -385,50 +255,40 @@ class ITSM:
         payload['end_date'] = payload['end_date'].strftime('%Y-%m-%d %H:%M:%S')
 
         try:
-            response = requests.post(target_url, auth = (self.snow_username, self.snow_password), \
-                    data = json.dumps(payload), headers = self.headers, verify = False)
-            output = {'number': response.json()['result']['number']}
-            output['target_link'] = self.snow_url + '/now/nav/ui/classic/params/target/change_request.do%3Fsys_id%3D' + response.json()['result']['sys_id']
+            response = self.client.post(target_url, data = json.dumps(payload))
+            result = response.json()['result']
+            output = {'number': result['number']}
+            output['target_link'] = self.snow_url + '/now/nav/ui/classic/params/target/change_request.do%3Fsys_id%3D' + result['sys_id']
         except Exception as e:
             output = {}
 
-        file_types = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'bmp': 'image/bmp'}
-        for attachment in attachments:
-            file_extension = attachment.split('.')[-1].lower().strip()
-            self.attach_file(response.json()['result']['sys_id'], attachment, file_types[file_extension.strip()])
+        self.cache.invalidate('change_request')
+
+        if output and attachments:
+            self.attach_files(result['sys_id'], attachments)
 
         return output
 
-    def attach_file(self, sys_id, file_name, file_type):
-        target_url = self.snow_url + '/api/now/attachment/upload'
-        payload = {'table_name': 'change_request', 'table_sys_id': sys_id}
+    # Attach files from static/ concurrently, one result per file
+    def attach_files(self, sys_id, file_names, table = 'change_request'):
+        results = upload_files(self.client, table, sys_id, [SCRIPT_PATH + '/static/' + file_name for file_name in file_names])
+        for (file_name, result) in zip(file_names, results):
+            if result['error']:
+                print(file_name + ' - ' + result['error'])
 
-        files = {'file': (file_name, open(SCRIPT_PATH + '/static/' + file_name, 'rb'), file_type, {'Expires': '0'})}
-        print(files)
+        return results
 
-        try:
-            response = requests.post(target_url, auth = (self.snow_username, self.snow_password),
-                                     data = payload, files = files)
-        except Exception as e:
-            print(e)
-            pass
+    def attach_file(self, sys_id, file_name, file_type, table = 'change_request'):
+        result = upload_file(self.client, table, sys_id, SCRIPT_PATH + '/static/' + file_name, content_type = file_type)
+        if result['error']:
+            print(file_name + ' - ' + result['error'])
 
-    def get_cmdb_ci(self, ci):
-        target_url = self.snow_url + '/api/now/table/cmdb_ci'
+        return result
 
-        params = {}
-        params['sysparm_query'] = 'nameLIKE' + ci + '^ORip_address=' + ci
-        params['sysparm_display_value'] = 'true'
-
-        try:
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    params = params, headers = self.headers, verify = False)
-            output = response.json()['result']
-
-            if type(output) == dict:
-                output = [output]
-        except Exception:
-            output = []
+    def get_cmdb_ci(self, ci):
+        return get_cmdb_ci(self.client, self.cache, ci)
 
-        return output
+    # Resolve several CI names or IPs at once, {ci: ranked matches}
+    def resolve_cmdb_cis(self, cis, limit = DEFAULT_RESOLVE_LIMIT):
+        return resolve_cmdb_cis(self.client, self.cache, cis, limit = limit)
 
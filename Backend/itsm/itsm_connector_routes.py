@@ -1,12 +1,23 @@
 import os
 import traceback
 
-from fastapi import APIRouter
-from typing import List, Optional 
-from pydantic import Field, BaseModel, model_validator
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Request
+from starlette.concurrency import run_in_threadpool
+from typing import List, Literal, Optional 
+from pydantic import Field, BaseModel, ValidationError, model_validator
+from fastapi.responses import JSONResponse, StreamingResponse
 
 from .itsm_connector import *
+from .itsm_async_connector import AsyncITSM
+from .snow_client import get_pool_stats, get_snow_settings
+from .snow_async_client import get_async_pool_stats
+from .cmdb_mirror import get_cmdb_mirror
+from .ticket_mirror import get_ticket_mirror
+from .reference_data import get_reference_data
+from .snow_webhook import SIGNATURE_HEADER, WEBHOOK_TABLES, get_webhook_processor, verify_signature
+from .snow_cache import get_snow_cache
+from .records import to_json
+from vault import vault_cache_stats
 #from .change_management import ChangeManagement
 #import tech_buddy_autogen as tech_buddy
 
@@ -19,6 +30,15 @@ mim_conf_file = open(mim_conf_path, 'r')
 mim_conf = json.load(mim_conf_file)
 mim_conf_file.close()
 
+# Serialise records as newline-delimited JSON, reporting failures as a final error line
+async def ndjson_lines(records):
+    try:
+        async for record in records:
+            yield json.dumps(to_json(record)) + '\n'
+    except Exception as e:
+        traceback.print_exc()
+        yield json.dumps({"error": {"data": {}, "message": str(e)}}) + '\n'
+
 class GetTicketPayload(BaseModel):
     start_ts: Optional[str] = Field(None, description = "Start time should be in %Y-%m-%d %H:%M:%S format")
     end_ts: Optional[str] = Field(None, description = "End time should be in %Y-%m-%d %H:%M:%S format")
@@ -43,6 +63,45 @@ class CMDB_Payload(BaseModel):
     target: str = Field(..., description = "Parent / Child")
     service_map: Optional[list] = Field([], description = "service map of CI")
 
+class ServiceMapGraphPayload(BaseModel):
+    sys_ids: List[str] = Field(..., description = "CI sys_ids to start from")
+    target: str = Field(..., description = "Parent / Child")
+    max_depth: Optional[int] = Field(None, description = "Maximum number of hops to walk")
+    max_fanout: Optional[int] = Field(None, description = "Maximum relations followed per CI")
+
+class TicketStatsPayload(BaseModel):
+    table: str = Field('incident', description = "Table to count, e.g. incident or change_request")
+    group_by: Optional[List[str]] = Field(None, description = "Fields to group counts by, e.g. state, assignment_group, priority")
+    interval: Optional[str] = Field(None, description = "Time bucket on sys_created_on: hour, day, week or month; needs start_ts and end_ts")
+    start_ts: Optional[str] = Field(None, description = "Start time should be in %Y-%m-%d %H:%M:%S format")
+    end_ts: Optional[str] = Field(None, description = "End time should be in %Y-%m-%d %H:%M:%S format")
+    conditions: Optional[List[dict]] = Field(None, description = 'Referance [{"param": "column name", "op": "opetation to be performed", "val": "value"}]')
+
+class CmdbMirrorSyncPayload(BaseModel):
+    full: bool = Field(False, description = "Re-read every row and drop rows deleted on the instance")
+
+class TicketMirrorSyncPayload(BaseModel):
+    table: Optional[str] = Field(None, description = "incident or change_request, both when omitted")
+    backfill: bool = Field(False, description = "Reload records created between start_ts and end_ts")
+    start_ts: Optional[str] = Field(None, description = "Backfill start time in '%Y-%m-%d %H:%M:%S' UTC, full history when omitted")
+    end_ts: Optional[str] = Field(None, description = "Backfill end time in '%Y-%m-%d %H:%M:%S' UTC, now when omitted")
+
+class ResolveCIsPayload(BaseModel):
+    cis: List[str] = Field(..., description = "CI names or IPs to resolve")
+    limit: Optional[int] = Field(5, description = "Maximum matches per CI")
+
+class WebhookEvent(BaseModel):
+    table: str = Field(..., description = "Table of the changed record")
+    operation: Literal['insert', 'update', 'delete'] = Field(..., description = "insert, update or delete")
+    sys_id: str = Field(..., pattern = '^[0-9a-f]{32}$', description = "sys_id of the changed record")
+    number: Optional[str] = Field(None, description = "Record number, used to remove KB articles loaded before sys_ids were stored")
+
+class WebhookPayload(BaseModel):
+    events: List[WebhookEvent] = Field(..., description = "Record-change events")
+
+class ReferenceDataSyncPayload(BaseModel):
+    full: bool = Field(False, description = "Re-read every row and drop rows deleted on the instance")
+
 class CmdbCIPayload(BaseModel):
     ci: str = Field(..., description = "CI name or IP")
 
@@ -74,9 +133,9 @@ class CreateChangewithImapactPayload(BaseModel):
 async def get_ticket_details(payload: GetTicketPayload) -> dict:
     response = {}
     try:
-        itsm_obj = ITSM()
+        itsm_obj = await AsyncITSM.create()
 
-        data = itsm_obj.get_ticket_details(start_ts = payload.start_ts , end_ts = payload.end_ts, conditions = payload.conditions)
+        data = to_json(await itsm_obj.get_ticket_details(start_ts = payload.start_ts , end_ts = payload.end_ts, conditions = payload.conditions))
 
         response['output'] = {"data": data, "message":'Tickets retrieved successfully'}
         response['code'] = 200
@@ -91,6 +150,47 @@ async def get_ticket_details(payload: GetTicketPayload) -> dict:
 
         return JSONResponse(status_code = 500, content = response)
 
+@router.post(f"/api/{mim_conf['api_version']}/get_ticket_details_stream/", status_code=200)
+async def get_ticket_details_stream(payload: GetTicketPayload):
+    response = {}
+    try:
+        itsm_obj = await AsyncITSM.create()
+
+        records = itsm_obj.iter_ticket_details(start_ts = payload.start_ts , end_ts = payload.end_ts, conditions = payload.conditions)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+    # Errors once streaming has started are reported in-band by ndjson_lines
+    return StreamingResponse(ndjson_lines(records), media_type = 'application/x-ndjson')
+
+@router.post(f"/api/{mim_conf['api_version']}/get_ticket_stats/", status_code=200)
+async def get_ticket_stats(payload: TicketStatsPayload) -> dict:
+    response = {}
+    try:
+        itsm_obj = await AsyncITSM.create()
+
+        data = await itsm_obj.get_ticket_stats(table = payload.table, group_by = payload.group_by, interval = payload.interval,
+                                               start_ts = payload.start_ts, end_ts = payload.end_ts, conditions = payload.conditions)
+
+        response['output'] = {"data": data, "message":'Ticket statistics retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
 @router.post(f"/api/{mim_conf['api_version']}/get_kb_articles_details/", status_code=200)
 async def get_kb_articles_details(payload: KnowledgePayload) -> dict:
     response = {}
@@ -101,7 +201,8 @@ async def get_kb_articles_details(payload: KnowledgePayload) -> dict:
         # print(payload.conditions)
         itsm_obj = ITSM()
   
-        data = itsm_obj.get_kb_articles_details(conditions = payload.conditions)
+        # HTML conversion is CPU bound, keep it off the event loop
+        data = to_json(await run_in_threadpool(itsm_obj.get_kb_articles_details, conditions = payload.conditions))
         print(data)
         print("---2-----")
 
@@ -130,9 +231,9 @@ async def get_kb_articles_details(payload: KnowledgePayload) -> dict:
 async def update_knowledge_article(payload: UpdateKnowledgePayload) -> dict:
     response = {}
     try:
-        itsm_obj = ITSM()
+        itsm_obj = await AsyncITSM.create()
 
-        data = itsm_obj.update_knowledge_article(sys_id = payload.sys_id, text = payload.text)
+        data = await itsm_obj.update_knowledge_article(sys_id = payload.sys_id, text = payload.text)
 
         print(data)
         response['code'] = 200
@@ -160,9 +261,9 @@ async def update_knowledge_article(payload: UpdateKnowledgePayload) -> dict:
 async def get_parents_children(payload: CMDB_Payload) -> dict:
     response = {}
     try:
-        itsm_obj = ITSM()
+        itsm_obj = await AsyncITSM.create()
 
-        output = itsm_obj.get_parents_children(payload.sys_id, payload.target, payload.service_map)
+        output = await itsm_obj.get_parents_children(payload.sys_id, payload.target, payload.service_map)
 
         response['output'] = {"data": output, "message":'Retrieved Hierarchy Successfully'}
         response['code'] = 200
@@ -177,13 +278,34 @@ async def get_parents_children(payload: CMDB_Payload) -> dict:
 
         return JSONResponse(status_code = 500, content = response)
 
+@router.post(f"/api/{mim_conf['api_version']}/get_service_map_graph/", status_code=200)
+async def get_service_map_graph(payload: ServiceMapGraphPayload) -> dict:
+    response = {}
+    try:
+        itsm_obj = await AsyncITSM.create()
+
+        output = await itsm_obj.get_service_map_graph(payload.sys_ids, payload.target, max_depth = payload.max_depth, max_fanout = payload.max_fanout)
+
+        response['output'] = {"data": output, "message":'Retrieved Service Map Successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
 @router.post(f"/api/{mim_conf['api_version']}/get_change_request_details/", status_code=200)
 async def get_change_request_details(payload: ChangePayload) -> dict:
     response = {}
     try:
-        itsm_obj = ITSM()
+        itsm_obj = await AsyncITSM.create()
 
-        data = itsm_obj.get_change_request_details(start_ts = payload.start_ts , end_ts = payload.end_ts, conditions = payload.conditions)
+        data = to_json(await itsm_obj.get_change_request_details(start_ts = payload.start_ts , end_ts = payload.end_ts, conditions = payload.conditions))
 
         #response['output'] = {"data": output, "message":'Change request details Retrieved Successfully'}
         response['code'] = 200
@@ -204,13 +326,32 @@ async def get_change_request_details(payload: ChangePayload) -> dict:
 
         return JSONResponse(status_code = 500, content = response)
 
+@router.post(f"/api/{mim_conf['api_version']}/get_change_request_details_stream/", status_code=200)
+async def get_change_request_details_stream(payload: ChangePayload):
+    response = {}
+    try:
+        itsm_obj = await AsyncITSM.create()
+
+        records = itsm_obj.iter_change_request_details(start_ts = payload.start_ts , end_ts = payload.end_ts, conditions = payload.conditions)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+    # Errors once streaming has started are reported in-band by ndjson_lines
+    return StreamingResponse(ndjson_lines(records), media_type = 'application/x-ndjson')
+
 @router.post(f"/api/{mim_conf['api_version']}/get_cmdb_ci_details/", status_code=200)
 async def get_cmdb_ci(payload: CmdbCIPayload) -> dict:
     response = {}
     try:
-        itsm_obj = ITSM()
+        itsm_obj = await AsyncITSM.create()
 
-        output = itsm_obj.get_cmdb_ci(payload.ci)
+        output = await itsm_obj.get_cmdb_ci(payload.ci)
 
         response['output'] = {"data": output, "message":'CI  details Retrieved Successfully'}
         response['code'] = 200
@@ -225,6 +366,269 @@ async def get_cmdb_ci(payload: CmdbCIPayload) -> dict:
 
         return JSONResponse(status_code = 500, content = response)
 
+@router.post(f"/api/{mim_conf['api_version']}/resolve_cmdb_cis/", status_code=200)
+async def resolve_cmdb_cis(payload: ResolveCIsPayload) -> dict:
+    response = {}
+    try:
+        itsm_obj = await AsyncITSM.create()
+
+        output = await itsm_obj.resolve_cmdb_cis(payload.cis, limit = payload.limit)
+
+        response['output'] = {"data": output, "message":'CIs resolved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.post(f"/api/{mim_conf['api_version']}/snow_webhook/", status_code=202)
+async def snow_webhook(request: Request) -> dict:
+    response = {}
+    try:
+        body = await request.body()
+
+        settings = await run_in_threadpool(get_snow_settings)
+        if not verify_signature(settings.get('webhook_secret'), body, request.headers.get(SIGNATURE_HEADER)):
+            response['error'] = {"data": {}, "message": 'Invalid webhook signature'}
+            response['code'] = 401
+
+            return JSONResponse(status_code = 401, content = response)
+
+        try:
+            payload = WebhookPayload.model_validate_json(body)
+        except ValidationError as e:
+            response['error'] = {"data": {}, "message": str(e)}
+            response['code'] = 422
+
+            return JSONResponse(status_code = 422, content = response)
+
+        events = [event.model_dump() for event in payload.events if event.table in WEBHOOK_TABLES]
+
+        # Applied in the background; a full queue asks ServiceNow to retry later
+        if not get_webhook_processor().submit(events):
+            response['error'] = {"data": {}, "message": 'Webhook queue is full, retry later'}
+            response['code'] = 503
+
+            return JSONResponse(status_code = 503, content = response)
+
+        response['output'] = {"data": {"accepted": len(events), "ignored": len(payload.events) - len(events)}, "message": 'Events accepted'}
+        response['code'] = 202
+
+        return JSONResponse(status_code = 202, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_webhook_stats/", status_code=200)
+async def get_webhook_stats() -> dict:
+    response = {}
+    try:
+        stats = get_webhook_processor().stats()
+
+        response['output'] = {"data": stats, "message": 'Webhook stats retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_snow_pool_stats/", status_code=200)
+async def get_snow_pool_stats() -> dict:
+    response = {}
+    try:
+        stats = {"sync": get_pool_stats(), "async": get_async_pool_stats()}
+
+        response['output'] = {"data": stats, "message": 'ServiceNow connection pool stats retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_snow_cache_stats/", status_code=200)
+async def get_snow_cache_stats() -> dict:
+    response = {}
+    try:
+        stats = get_snow_cache().stats()
+
+        response['output'] = {"data": stats, "message": 'ServiceNow cache stats retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_vault_cache_stats/", status_code=200)
+async def get_vault_cache_stats() -> dict:
+    response = {}
+    try:
+        stats = vault_cache_stats()
+
+        response['output'] = {"data": stats, "message": 'Vault secret cache stats retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_cmdb_mirror_status/", status_code=200)
+async def get_cmdb_mirror_status() -> dict:
+    response = {}
+    try:
+        status = await run_in_threadpool(lambda: get_cmdb_mirror().status())
+
+        response['output'] = {"data": status, "message": 'CMDB mirror status retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.post(f"/api/{mim_conf['api_version']}/sync_cmdb_mirror/", status_code=200)
+async def sync_cmdb_mirror(payload: CmdbMirrorSyncPayload) -> dict:
+    response = {}
+    try:
+        status = await run_in_threadpool(lambda: get_cmdb_mirror().sync(full = payload.full))
+
+        response['output'] = {"data": status, "message": 'CMDB mirror synced successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_ticket_mirror_status/", status_code=200)
+async def get_ticket_mirror_status() -> dict:
+    response = {}
+    try:
+        status = await run_in_threadpool(lambda: get_ticket_mirror().status())
+
+        response['output'] = {"data": status, "message": 'Ticket mirror status retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.post(f"/api/{mim_conf['api_version']}/sync_ticket_mirror/", status_code=200)
+async def sync_ticket_mirror(payload: TicketMirrorSyncPayload) -> dict:
+    response = {}
+    try:
+        mirror = get_ticket_mirror()
+
+        def run():
+            if payload.backfill:
+                for table in [payload.table] if payload.table else ['incident', 'change_request']:
+                    mirror.backfill(table, start_ts = payload.start_ts, end_ts = payload.end_ts)
+
+            return mirror.sync(payload.table)
+
+        status = await run_in_threadpool(run)
+
+        response['output'] = {"data": status, "message": 'Ticket mirror synced successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.get(f"/api/{mim_conf['api_version']}/get_reference_data_status/", status_code=200)
+async def get_reference_data_status() -> dict:
+    response = {}
+    try:
+        status = await run_in_threadpool(lambda: get_reference_data().status())
+
+        response['output'] = {"data": status, "message": 'Reference data status retrieved successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
+@router.post(f"/api/{mim_conf['api_version']}/sync_reference_data/", status_code=200)
+async def sync_reference_data(payload: ReferenceDataSyncPayload) -> dict:
+    response = {}
+    try:
+        status = await run_in_threadpool(lambda: get_reference_data().sync(full = payload.full))
+
+        response['output'] = {"data": status, "message": 'Reference data synced successfully'}
+        response['code'] = 200
+
+        return JSONResponse(status_code = 200, content = response)
+
+    except Exception as e:
+        response['error'] = {"data": {}, "message": str(e)}
+        response['code'] = 500
+
+        traceback.print_exc()
+
+        return JSONResponse(status_code = 500, content = response)
+
 '''
 @router.post(f"/api/{mim_conf['api_version']}/draft_change_prompt/", status_code=200)
 async def draft_change_prompt(payload: DraftChangePayload) -> dict:
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import sqlite3
+import threading
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import get_mim_conf
+
+DEFAULT_STORE_PATH = SCRIPT_PATH + '/local_store.sqlite3'
+
+
+class LocalStore:
+    """
+        SQLite file holding local mirrors of ServiceNow tables.
+
+        Each thread gets its own connection; WAL mode lets readers run while
+        a sync is writing. Sync progress is kept per table in sync_state.
+    """
+    def __init__(self, path = DEFAULT_STORE_PATH):
+        self.path = path
+        self._local = threading.local()
+
+        with self.connection() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS sync_state (
+                    table_name TEXT PRIMARY KEY,
+                    watermark TEXT,
+                    synced_at REAL
+                )
+            ''')
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout = 30)
+            conn.row_factory = sqlite3.Row
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+
+        return conn
+
+    def get_watermark(self, table_name):
+        row = self.connection().execute('SELECT watermark, synced_at FROM sync_state WHERE table_name = ?',
+                                        (table_name,)).fetchone()
+        if row is None:
+            return (None, None)
+
+        return (row['watermark'], row['synced_at'])
+
+    def set_watermark(self, table_name, watermark, synced_at = None):
+        with self.connection() as conn:
+            conn.execute('''
+                INSERT INTO sync_state (table_name, watermark, synced_at) VALUES (?, ?, ?)
+                ON CONFLICT(table_name) DO UPDATE SET watermark = excluded.watermark, synced_at = excluded.synced_at
+            ''', (table_name, watermark, synced_at if synced_at is not None else time.time()))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_local_store():
+    global _store
+
+    with _store_lock:
+        if _store is None:
+            mim_conf = get_mim_conf()
+            _store = LocalStore(mim_conf.get('local_store_path') or DEFAULT_STORE_PATH)
+
+        return _store
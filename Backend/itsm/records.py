@@ -0,0 +1,225 @@
+import os
+import sys
+from operator import attrgetter
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_query import record_link, kb_link
+
+class _Missing:
+    """Slot value of a field the source record did not carry, left out of to_dict()."""
+    __slots__ = ()
+
+    def __repr__(self):
+        return '<missing>'
+
+    # Unpickles, including in spawned worker processes, to this module's singleton
+    def __reduce__(self):
+        return '_MISSING'
+
+
+_MISSING = _Missing()
+
+
+def _attr(key):
+    return key.replace('.', '_')
+
+
+class Record:
+    """
+        Compact, read-only view of one ServiceNow row.
+
+        Each subclass lists the JSON keys it holds in FIELDS and stores them in
+        __slots__ (dotted keys such as assignment_group.name become
+        assignment_group_name), so a record costs a fraction of the dict it
+        replaces. Keys outside FIELDS are kept in a small side dict. The link
+        field (ticket_link, kb_link) is built from sys_id only when it is read
+        or serialised.
+
+        Records support the dict reads callers already use (record['number'],
+        record.get(...), in, keys()), and to_dict() gives back the exact dict
+        the routes have always returned.
+    """
+    __slots__ = ('_snow_url', '_extra')
+
+    FIELDS = ()
+    LINK_KEY = None
+
+    _ATTRS = {}
+    _values = staticmethod(lambda record: ())
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+
+        cls._ATTRS = {key: _attr(key) for key in cls.FIELDS}
+
+        # attrgetter returns a bare value for a single name, so it needs at least two
+        if len(cls.FIELDS) > 1:
+            cls._values = attrgetter(*cls._ATTRS.values())
+
+    @classmethod
+    def from_dict(cls, data, snow_url = ''):
+        record = cls.__new__(cls)
+        record._snow_url = snow_url
+
+        for (key, attr) in cls._ATTRS.items():
+            setattr(record, attr, data.get(key, _MISSING))
+
+        extra = {key: value for (key, value) in data.items() if key not in cls._ATTRS and key != cls.LINK_KEY}
+        record._extra = extra or None
+
+        return record
+
+    def link(self):
+        return None
+
+    def to_dict(self):
+        output = {key: value for (key, value) in zip(self.FIELDS, self._values(self)) if value is not _MISSING}
+
+        if self._extra:
+            output.update(self._extra)
+
+        if self.LINK_KEY is not None:
+            output[self.LINK_KEY] = self.link()
+
+        return output
+
+    # Dict-style reads
+    def __getitem__(self, key):
+        attr = self._ATTRS.get(key)
+        if attr is not None:
+            value = getattr(self, attr)
+            if value is not _MISSING:
+                return value
+
+        elif key == self.LINK_KEY:
+            return self.link()
+
+        elif self._extra and key in self._extra:
+            return self._extra[key]
+
+        raise KeyError(key)
+
+    def get(self, key, default = None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+            return True
+        except KeyError:
+            return False
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __eq__(self, other):
+        if isinstance(other, (Record, dict)):
+            return self.to_dict() == (other.to_dict() if isinstance(other, Record) else other)
+
+        return NotImplemented
+
+    def __repr__(self):
+        return type(self).__name__ + '(' + repr(self.to_dict()) + ')'
+
+    # Cached values are deep-copied on every read; the slots only hold JSON values
+    def __deepcopy__(self, memo):
+        record = type(self).__new__(type(self))
+        record._snow_url = self._snow_url
+        record._extra = dict(self._extra) if self._extra else None
+
+        for attr in self._ATTRS.values():
+            value = getattr(self, attr)
+            setattr(record, attr, dict(value) if isinstance(value, dict) else value)
+
+        return record
+
+
+class Ticket(Record):
+    __slots__ = ()
+
+    TABLE = None
+    LINK_KEY = 'ticket_link'
+
+    def link(self):
+        return record_link(self._snow_url, self.TABLE, self['sys_id'])
+
+    @property
+    def ticket_link(self):
+        return self.link()
+
+
+class Incident(Ticket):
+    FIELDS = ('sys_id', 'number', 'short_description', 'description', 'close_notes')
+    __slots__ = tuple([_attr(key) for key in FIELDS])
+
+    TABLE = 'incident'
+
+
+class ChangeRequest(Ticket):
+    FIELDS = ('sys_id', 'number', 'short_description', 'description', 'implementation_plan', 'backout_plan', 'test_plan',
+              'assignment_group', 'start_date', 'end_date', 'state', 'chg_model', 'approval')
+    __slots__ = tuple([_attr(key) for key in FIELDS])
+
+    TABLE = 'change_request'
+
+
+class KBArticle(Record):
+    FIELDS = ('number', 'sys_id', 'category', 'short_description', 'text')
+    __slots__ = tuple([_attr(key) for key in FIELDS])
+
+    LINK_KEY = 'kb_link'
+
+    def link(self):
+        return kb_link(self._snow_url, self['sys_id'])
+
+    @property
+    def kb_link(self):
+        return self.link()
+
+
+class ChangeTask(Record):
+    FIELDS = ('number', 'short_description', 'assignment_group.name')
+    __slots__ = tuple([_attr(key) for key in FIELDS])
+
+
+class CMDBRelation(Record):
+    FIELDS = ('parent', 'child', 'type', 'type.name', 'parent.name', 'parent.sys_class_name', 'parent.ip_address',
+              'child.name', 'child.sys_class_name', 'child.ip_address')
+    __slots__ = tuple([_attr(key) for key in FIELDS])
+
+
+TICKET_RECORDS = {'incident': Incident, 'change_request': ChangeRequest}
+
+
+# Ticket record for a table, or the row itself (with its link) for tables without a record class
+def ticket_record(table, data, snow_url):
+    record_class = TICKET_RECORDS.get(table)
+    if record_class is None:
+        data['ticket_link'] = record_link(snow_url, table, data['sys_id'])
+        return data
+
+    return record_class.from_dict(data, snow_url)
+
+
+# JSON-ready form of a record, list of records or plain value
+def to_json(value):
+    if isinstance(value, Record):
+        return value.to_dict()
+
+    if isinstance(value, list):
+        return [to_json(item) for item in value]
+
+    return value
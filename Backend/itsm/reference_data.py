@@ -0,0 +1,283 @@
+import os
+import re
+import sys
+import time
+import threading
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import get_snow_client, get_mim_conf
+from itsm.local_store import get_local_store
+
+# Dictionary older than this is not used; callers fall back to server-side resolution
+DEFAULT_MAX_STALENESS = 7200
+DEFAULT_SYNC_INTERVAL = 900
+
+# Dictionaries kept locally: source table, optional filter and the columns holding the name and an alternate name.
+# CI classes are tables, so their dictionary maps labels to sys_db_object rows whose alias is the class table name.
+REFERENCE_TABLES = {
+    'sys_user_group': {'source': 'sys_user_group', 'query': '', 'name': 'name', 'alias': None},
+    'sys_user': {'source': 'sys_user', 'query': '', 'name': 'name', 'alias': 'user_name'},
+    'cmdb_ci_class': {'source': 'sys_db_object', 'query': 'nameSTARTSWITHcmdb_ci', 'name': 'label', 'alias': 'name'}
+}
+
+SYNC_BATCH_SIZE = 1000
+
+SYS_ID_PATTERN = re.compile('^[0-9a-f]{32}$')
+
+
+class ReferenceData:
+    """
+        Local name <-> sys_id dictionary for users, groups and CI classes.
+
+        Lets writes send sys_ids instead of display names and lets reads ask
+        for raw values (sysparm_display_value=false), so the instance does not
+        resolve references on every call. Synced incrementally on
+        sys_updated_on like the CMDB mirror. Names that match more than one row
+        are treated as unknown.
+    """
+    def __init__(self, store = None, client = None, max_staleness = DEFAULT_MAX_STALENESS):
+        self.store = store or get_local_store()
+        self.client = client or get_snow_client()
+        self.max_staleness = max_staleness
+
+        with self.store.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS reference_data (
+                    ref_table TEXT,
+                    sys_id TEXT,
+                    name TEXT,
+                    alias TEXT,
+                    sys_updated_on TEXT,
+                    PRIMARY KEY (ref_table, sys_id)
+                )
+            ''')
+
+        self._lock = threading.RLock()
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+        self._stop_event = threading.Event()
+
+        self._load_index()
+
+    def _load_index(self):
+        with self._lock:
+            self._names = {table: {} for table in REFERENCE_TABLES}
+            self._ids = {table: {} for table in REFERENCE_TABLES}
+
+            for row in self.store.connection().execute('SELECT ref_table, sys_id, name, alias FROM reference_data'):
+                if row['ref_table'] in REFERENCE_TABLES:
+                    self._index(row['ref_table'], row['sys_id'], row['name'] or '', row['alias'] or '')
+
+    def _index(self, table, sys_id, name, alias):
+        self._unindex(table, sys_id)
+
+        self._names[table][sys_id] = (name, alias)
+        for key in set([name.lower(), alias.lower()]):
+            if key:
+                self._ids[table].setdefault(key, set()).add(sys_id)
+
+    def _unindex(self, table, sys_id):
+        previous = self._names[table].pop(sys_id, None)
+        if previous is None:
+            return
+
+        for key in set([previous[0].lower(), previous[1].lower()]):
+            ids = self._ids[table].get(key)
+            if ids is not None:
+                ids.discard(sys_id)
+                if not ids:
+                    del self._ids[table][key]
+
+    def apply(self, table, records):
+        conf = REFERENCE_TABLES[table]
+        rows = [(table, record['sys_id'], record.get(conf['name']) or '', (record.get(conf['alias']) or '') if conf['alias'] else '',
+                 record.get('sys_updated_on', '')) for record in records]
+
+        with self.store.connection() as conn:
+            conn.executemany('''
+                INSERT INTO reference_data (ref_table, sys_id, name, alias, sys_updated_on) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(ref_table, sys_id) DO UPDATE SET name = excluded.name, alias = excluded.alias,
+                    sys_updated_on = excluded.sys_updated_on
+            ''', rows)
+
+        with self._lock:
+            for row in rows:
+                self._index(table, row[1], row[2], row[3])
+
+    def delete(self, table, sys_ids):
+        if table not in REFERENCE_TABLES:
+            return
+
+        with self.store.connection() as conn:
+            conn.executemany('DELETE FROM reference_data WHERE ref_table = ? AND sys_id = ?', [(table, sys_id) for sys_id in sys_ids])
+
+        with self._lock:
+            for sys_id in sys_ids:
+                self._unindex(table, sys_id)
+
+    def sync(self, full = False):
+        """Pull changes since the last watermark, or everything when full is set."""
+        with self._sync_lock:
+            for (table, conf) in REFERENCE_TABLES.items():
+                watermark_key = 'reference_data.' + table
+                (watermark, _) = self.store.get_watermark(watermark_key)
+                started = time.time()
+
+                query = conf['query']
+                if watermark and not full:
+                    query = (query + '^' if query else '') + 'sys_updated_on>=' + watermark
+
+                fields = ','.join([field for field in ['sys_id', conf['name'], conf['alias'], 'sys_updated_on'] if field])
+
+                seen = set()
+                batch = []
+                for record in self.client.iter_table(conf['source'], query = query, fields = fields, display_value = 'false',
+                                                     params = {'sysparm_exclude_reference_link': 'true'}):
+                    batch.append(record)
+                    seen.add(record['sys_id'])
+
+                    if record.get('sys_updated_on', '') > (watermark or ''):
+                        watermark = record['sys_updated_on']
+
+                    if len(batch) >= SYNC_BATCH_SIZE:
+                        self.apply(table, batch)
+                        batch = []
+
+                if batch:
+                    self.apply(table, batch)
+
+                # A full pass also removes rows deleted on the instance
+                if full:
+                    with self._lock:
+                        stale = [sys_id for sys_id in self._names[table] if sys_id not in seen]
+                    self.delete(table, stale)
+
+                self.store.set_watermark(watermark_key, watermark, synced_at = started)
+
+        return self.status()
+
+    def sys_id_for(self, table, value):
+        """sys_id for a name, alternate name or sys_id; None when unknown or ambiguous."""
+        if not value:
+            return None
+
+        with self._lock:
+            if value in self._names[table]:
+                return value
+
+            ids = self._ids[table].get(value.strip().lower())
+            if ids and len(ids) == 1:
+                return next(iter(ids))
+
+        return None
+
+    def name_for(self, table, sys_id):
+        with self._lock:
+            entry = self._names[table].get(sys_id)
+
+        return entry[0] if entry else None
+
+    def alias_for(self, table, sys_id):
+        with self._lock:
+            entry = self._names[table].get(sys_id)
+
+        return entry[1] if entry else None
+
+    def age(self):
+        """Seconds since the least recently synced dictionary was synced, None if one was never synced."""
+        synced = [self.store.get_watermark('reference_data.' + table)[1] for table in REFERENCE_TABLES]
+        if None in synced:
+            return None
+
+        return time.time() - min(synced)
+
+    def is_fresh(self):
+        age = self.age()
+
+        return age is not None and age <= self.max_staleness
+
+    def status(self):
+        tables = {}
+        for table in REFERENCE_TABLES:
+            (watermark, synced_at) = self.store.get_watermark('reference_data.' + table)
+            with self._lock:
+                rows = len(self._names[table])
+
+            tables[table] = {'rows': rows, 'watermark': watermark, 'synced_at': synced_at}
+
+        age = self.age()
+        return {
+            'tables': tables,
+            'age_seconds': round(age, 1) if age is not None else None,
+            'max_staleness': self.max_staleness,
+            'fresh': self.is_fresh()
+        }
+
+    def start_background_sync(self, interval = DEFAULT_SYNC_INTERVAL):
+        if self._sync_thread is not None and self._sync_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Reference data sync failed - {str(e)}")
+
+                self._stop_event.wait(interval)
+
+        self._sync_thread = threading.Thread(target = run, name = 'reference-data-sync', daemon = True)
+        self._sync_thread.start()
+
+    def stop_background_sync(self):
+        self._stop_event.set()
+
+
+_reference_data = None
+_reference_data_lock = threading.Lock()
+
+
+def get_reference_data():
+    global _reference_data
+
+    with _reference_data_lock:
+        if _reference_data is None:
+            mim_conf = get_mim_conf()
+            _reference_data = ReferenceData(max_staleness = mim_conf.get('reference_data_max_staleness', DEFAULT_MAX_STALENESS))
+
+        return _reference_data
+
+
+# Dictionary for the instance a client talks to, when it is fresh; otherwise None
+def fresh_reference_data(client = None):
+    try:
+        reference_data = get_reference_data()
+    except Exception as e:
+        print(f"Reference data unavailable - {str(e)}")
+        return None
+
+    if client is not None and client.snow_url != reference_data.client.snow_url:
+        return None
+
+    if reference_data.is_fresh():
+        return reference_data
+
+    return None
+
+
+# sys_id for a display name when the dictionary knows it, otherwise the value unchanged for the instance to resolve
+def to_sys_id(table, value, client = None):
+    if not value or SYS_ID_PATTERN.match(value):
+        return value
+
+    reference_data = fresh_reference_data(client)
+    if reference_data is None:
+        return value
+
+    return reference_data.sys_id_for(table, value) or value
@@ -0,0 +1,316 @@
+import os
+import sys
+import time
+import asyncio
+
+import httpx
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import CustomError, KEYSET_FIELDS, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT, \
+        DEFAULT_PAGE_SIZE, get_snow_settings, get_mim_conf, client_key, display_record, _raw_value
+from itsm.snow_query import build_keyset_query
+from itsm.snow_scheduler import AsyncRequestScheduler, endpoint_key, retry_after_seconds, scheduler_conf
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_KEEPALIVE = 20
+
+
+class _AsyncByteReader:
+    """File-like adapter so ijson can decode an httpx response body as it arrives."""
+    def __init__(self, response):
+        self._chunks = response.aiter_bytes()
+        self._buffer = b''
+
+    async def read(self, size = -1):
+        # ijson probes with read(0) before decoding
+        if size == 0:
+            return b''
+
+        if not self._buffer:
+            try:
+                self._buffer = await self._chunks.__anext__()
+            except StopAsyncIteration:
+                return b''
+
+        if size < 0:
+            size = len(self._buffer)
+
+        data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+class AsyncSnowClient:
+    """
+        asyncio counterpart of SnowClient built on httpx.AsyncClient.
+
+        One worker can keep up to max_connections ServiceNow calls in flight
+        while the event loop stays free for other requests.
+    """
+    def __init__(self, snow_url, username, password, proxies = None, max_connections = DEFAULT_MAX_CONNECTIONS,
+                 max_keepalive = DEFAULT_MAX_KEEPALIVE, connect_timeout = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout = DEFAULT_READ_TIMEOUT, page_size = DEFAULT_PAGE_SIZE, scheduler = None, verify = False):
+        if snow_url.endswith('/'):
+            snow_url = snow_url[:-1]
+
+        self.snow_url = snow_url
+        self.snow_username = username
+        self.snow_password = password
+        self.headers = {'content-type': 'application/json'}
+        self.page_size = page_size
+        self.max_connections = max_connections
+
+        self.session = httpx.AsyncClient(auth = (username, password),
+                                         headers = {'accept': 'application/json'},
+                                         verify = verify,
+                                         proxy = proxies['https'] if proxies else None,
+                                         timeout = httpx.Timeout(read_timeout, connect = connect_timeout),
+                                         limits = httpx.Limits(max_connections = max_connections,
+                                                               max_keepalive_connections = max_keepalive))
+
+        # Same admission control as SnowClient, on asyncio primitives
+        self.scheduler = scheduler or AsyncRequestScheduler(concurrency_max = max_connections)
+
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._elapsed = 0.0
+
+    def url(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+
+        return self.snow_url + path
+
+    async def request(self, method, path, **kwargs):
+        """Send a request through the scheduler, retrying like SnowClient.request."""
+        # JSON by default; multipart bodies set their own content type
+        if 'files' not in kwargs:
+            kwargs['headers'] = dict(self.headers, **kwargs.get('headers', {}))
+
+        url = self.url(path)
+        endpoint = endpoint_key(url)
+
+        # Streamed bodies cannot be sent twice
+        content = kwargs.get('content')
+        replayable = content is None or isinstance(content, (bytes, str))
+
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(endpoint)
+
+            self._requests += 1
+            self._in_flight += 1
+
+            response = None
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = await self.session.request(method, url, **kwargs)
+            except Exception:
+                self._errors += 1
+
+                self.scheduler.record(endpoint, 0)
+                if not replayable or not self.scheduler.should_retry(method, 0, attempt):
+                    raise
+            finally:
+                await self.scheduler.release()
+                self._in_flight -= 1
+                self._elapsed += time.perf_counter() - started
+
+            if response is not None:
+                retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+                self.scheduler.record(endpoint, response.status_code, retry_after)
+
+                if not replayable or not self.scheduler.should_retry(method, response.status_code, attempt):
+                    return response
+
+            self.scheduler.note_retry(endpoint)
+            await asyncio.sleep(self.scheduler.backoff(attempt, retry_after))
+
+            attempt += 1
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request('PUT', path, **kwargs)
+
+    async def patch(self, path, **kwargs):
+        return await self.request('PATCH', path, **kwargs)
+
+    async def iter_table(self, table, query = '', fields = None, display_value = 'true', page_size = None, params = None,
+                         start_after = None):
+        """Async generator with the same paging contract as SnowClient.iter_table."""
+        page_size = page_size or self.page_size
+
+        requested_fields = None
+        page_params = dict(params or {})
+        if fields:
+            requested_fields = [field.strip() for field in fields.split(',') if field.strip()]
+            fetch_fields = requested_fields + [field for field in KEYSET_FIELDS if field not in requested_fields]
+            page_params['sysparm_fields'] = ','.join(fetch_fields)
+
+        page_params['sysparm_limit'] = str(page_size)
+        page_params['sysparm_no_count'] = 'true'
+
+        # Raw sys_created_on for the cursor; see SnowClient.iter_table
+        as_display = str(display_value).lower() == 'true'
+        page_params['sysparm_display_value'] = 'all' if as_display else display_value
+
+        # Resume after a (sys_created_on, sys_id) position from an earlier read
+        (last_created_on, last_sys_id) = start_after or (None, None)
+
+        while True:
+            page_params['sysparm_query'] = build_keyset_query(query, last_created_on, last_sys_id)
+
+            count = 0
+            async for record in self._iter_page('/api/now/table/' + table, page_params):
+                count += 1
+                last_created_on = _raw_value(record.get('sys_created_on'))
+                last_sys_id = _raw_value(record.get('sys_id'))
+
+                if as_display:
+                    display_record(record)
+
+                if requested_fields is not None:
+                    for field in KEYSET_FIELDS:
+                        if field not in requested_fields:
+                            record.pop(field, None)
+
+                yield record
+
+            if count < page_size or last_sys_id is None:
+                break
+
+    async def _iter_page(self, path, params):
+        url = self.url(path)
+        endpoint = endpoint_key(url)
+
+        attempt = 0
+        while True:
+            await self.scheduler.acquire(endpoint)
+
+            self._requests += 1
+            self._in_flight += 1
+
+            retry_after = None
+            status_code = 0
+            released = False
+            started = time.perf_counter()
+            try:
+                async with self.session.stream('GET', url, params = params) as response:
+                    status_code = response.status_code
+                    retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+
+                    # The slot is held only until the headers arrive, as for SnowClient
+                    released = True
+                    await self.scheduler.release()
+                    self.scheduler.record(endpoint, status_code, retry_after)
+
+                    if status_code < 400:
+                        if ijson is not None:
+                            async for record in ijson.items_async(_AsyncByteReader(response), 'result.item', use_float = True):
+                                yield record
+                        else:
+                            await response.aread()
+                            for record in response.json()['result']:
+                                yield record
+
+                        return
+
+                    await response.aread()
+                    if not self.scheduler.should_retry('GET', status_code, attempt):
+                        raise CustomError('ServiceNow returned ' + str(status_code) + ' - ' + response.text)
+            except CustomError:
+                self._errors += 1
+                raise
+            except Exception:
+                self._errors += 1
+
+                # Failures mid-body are not retried, the caller may already have records
+                if status_code != 0:
+                    raise
+
+                self.scheduler.record(endpoint, 0)
+                if not self.scheduler.should_retry('GET', 0, attempt):
+                    raise
+            finally:
+                if not released:
+                    await self.scheduler.release()
+
+                self._in_flight -= 1
+                self._elapsed += time.perf_counter() - started
+
+            self.scheduler.note_retry(endpoint)
+            await asyncio.sleep(self.scheduler.backoff(attempt, retry_after))
+
+            attempt += 1
+
+    def pool_stats(self):
+        return {
+            'snow_url': self.snow_url,
+            'max_connections': self.max_connections,
+            'requests': self._requests,
+            'errors': self._errors,
+            'in_flight': self._in_flight,
+            'avg_latency_ms': round(self._elapsed * 1000 / self._requests, 2) if self._requests else 0.0,
+            'scheduler': self.scheduler.stats()
+        }
+
+    async def close(self):
+        await self.session.aclose()
+
+
+_async_clients = {}
+
+
+def get_async_snow_client(snow_url = None, username = None, password = None, proxies = None):
+    """Return the shared AsyncSnowClient, configured like get_snow_client()."""
+    mim_conf = get_mim_conf()
+
+    if snow_url is None:
+        settings = get_snow_settings()
+        snow_url = settings['snow_url']
+        username = settings['snow_username']
+        password = settings['snow_password']
+        proxies = settings['proxies']
+
+    key = client_key(snow_url, username, password)
+
+    client = _async_clients.get(key)
+    if client is None:
+        client = AsyncSnowClient(snow_url, username, password, proxies = proxies,
+                                 max_connections = mim_conf.get('snow_async_max_connections', DEFAULT_MAX_CONNECTIONS),
+                                 max_keepalive = mim_conf.get('snow_async_max_keepalive', DEFAULT_MAX_KEEPALIVE),
+                                 connect_timeout = mim_conf.get('snow_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                                 read_timeout = mim_conf.get('snow_read_timeout', DEFAULT_READ_TIMEOUT),
+                                 page_size = mim_conf.get('snow_page_size', DEFAULT_PAGE_SIZE),
+                                 scheduler = AsyncRequestScheduler(**dict(scheduler_conf(mim_conf),
+                                                                          concurrency_max = mim_conf.get('snow_async_max_connections', DEFAULT_MAX_CONNECTIONS))))
+        _async_clients[key] = client
+
+    return client
+
+
+def get_async_pool_stats():
+    return [client.pool_stats() for client in _async_clients.values()]
+
+
+async def close_async_snow_clients():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+
+    for client in clients:
+        await client.close()
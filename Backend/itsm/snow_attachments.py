@@ -0,0 +1,120 @@
+import os
+import sys
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_batch import execute_batch, attachment_upload, _result
+
+ATTACHMENT_FILE_PATH = '/api/now/attachment/file'
+
+# Files up to this size share Batch API calls, larger ones are streamed on their own
+BATCH_ATTACHMENT_MAX_BYTES = 1024 * 1024
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+FILE_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'bmp': 'image/bmp',
+              'gif': 'image/gif', 'svg': 'image/svg+xml', 'pdf': 'application/pdf', 'txt': 'text/plain'}
+
+
+def content_type_for(file_name):
+    return FILE_TYPES.get(file_name.split('.')[-1].lower().strip(), 'application/octet-stream')
+
+
+def _upload_params(table, sys_id, file_name):
+    return {'table_name': table, 'table_sys_id': sys_id, 'file_name': file_name}
+
+
+def upload_file(client, table, sys_id, file_path, file_name = None, content_type = None):
+    """
+        Stream one file into the Attachment API.
+
+        The file object is the request body, so it is sent in chunks straight
+        from disk and memory use does not grow with the file size.
+    """
+    file_name = file_name or os.path.basename(file_path)
+    content_type = content_type or content_type_for(file_name)
+
+    try:
+        with open(file_path, 'rb') as attachment:
+            response = client.post(ATTACHMENT_FILE_PATH, params = _upload_params(table, sys_id, file_name), data = attachment,
+                                   headers = {'content-type': content_type, 'accept': 'application/json'})
+
+        return _result(response.status_code, response.content)
+    except Exception as e:
+        return {'status_code': 0, 'result': None, 'error': str(e)}
+
+
+def upload_files(client, table, sys_id, file_paths, workers = None):
+    """
+        Attach several files to one record concurrently, one result per file in input order.
+
+        Small files go out together through the Batch API while large ones are
+        streamed in parallel on their own connections.
+    """
+    workers = workers or client.batch_workers
+
+    results = [None] * len(file_paths)
+    small = []
+    large = []
+    for (ind, file_path) in enumerate(file_paths):
+        try:
+            size = os.path.getsize(file_path)
+        except OSError as e:
+            results[ind] = {'status_code': 0, 'result': None, 'error': str(e)}
+            continue
+
+        if size <= BATCH_ATTACHMENT_MAX_BYTES:
+            small.append(ind)
+        else:
+            large.append(ind)
+
+    with ThreadPoolExecutor(max_workers = max(min(workers, len(large)), 1)) as executor:
+        streamed = [executor.submit(upload_file, client, table, sys_id, file_paths[ind]) for ind in large]
+
+        items = []
+        for ind in small:
+            file_name = os.path.basename(file_paths[ind])
+            with open(file_paths[ind], 'rb') as attachment:
+                items.append(attachment_upload(table, sys_id, file_name, attachment.read(), content_type_for(file_name)))
+
+        for (ind, result) in zip(small, execute_batch(client, items)):
+            results[ind] = result
+
+        for (ind, future) in zip(large, streamed):
+            results[ind] = future.result()
+
+    return results
+
+
+# File reads run on a worker thread, off the event loop
+async def _file_chunks(attachment):
+    while True:
+        chunk = await asyncio.to_thread(attachment.read, UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        yield chunk
+
+
+async def async_upload_file(client, table, sys_id, file_path, file_name = None, content_type = None):
+    """upload_file() on an AsyncSnowClient; the body is streamed from an async chunk generator."""
+    file_name = file_name or os.path.basename(file_path)
+    content_type = content_type or content_type_for(file_name)
+
+    try:
+        attachment = await asyncio.to_thread(open, file_path, 'rb')
+        try:
+            headers = {'content-type': content_type, 'content-length': str(os.fstat(attachment.fileno()).st_size)}
+            response = await client.post(ATTACHMENT_FILE_PATH, params = _upload_params(table, sys_id, file_name),
+                                         content = _file_chunks(attachment), headers = headers)
+        finally:
+            attachment.close()
+
+        return _result(response.status_code, response.content)
+    except Exception as e:
+        return {'status_code': 0, 'result': None, 'error': str(e)}
@@ -0,0 +1,128 @@
+import json
+import base64
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+
+BATCH_PATH = '/api/now/v1/batch'
+
+# Responses meaning the Batch API is not available to this account or instance
+BATCH_UNSUPPORTED_STATUS = [403, 404, 405]
+
+
+# Batch item creating one record through the Table API
+def table_insert(table, payload):
+    return {
+        'method': 'POST',
+        'url': '/api/now/table/' + table,
+        'headers': {'Content-Type': 'application/json', 'Accept': 'application/json'},
+        'body': json.dumps(payload).encode('utf-8')
+    }
+
+
+# Batch item attaching raw file content to a record through the Attachment API
+def attachment_upload(table, sys_id, file_name, content, content_type):
+    return {
+        'method': 'POST',
+        'url': '/api/now/attachment/file?' + urlencode({'table_name': table, 'table_sys_id': sys_id, 'file_name': file_name}),
+        'headers': {'Content-Type': content_type, 'Accept': 'application/json'},
+        'body': content
+    }
+
+
+def _result(status_code, body, error = None):
+    result = None
+    if body:
+        try:
+            result = json.loads(body).get('result')
+        except Exception:
+            result = None
+
+    if error is None and status_code >= 400:
+        error = 'ServiceNow returned ' + str(status_code) + (' - ' + body.decode('utf-8', 'replace') if body else '')
+
+    return {'status_code': status_code, 'result': result, 'error': error}
+
+
+def _send_one(client, item):
+    try:
+        response = client.request(item['method'], item['url'], data = item['body'], headers = item['headers'])
+        return _result(response.status_code, response.content)
+    except Exception as e:
+        return {'status_code': 0, 'result': None, 'error': str(e)}
+
+
+def _send_individually(client, items, workers):
+    with ThreadPoolExecutor(max_workers = max(min(workers, len(items)), 1)) as executor:
+        return list(executor.map(lambda item: _send_one(client, item), items))
+
+
+def _send_batch(client, items, batch_id, workers):
+    rest_requests = []
+    for (ind, item) in enumerate(items):
+        rest_requests.append({
+            'id': str(ind),
+            'method': item['method'],
+            'url': item['url'],
+            'headers': [{'name': name, 'value': value} for (name, value) in item['headers'].items()],
+            'body': base64.b64encode(item['body']).decode('ascii')
+        })
+
+    payload = {'batch_request_id': batch_id, 'rest_requests': rest_requests}
+
+    try:
+        response = client.post(BATCH_PATH, data = json.dumps(payload))
+    except Exception as e:
+        # Nothing is known to have run, but writes are not retried blindly
+        return [{'status_code': 0, 'result': None, 'error': str(e)} for item in items]
+
+    if response.status_code in BATCH_UNSUPPORTED_STATUS:
+        print(f"ServiceNow Batch API unavailable ({response.status_code}), sending requests individually")
+        client.batch_supported = False
+        return _send_individually(client, items, workers)
+
+    if response.status_code >= 400:
+        return [{'status_code': response.status_code, 'result': None, 'error': 'Batch request failed - ' + response.text}
+                for item in items]
+
+    results = [None] * len(items)
+    output = response.json()
+
+    for serviced in output.get('serviced_requests', []):
+        body = base64.b64decode(serviced['body']) if serviced.get('body') else b''
+        results[int(serviced['id'])] = _result(serviced.get('status_code', 0), body)
+
+    # Requests the instance did not get to within the batch time limit never ran
+    unserviced = [ind for ind in range(len(items)) if results[ind] is None]
+    if unserviced:
+        for (ind, result) in zip(unserviced, _send_individually(client, [items[ind] for ind in unserviced], workers)):
+            results[ind] = result
+
+    return results
+
+
+def execute_batch(client, items, batch_size = None, workers = None):
+    """
+        Send items built with table_insert()/attachment_upload() in as few round trips as possible.
+
+        Items are grouped into Batch REST API calls of batch_size, and the groups
+        are sent concurrently on up to workers connections. When the instance does
+        not expose the Batch API the items are sent as parallel individual
+        requests instead. Returns one {status_code, result, error} per item, in
+        input order.
+    """
+    batch_size = batch_size or client.batch_size
+    workers = workers or client.batch_workers
+
+    if not items:
+        return []
+
+    if not client.batch_supported:
+        return _send_individually(client, items, workers)
+
+    groups = [items[ind:ind + batch_size] for ind in range(0, len(items), batch_size)]
+
+    with ThreadPoolExecutor(max_workers = max(min(workers, len(groups)), 1)) as executor:
+        group_results = list(executor.map(lambda args: _send_batch(client, args[1], str(args[0]), workers), enumerate(groups)))
+
+    return [result for results in group_results for result in results]
+
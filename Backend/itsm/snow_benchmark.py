@@ -0,0 +1,220 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import configure_snow_settings, get_snow_client, _load_pool_conf
+from itsm.snow_cache import get_snow_cache
+from itsm.snow_standin import SnowStandIn, add_standin_arguments, standin_options
+
+OPERATIONS = ['get_ticket_details', 'get_parents_children', 'get_kb_articles_details', 'create_change_request', 'create_task']
+
+DEFAULT_ITERATIONS = 20
+DEFAULT_CONCURRENCY = 1
+
+# Window wide enough for every generated ticket
+TICKET_WINDOW = ('2000-01-01 00:00:00', '2100-01-01 00:00:00')
+
+BENCH_USERNAME = 'benchmark'
+BENCH_PASSWORD = 'benchmark'
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100.0 * len(ordered) + 0.5)) - 1, 0)
+
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def _size(result):
+    return len(result) if isinstance(result, list) else 1
+
+
+class ITSMBenchmark:
+    """
+        Times ITSM connector calls against a ServiceNow instance, normally the
+        local stand-in from snow_standin.py.
+
+        Each operation runs iterations times over concurrency threads after one
+        untimed warm-up call. The read-through cache is cleared before every
+        call unless warm_cache is set, so reads measure the HTTP path. Results
+        hold throughput (calls/s and items/s), p50/p99/max latency in ms, the
+        HTTP requests made per call and the errors seen.
+    """
+    def __init__(self, snow_url, username = BENCH_USERNAME, password = BENCH_PASSWORD, iterations = DEFAULT_ITERATIONS,
+                 concurrency = DEFAULT_CONCURRENCY, warm_cache = False, seed = 7):
+        self.iterations = iterations
+        self.concurrency = concurrency
+        self.warm_cache = warm_cache
+        self._rand = random.Random(seed)
+
+        # Mirrors and reference data of the benchmark run live in a scratch store
+        self._store_dir = tempfile.mkdtemp(prefix = 'snow-benchmark-')
+        mim_conf = dict(_load_pool_conf(), local_store_path = os.path.join(self._store_dir, 'itsm_local.db'))
+        configure_snow_settings(snow_url, username, password, mim_conf = mim_conf)
+
+        from itsm.itsm_connector import ITSM
+        from change_management.snow_ctask import ServiceNowTasks
+
+        self.client = get_snow_client()
+        self.itsm = ITSM()
+
+        self.tasks = ServiceNowTasks()
+        self.tasks.snow_url = self.client.snow_url
+        self.tasks.client = self.client
+
+        self._ci_ids = None
+        self._change_ids = None
+        self._groups = None
+
+    def _sample(self, table, field, count = 50):
+        response = self.client.get('/api/now/table/' + table, params = {'sysparm_fields': field, 'sysparm_limit': str(count),
+                                                                       'sysparm_exclude_reference_link': 'true'})
+        return [record[field] for record in response.json()['result'] if record.get(field)]
+
+    def _operation(self, name):
+        if name == 'get_ticket_details':
+            return lambda: self.itsm.get_ticket_details(start_ts = TICKET_WINDOW[0], end_ts = TICKET_WINDOW[1])
+
+        if name == 'get_parents_children':
+            if self._ci_ids is None:
+                self._ci_ids = self._sample('cmdb_rel_ci', 'parent')
+            return lambda: self.itsm.get_parents_children(self._rand.choice(self._ci_ids), 'child')
+
+        if name == 'get_kb_articles_details':
+            return lambda: self.itsm.get_kb_articles_details()
+
+        if name == 'create_change_request':
+            return lambda: self.itsm.create_change_request('Benchmark change', description = 'Created by snow_benchmark',
+                                                           implementation_plan = 'None', backout_plan = 'None', test_plan = 'None')
+
+        if name == 'create_task':
+            if self._change_ids is None:
+                self._change_ids = self._sample('change_request', 'sys_id')
+                self._groups = self._sample('sys_user_group', 'name')
+            return lambda: self.tasks.create_task(short_description = 'Benchmark task', sys_id = self._rand.choice(self._change_ids),
+                                                  description = 'Created by snow_benchmark',
+                                                  assignment_group = self._rand.choice(self._groups))
+
+        raise ValueError('Unknown operation ' + name)
+
+    def run_operation(self, name):
+        call = self._operation(name)
+        cache = get_snow_cache()
+
+        latencies = []
+        items = [0]
+        errors = []
+        lock = threading.Lock()
+
+        def timed(ind):
+            if not self.warm_cache:
+                cache.clear()
+
+            started = time.perf_counter()
+            try:
+                result = call()
+            except Exception as e:
+                with lock:
+                    errors.append(str(e))
+                return
+
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                items[0] += _size(result)
+
+        # Untimed warm-up call
+        timed(-1)
+        latencies.clear()
+        errors.clear()
+        items[0] = 0
+
+        requests_before = self.client.pool_stats()['requests']
+        started = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers = self.concurrency) as executor:
+            list(executor.map(timed, range(self.iterations)))
+
+        wall = time.perf_counter() - started
+        requests = self.client.pool_stats()['requests'] - requests_before
+
+        latencies_ms = [latency * 1000 for latency in latencies]
+        return {
+            'operation': name,
+            'calls': len(latencies),
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'wall_s': round(wall, 3),
+            'calls_per_s': round(len(latencies) / wall, 2) if wall > 0 else None,
+            'items_per_s': round(items[0] / wall, 1) if wall > 0 else None,
+            'p50_ms': round(percentile(latencies_ms, 50), 2) if latencies_ms else None,
+            'p99_ms': round(percentile(latencies_ms, 99), 2) if latencies_ms else None,
+            'max_ms': round(max(latencies_ms), 2) if latencies_ms else None,
+            'requests_per_call': round(requests / self.iterations, 2) if self.iterations else None
+        }
+
+    def run(self, operations = OPERATIONS):
+        return [self.run_operation(name) for name in operations]
+
+
+def format_results(results):
+    columns = ['operation', 'calls', 'errors', 'calls_per_s', 'items_per_s', 'p50_ms', 'p99_ms', 'max_ms', 'requests_per_call']
+    rows = [columns] + [['' if result[column] is None else str(result[column]) for column in columns] for result in results]
+    widths = [max([len(row[ind]) for row in rows]) for ind in range(len(columns))]
+
+    return '\n'.join(['  '.join([value.ljust(width) for (value, width) in zip(row, widths)]) for row in rows])
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark ITSM connector calls against the ServiceNow stand-in')
+    parser.add_argument('--url', help = 'Benchmark this instance instead of starting a stand-in')
+    parser.add_argument('--operations', nargs = '+', choices = OPERATIONS, default = OPERATIONS)
+    parser.add_argument('--iterations', type = int, default = DEFAULT_ITERATIONS)
+    parser.add_argument('--concurrency', type = int, default = DEFAULT_CONCURRENCY)
+    parser.add_argument('--warm-cache', action = 'store_true', help = 'Keep the read-through cache between calls')
+    parser.add_argument('--json', dest = 'json_path', help = 'Also write the results to this file')
+    add_standin_arguments(parser)
+    args = parser.parse_args(argv)
+
+    standin = None
+    snow_url = args.url
+    if snow_url is None:
+        standin = SnowStandIn(ke_category = _load_pool_conf().get('ke_category_name', 'Knowledge'), **standin_options(args)).start()
+        snow_url = standin.url
+        print('ServiceNow stand-in on', snow_url, '-', standin.stats()['tables'])
+
+    try:
+        benchmark = ITSMBenchmark(snow_url, iterations = args.iterations, concurrency = args.concurrency,
+                                  warm_cache = args.warm_cache, seed = args.seed)
+        results = benchmark.run(args.operations)
+    finally:
+        if standin is not None:
+            print('Stand-in served', standin.stats()['requests'], 'requests,', standin.stats()['throttled'], 'throttled')
+            standin.stop()
+
+    print(format_results(results))
+
+    if args.json_path:
+        with open(args.json_path, 'w') as json_f:
+            json.dump(results, json_f, indent = 2)
+
+    return results
+
+
+if __name__ == '__main__':
+    main()
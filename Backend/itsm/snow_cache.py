@@ -0,0 +1,159 @@
+import os
+import sys
+import copy
+import json
+import time
+import threading
+from collections import OrderedDict
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import _load_pool_conf
+
+# Seconds a cached read stays valid, per ServiceNow table; overridable with snow_cache_ttl in mim_conf.json
+DEFAULT_TTLS = {
+    'cmdb_ci': 300,
+    'cmdb_rel_ci': 300,
+    'change_request': 60,
+    'change_task': 60,
+    'kb_knowledge': 300
+}
+DEFAULT_TTL = 60
+DEFAULT_MAX_ENTRIES = 2048
+
+
+# Hashable cache key for call arguments, including lists and dicts, scoped to the client's instance and user
+# so clients of different instances or credentials sharing the process cache never read each other's entries
+def cache_key(client, *args):
+    return json.dumps([client.snow_url.rstrip('/'), client.snow_username] + list(args), sort_keys = True, default = str)
+
+
+class SnowCache:
+    """
+        Read-through cache for ServiceNow lookups, shared by every ITSM client in the process.
+
+        Entries expire after the TTL of their table and the least recently used
+        entry is evicted once max_entries is reached. Writes we make ourselves
+        call invalidate() for the tables they change. Values are copied on the
+        way in and out, so callers can modify what they get back.
+    """
+    def __init__(self, max_entries = DEFAULT_MAX_ENTRIES, ttls = None, default_ttl = DEFAULT_TTL):
+        self.max_entries = max_entries
+        self.ttls = dict(DEFAULT_TTLS, **(ttls or {}))
+        self.default_ttl = default_ttl
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _table_stats(self, table):
+        if table not in self._stats:
+            self._stats[table] = {'hits': 0, 'misses': 0, 'expired': 0, 'evictions': 0, 'invalidations': 0}
+
+        return self._stats[table]
+
+    def get(self, table, key):
+        """Return (True, value) on a hit, (False, None) otherwise."""
+        with self._lock:
+            stats = self._table_stats(table)
+            entry = self._entries.get((table, key))
+
+            if entry is None:
+                stats['misses'] += 1
+                return (False, None)
+
+            (expires_at, value) = entry
+            if expires_at < time.monotonic():
+                del self._entries[(table, key)]
+                stats['expired'] += 1
+                stats['misses'] += 1
+                return (False, None)
+
+            self._entries.move_to_end((table, key))
+            stats['hits'] += 1
+
+        return (True, copy.deepcopy(value))
+
+    def put(self, table, key, value):
+        ttl = self.ttls.get(table, self.default_ttl)
+        if ttl <= 0:
+            return
+
+        value = copy.deepcopy(value)
+
+        with self._lock:
+            self._entries[(table, key)] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end((table, key))
+
+            while len(self._entries) > self.max_entries:
+                ((evicted_table, _), _) = self._entries.popitem(last = False)
+                self._table_stats(evicted_table)['evictions'] += 1
+
+    def cached(self, table, key, loader):
+        """Value for key, calling loader() and caching its result on a miss."""
+        (hit, value) = self.get(table, key)
+        if hit:
+            return value
+
+        value = loader()
+        self.put(table, key, value)
+
+        return value
+
+    async def async_cached(self, table, key, loader):
+        """cached() for a coroutine loader."""
+        (hit, value) = self.get(table, key)
+        if hit:
+            return value
+
+        value = await loader()
+        self.put(table, key, value)
+
+        return value
+
+    def invalidate(self, table, key = None):
+        """Drop one key, or every entry of the table when key is None."""
+        with self._lock:
+            if key is not None:
+                removed = [(table, key)] if (table, key) in self._entries else []
+            else:
+                removed = [entry_key for entry_key in self._entries.keys() if entry_key[0] == table]
+
+            for entry_key in removed:
+                del self._entries[entry_key]
+
+            self._table_stats(table)['invalidations'] += len(removed)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            tables = {}
+            for (table, stats) in self._stats.items():
+                lookups = stats['hits'] + stats['misses']
+                tables[table] = dict(stats, ttl = self.ttls.get(table, self.default_ttl),
+                                     hit_ratio = round(stats['hits'] / lookups, 3) if lookups else 0.0)
+
+            return {'size': len(self._entries), 'max_entries': self.max_entries, 'tables': tables}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_snow_cache():
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            # Plain file read so the cache works without Vault access
+            mim_conf = _load_pool_conf()
+            _cache = SnowCache(max_entries = mim_conf.get('snow_cache_max_entries', DEFAULT_MAX_ENTRIES),
+                               ttls = mim_conf.get('snow_cache_ttl'))
+
+        return _cache
@@ -0,0 +1,483 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from vault import get_vault
+from itsm.snow_query import build_keyset_query
+from itsm.snow_scheduler import RequestScheduler, endpoint_key, retry_after_seconds, scheduler_conf
+
+class CustomError(Exception):
+    """Custom exception for application-specific errors."""
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+
+# Pool and timeout defaults, overridable from mim_conf.json
+DEFAULT_POOL_CONNECTIONS = 10
+DEFAULT_POOL_MAXSIZE = 20
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_BATCH_WORKERS = 8
+
+# Columns used to order and resume paged table reads
+KEYSET_FIELDS = ['sys_created_on', 'sys_id']
+
+
+class SnowClient:
+    """
+        Keep-alive HTTP client for a single ServiceNow instance and credential.
+
+        All ITSM code paths share one instance per (snow_url, username) through
+        get_snow_client(), so TCP and TLS connections are reused across requests.
+    """
+    def __init__(self, snow_url, username, password, proxies = None, pool_connections = DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize = DEFAULT_POOL_MAXSIZE, connect_timeout = DEFAULT_CONNECT_TIMEOUT,
+                 read_timeout = DEFAULT_READ_TIMEOUT, page_size = DEFAULT_PAGE_SIZE, batch_size = DEFAULT_BATCH_SIZE,
+                 batch_workers = DEFAULT_BATCH_WORKERS, scheduler = None, verify = False):
+        if snow_url.endswith('/'):
+            snow_url = snow_url[:-1]
+
+        self.snow_url = snow_url
+        self.snow_username = username
+        self.snow_password = password
+        self.headers = {'content-type': 'application/json'}
+        self.timeout = (connect_timeout, read_timeout)
+        self.pool_maxsize = pool_maxsize
+        self.page_size = page_size
+
+        # Batch REST API settings, see itsm/snow_batch.py
+        self.batch_size = batch_size
+        self.batch_workers = batch_workers
+        self.batch_supported = True
+
+        self.adapter = HTTPAdapter(pool_connections = pool_connections, pool_maxsize = pool_maxsize)
+
+        self.session = requests.Session()
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+        self.session.auth = (username, password)
+        self.session.headers.update(self.headers)
+        self.session.verify = verify
+
+        if proxies:
+            self.session.proxies.update(proxies)
+
+        # Admission control: AIMD concurrency, per-endpoint token buckets and retries
+        self.scheduler = scheduler or RequestScheduler(concurrency_max = pool_maxsize)
+
+        # Request counters exposed through pool_stats()
+        self._stats_lock = threading.Lock()
+        self._requests = 0
+        self._errors = 0
+        self._in_flight = 0
+        self._elapsed = 0.0
+
+    def url(self, path):
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+
+        return self.snow_url + path
+
+    def request(self, method, path, **kwargs):
+        """
+            Send a request through the scheduler.
+
+            Throttled responses (429/503) are retried after Retry-After or a
+            jittered backoff; GETs are also retried on connection errors and 5xx.
+            The last response is returned once retries run out.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+
+        url = self.url(path)
+        endpoint = endpoint_key(url)
+
+        # File bodies are rewound before a retry
+        body = kwargs.get('data')
+        body_position = body.tell() if hasattr(body, 'tell') else None
+
+        attempt = 0
+        while True:
+            self.scheduler.acquire(endpoint)
+
+            with self._stats_lock:
+                self._requests += 1
+                self._in_flight += 1
+
+            response = None
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except Exception:
+                with self._stats_lock:
+                    self._errors += 1
+
+                self.scheduler.record(endpoint, 0)
+                if not self.scheduler.should_retry(method, 0, attempt):
+                    raise
+            finally:
+                self.scheduler.release()
+                with self._stats_lock:
+                    self._in_flight -= 1
+                    self._elapsed += time.perf_counter() - started
+
+            if response is not None:
+                retry_after = retry_after_seconds(response.headers.get('Retry-After'))
+                self.scheduler.record(endpoint, response.status_code, retry_after)
+
+                if not self.scheduler.should_retry(method, response.status_code, attempt):
+                    return response
+
+                response.close()
+
+            self.scheduler.note_retry(endpoint)
+            time.sleep(self.scheduler.backoff(attempt, retry_after))
+
+            if body_position is not None:
+                body.seek(body_position)
+
+            attempt += 1
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def patch(self, path, **kwargs):
+        return self.request('PATCH', path, **kwargs)
+
+    def iter_table(self, table, query = '', fields = None, display_value = 'true', page_size = None, params = None,
+                   start_after = None):
+        """
+            Yield records of a Table API read page by page.
+
+            Pages are bounded by sysparm_limit and resumed with keyset paging on
+            (sys_created_on, sys_id), so deep pages cost the same as the first one
+            and rows inserted mid-read do not shift the window. sysparm_no_count
+            skips the total count, and each page is decoded incrementally when
+            ijson is installed.
+        """
+        page_size = page_size or self.page_size
+
+        requested_fields = None
+        page_params = dict(params or {})
+        if fields:
+            requested_fields = [field.strip() for field in fields.split(',') if field.strip()]
+            fetch_fields = requested_fields + [field for field in KEYSET_FIELDS if field not in requested_fields]
+            page_params['sysparm_fields'] = ','.join(fetch_fields)
+
+        page_params['sysparm_limit'] = str(page_size)
+        page_params['sysparm_no_count'] = 'true'
+
+        # The cursor must be the raw UTC sys_created_on, not the display value in the
+        # session user's timezone and format, so display reads fetch both and map back
+        as_display = str(display_value).lower() == 'true'
+        page_params['sysparm_display_value'] = 'all' if as_display else display_value
+
+        # Resume after a (sys_created_on, sys_id) position from an earlier read
+        (last_created_on, last_sys_id) = start_after or (None, None)
+
+        while True:
+            page_params['sysparm_query'] = build_keyset_query(query, last_created_on, last_sys_id)
+
+            count = 0
+            for record in self._iter_page('/api/now/table/' + table, page_params):
+                count += 1
+                last_created_on = _raw_value(record.get('sys_created_on'))
+                last_sys_id = _raw_value(record.get('sys_id'))
+
+                if as_display:
+                    display_record(record)
+
+                # Drop keyset columns the caller did not ask for
+                if requested_fields is not None:
+                    for field in KEYSET_FIELDS:
+                        if field not in requested_fields:
+                            record.pop(field, None)
+
+                yield record
+
+            if count < page_size or last_sys_id is None:
+                break
+
+    def _iter_page(self, path, params):
+        response = self.get(path, params = params, stream = True)
+        try:
+            if response.status_code >= 400:
+                raise CustomError('ServiceNow returned ' + str(response.status_code) + ' - ' + response.text)
+
+            if ijson is not None:
+                response.raw.decode_content = True
+                for record in ijson.items(response.raw, 'result.item', use_float = True):
+                    yield record
+            else:
+                for record in response.json()['result']:
+                    yield record
+        finally:
+            response.close()
+
+    def pool_stats(self):
+        pools = []
+        for key in list(self.adapter.poolmanager.pools.keys()):
+            pool = self.adapter.poolmanager.pools.get(key)
+            if pool is None:
+                continue
+
+            # The pool queue is pre-filled with None placeholders for unopened slots
+            idle = 0
+            if pool.pool is not None:
+                idle = len([conn for conn in list(pool.pool.queue) if conn is not None])
+
+            pools.append({
+                'host': pool.host,
+                'port': pool.port,
+                'connections_opened': pool.num_connections,
+                'requests_served': pool.num_requests,
+                'idle_connections': idle
+            })
+
+        with self._stats_lock:
+            return {
+                'snow_url': self.snow_url,
+                'pool_maxsize': self.pool_maxsize,
+                'requests': self._requests,
+                'errors': self._errors,
+                'in_flight': self._in_flight,
+                'avg_latency_ms': round(self._elapsed * 1000 / self._requests, 2) if self._requests else 0.0,
+                'pools': pools,
+                'scheduler': self.scheduler.stats()
+            }
+
+    def close(self):
+        self.session.close()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+_snow_settings = None
+
+# Settings are read under their own lock, so client lookups never wait behind them
+_settings_lock = threading.Lock()
+
+
+# mim_conf.json and what follows from it; credentials are left to _vault_credentials()
+def _load_snow_settings():
+    conf_f_path = ROOT_PATH + '/config/mim_conf.json'
+    with open(conf_f_path) as conf_f:
+        mim_conf = json.load(conf_f)
+
+    if mim_conf.get('proxy_url'):
+        proxies = {
+          "http"  : mim_conf['proxy_url'],
+          "https" : mim_conf['proxy_url']
+        }
+    else:
+        proxies = None
+
+    return {
+        'mim_conf': mim_conf,
+        'snow_url': mim_conf['snow_url'].rstrip('/'),
+        'proxies': proxies,
+        'credentials': None
+    }
+
+
+def _cached_settings():
+    global _snow_settings
+
+    with _settings_lock:
+        if _snow_settings is None:
+            _snow_settings = _load_snow_settings()
+
+        return _snow_settings
+
+
+# ServiceNow credentials from Vault; repeat reads are served by the Vault secret cache
+def _vault_credentials(mim_conf):
+    vault_session = get_vault(mim_conf['vault_url'], ROOT_PATH + '/config/.vault_token')
+
+    snow_username = None
+    snow_password = None
+    snow_creds = vault_session.retrieve_secret(mim_conf['snow_tag'])
+    if snow_creds[0]:
+        for k, v in snow_creds[1].items():
+            snow_username = k
+            snow_password = v
+
+    # Shared secret ServiceNow signs webhook deliveries with, see itsm/snow_webhook.py
+    webhook_secret = None
+    if mim_conf.get('snow_webhook_tag'):
+        webhook_creds = vault_session.retrieve_secret(mim_conf['snow_webhook_tag'])
+        if webhook_creds[0] and webhook_creds[1]:
+            webhook_secret = list(webhook_creds[1].values())[0]
+
+    return {'snow_username': snow_username, 'snow_password': snow_password, 'webhook_secret': webhook_secret}
+
+
+def get_mim_conf():
+    """mim_conf.json, read once per process."""
+    return _cached_settings()['mim_conf']
+
+
+# Pool settings for a client built from explicit arguments; mim_conf.json may be absent then
+def _settings_conf():
+    try:
+        return get_mim_conf()
+    except Exception:
+        return {}
+
+
+def get_snow_settings():
+    """
+        mim_conf.json settings plus the current ServiceNow credentials.
+
+        mim_conf.json is read once per process. Credentials go through the Vault
+        secret cache on every call, so a rotated password is picked up once its
+        cache entry is refreshed, and a failed read is retried on the next call.
+    """
+    settings = dict(_cached_settings())
+
+    credentials = settings.pop('credentials')
+    if credentials is None:
+        credentials = _vault_credentials(settings['mim_conf'])
+    settings.update(credentials)
+
+    return settings
+
+
+def configure_snow_settings(snow_url, username = None, password = None, mim_conf = None):
+    """Use these settings instead of mim_conf.json and Vault, e.g. against the local stand-in in snow_standin.py."""
+    global _snow_settings
+
+    mim_conf = dict(mim_conf if mim_conf is not None else _load_pool_conf(), snow_url = snow_url)
+
+    with _settings_lock:
+        _snow_settings = {
+            'mim_conf': mim_conf,
+            'snow_url': snow_url.rstrip('/'),
+            'proxies': None,
+            'credentials': {'snow_username': username, 'snow_password': password, 'webhook_secret': None}
+        }
+
+    return get_snow_settings()
+
+
+# Shared-client key; the password is hashed, so a rotated credential gets a new client and session
+def client_key(snow_url, username, password):
+    return (snow_url.rstrip('/'), username, hashlib.sha256((password or '').encode('utf-8')).hexdigest())
+
+
+def get_snow_client(snow_url = None, username = None, password = None, proxies = None):
+    """
+        Return the shared SnowClient for an instance and credential.
+
+        Without arguments, the instance and credentials come from mim_conf.json
+        and Vault, see get_snow_settings().
+    """
+    settings = None
+    if snow_url is None:
+        settings = get_snow_settings()
+        snow_url = settings['snow_url']
+        username = settings['snow_username']
+        password = settings['snow_password']
+        proxies = settings['proxies']
+
+    key = client_key(snow_url, username, password)
+
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is not None:
+            return client
+
+        mim_conf = settings['mim_conf'] if settings else _settings_conf()
+        client = SnowClient(snow_url, username, password, proxies = proxies,
+                            pool_connections = mim_conf.get('snow_pool_connections', DEFAULT_POOL_CONNECTIONS),
+                            pool_maxsize = mim_conf.get('snow_pool_maxsize', DEFAULT_POOL_MAXSIZE),
+                            connect_timeout = mim_conf.get('snow_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                            read_timeout = mim_conf.get('snow_read_timeout', DEFAULT_READ_TIMEOUT),
+                            page_size = mim_conf.get('snow_page_size', DEFAULT_PAGE_SIZE),
+                            batch_size = mim_conf.get('snow_batch_size', DEFAULT_BATCH_SIZE),
+                            batch_workers = mim_conf.get('snow_batch_workers', DEFAULT_BATCH_WORKERS),
+                            scheduler = RequestScheduler(**scheduler_conf(mim_conf)))
+        _clients[key] = client
+
+        return client
+
+
+# Plain value of a field returned with sysparm_display_value=all or as a reference
+def display_record(record, raw_fields = ()):
+    """
+        Map a sysparm_display_value=all record in place to what display_value=true
+        returns; fields in raw_fields keep their raw value instead.
+    """
+    for (field, value) in record.items():
+        if not isinstance(value, dict) or 'display_value' not in value:
+            continue
+
+        if field in raw_fields:
+            record[field] = value.get('value')
+        elif 'link' in value:
+            record[field] = {'display_value': value['display_value'], 'link': value['link']}
+        else:
+            record[field] = value['display_value']
+
+    return record
+
+
+def _raw_value(value):
+    if isinstance(value, dict):
+        return value.get('value', value.get('display_value'))
+
+    return value
+
+
+def _load_pool_conf():
+    try:
+        with open(ROOT_PATH + '/config/mim_conf.json') as conf_f:
+            return json.load(conf_f)
+    except Exception:
+        return {}
+
+
+def get_pool_stats():
+    with _clients_lock:
+        clients = list(_clients.values())
+
+    return [client.pool_stats() for client in clients]
+
+
+def close_snow_clients():
+    global _snow_settings
+
+    with _clients_lock:
+        clients = list(_clients.values())
+        _clients.clear()
+
+    with _settings_lock:
+        _snow_settings = None
+
+    for client in clients:
+        client.close()
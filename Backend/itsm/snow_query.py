@@ -0,0 +1,60 @@
+import datetime
+
+
+# Encoded query for records created between two '%Y-%m-%d %H:%M:%S' timestamps
+def build_time_window_query(start_ts, end_ts, column = 'sys_created_on'):
+    [start_date, start_time] = start_ts.split(' ')
+    [end_date, end_time] = end_ts.split(' ')
+
+    return column + 'BETWEEN' + \
+            'javascript:gs.dateGenerate(\'' + start_date + '\',\'' + start_time + '\')@' + \
+            'javascript:gs.dateGenerate(\'' + end_date + '\',\'' + end_time + '\')'
+
+
+# True when the window is valid, i.e. end is not before start
+def is_valid_window(start_ts, end_ts):
+    start_ts_obj = datetime.datetime.strptime(start_ts, '%Y-%m-%d %H:%M:%S')
+    end_ts_obj = datetime.datetime.strptime(end_ts, '%Y-%m-%d %H:%M:%S')
+
+    return end_ts_obj >= start_ts_obj
+
+
+# Encoded query for [{"param": ..., "op": ..., "val": ...}] conditions
+def build_conditions_query(conditions):
+    query = ''
+    for condition in conditions or []:
+        query += '^' + condition['param'] + condition['op'] + condition['val']
+
+    return query
+
+
+# Encoded query for the page after (last_created_on, last_sys_id) in keyset order
+def build_keyset_query(base_query, last_created_on = None, last_sys_id = None):
+    base_query = (base_query or '').strip('^')
+    prefix = base_query + '^' if base_query else ''
+
+    if last_sys_id is None:
+        query = base_query
+    else:
+        # (created_on > last) OR (created_on = last AND sys_id > last_id)
+        query = prefix + 'sys_created_on>' + last_created_on + \
+                '^NQ' + prefix + 'sys_created_on=' + last_created_on + '^sys_id>' + last_sys_id
+
+    return (query + '^' if query else '') + 'ORDERBYsys_created_on^ORDERBYsys_id'
+
+
+def record_link(snow_url, table, sys_id):
+    return snow_url + '/now/nav/ui/classic/params/target/' + table + '.do%3Fsys_id%3D' + sys_id
+
+
+def kb_link(snow_url, sys_id):
+    return snow_url + '/now/nav/ui/classic/params/target/kb_view.do%3Fsys_kb_id%3D' + sys_id
+
+
+# Encoded query for records created in [start_ts, end_ts), so adjacent ranges do not overlap
+def build_range_query(start_ts, end_ts, column = 'sys_created_on'):
+    [start_date, start_time] = start_ts.split(' ')
+    [end_date, end_time] = end_ts.split(' ')
+
+    return column + '>=' + 'javascript:gs.dateGenerate(\'' + start_date + '\',\'' + start_time + '\')' + \
+            '^' + column + '<' + 'javascript:gs.dateGenerate(\'' + end_date + '\',\'' + end_time + '\')'
@@ -0,0 +1,240 @@
+import time
+import random
+import asyncio
+import threading
+import email.utils
+from urllib.parse import urlparse
+
+# Defaults, overridable from mim_conf.json
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_BASE_DELAY = 0.5
+DEFAULT_RETRY_MAX_DELAY = 30.0
+DEFAULT_CONCURRENCY_INITIAL = 8
+DEFAULT_CONCURRENCY_MIN = 1
+DEFAULT_CONCURRENCY_MAX = 20
+DEFAULT_RATE_LIMITS = {'default': {'rate': 50, 'burst': 100}}
+
+# Responses that mean the instance is shedding load rather than rejecting the request
+THROTTLE_STATUS = [429, 503]
+
+# Throttled responses arriving together count as one signal for the concurrency limit
+DECREASE_INTERVAL = 1.0
+
+# Retried on any transient failure; other methods only when the instance throttled them before running
+IDEMPOTENT_METHODS = ['GET', 'HEAD', 'OPTIONS']
+
+# The only status that proves a write was not applied; a 503 may come from a proxy after it ran
+RATE_LIMITED_STATUS = 429
+
+
+# Rate-limit bucket for a request path, e.g. /api/now/table/incident or /api/now/attachment
+def endpoint_key(url):
+    parts = [part for part in urlparse(url).path.split('/') if part]
+
+    if parts[:2] == ['api', 'now'] and len(parts) > 2:
+        if parts[2] in ['table', 'stats'] and len(parts) > 3:
+            return '/' + '/'.join(parts[:4])
+
+        # Versioned paths, e.g. /api/now/v1/batch
+        if parts[2].startswith('v') and parts[2][1:].isdigit() and len(parts) > 3:
+            return '/' + '/'.join(parts[:4])
+
+        return '/' + '/'.join(parts[:3])
+
+    return '/' + '/'.join(parts[:2])
+
+
+# Seconds to wait from a Retry-After header, given either as seconds or as an HTTP date
+def retry_after_seconds(value):
+    if not value:
+        return None
+
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+
+    try:
+        return max(email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except Exception:
+        return None
+
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second up to burst; reserve() returns the wait for one token."""
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+        # Retry-After from the instance pauses the whole endpoint
+        self.blocked_until = 0.0
+
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+            # Tokens may go negative; each caller waits its turn in the deficit
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+            return max(wait, self.blocked_until - now)
+
+    def block(self, seconds):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class _SchedulerState:
+    """
+        Limits shared by the thread and asyncio schedulers.
+
+        Concurrency follows additive-increase/multiplicative-decrease: the
+        in-flight limit grows by one for every window of successful calls and
+        halves when the instance throttles. Each endpoint also has its own token
+        bucket, and Retry-After pauses that endpoint.
+    """
+    def __init__(self, rate_limits = None, concurrency_initial = DEFAULT_CONCURRENCY_INITIAL,
+                 concurrency_min = DEFAULT_CONCURRENCY_MIN, concurrency_max = DEFAULT_CONCURRENCY_MAX,
+                 max_retries = DEFAULT_MAX_RETRIES, retry_base_delay = DEFAULT_RETRY_BASE_DELAY,
+                 retry_max_delay = DEFAULT_RETRY_MAX_DELAY):
+        self.rate_limits = dict(DEFAULT_RATE_LIMITS, **(rate_limits or {}))
+        self.concurrency_min = concurrency_min
+        self.concurrency_max = max(concurrency_max, concurrency_min)
+        self.limit = float(min(max(concurrency_initial, concurrency_min), self.concurrency_max))
+        self.max_retries = max_retries
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._buckets = {}
+        self._endpoint_stats = {}
+        self._state_lock = threading.Lock()
+
+    def bucket(self, endpoint):
+        with self._state_lock:
+            bucket = self._buckets.get(endpoint)
+            if bucket is None:
+                conf = self.rate_limits.get(endpoint, self.rate_limits['default'])
+                bucket = TokenBucket(conf['rate'], conf['burst'])
+                self._buckets[endpoint] = bucket
+                self._endpoint_stats[endpoint] = {'requests': 0, 'throttled': 0, 'retries': 0}
+
+            return bucket
+
+    def _count(self, endpoint, name):
+        with self._state_lock:
+            self._endpoint_stats[endpoint][name] += 1
+
+    def record(self, endpoint, status_code, retry_after = None):
+        """Adjust the limits from a response status; status_code 0 means the call failed without a response."""
+        self._count(endpoint, 'requests')
+
+        if status_code in THROTTLE_STATUS:
+            self._count(endpoint, 'throttled')
+            with self._state_lock:
+                now = time.monotonic()
+                if now - self._last_decrease >= DECREASE_INTERVAL:
+                    self.limit = max(float(self.concurrency_min), self.limit / 2)
+                    self._last_decrease = now
+
+            if retry_after is not None:
+                self.bucket(endpoint).block(retry_after)
+
+        elif 0 < status_code < 500:
+            with self._state_lock:
+                self.limit = min(float(self.concurrency_max), self.limit + 1 / self.limit)
+
+    def should_retry(self, method, status_code, attempt):
+        if attempt >= self.max_retries:
+            return False
+
+        if method.upper() not in IDEMPOTENT_METHODS:
+            return status_code == RATE_LIMITED_STATUS
+
+        return status_code in THROTTLE_STATUS or status_code == 0 or status_code >= 500
+
+    def backoff(self, attempt, retry_after = None):
+        """Retry-After when the instance sent one, otherwise exponential backoff with full jitter."""
+        if retry_after is not None:
+            return min(retry_after, self.retry_max_delay)
+
+        return random.uniform(0, min(self.retry_max_delay, self.retry_base_delay * (2 ** attempt)))
+
+    def note_retry(self, endpoint):
+        self._count(endpoint, 'retries')
+
+    def stats(self):
+        with self._state_lock:
+            return {
+                'concurrency_limit': round(self.limit, 2),
+                'in_flight': self.in_flight,
+                'endpoints': {endpoint: dict(stats, rate = self._buckets[endpoint].rate, burst = self._buckets[endpoint].burst)
+                              for (endpoint, stats) in self._endpoint_stats.items()}
+            }
+
+
+class RequestScheduler(_SchedulerState):
+    """Scheduler for SnowClient, whose requests run on many threads."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._slots = threading.Condition()
+
+    def acquire(self, endpoint):
+        wait = self.bucket(endpoint).reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+        with self._slots:
+            while self.in_flight >= int(self.limit):
+                self._slots.wait()
+            self.in_flight += 1
+
+    def release(self):
+        with self._slots:
+            self.in_flight -= 1
+            self._slots.notify_all()
+
+
+class AsyncRequestScheduler(_SchedulerState):
+    """Scheduler for AsyncSnowClient, whose requests share one event loop."""
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._slots = None
+
+    async def acquire(self, endpoint):
+        # Created lazily so it binds to the running loop
+        if self._slots is None:
+            self._slots = asyncio.Condition()
+
+        wait = self.bucket(endpoint).reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+        async with self._slots:
+            await self._slots.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._slots:
+            self.in_flight -= 1
+            self._slots.notify_all()
+
+
+# Scheduler settings from mim_conf.json
+def scheduler_conf(mim_conf):
+    return {
+        'rate_limits': mim_conf.get('snow_rate_limits'),
+        'concurrency_initial': mim_conf.get('snow_concurrency_initial', DEFAULT_CONCURRENCY_INITIAL),
+        'concurrency_min': mim_conf.get('snow_concurrency_min', DEFAULT_CONCURRENCY_MIN),
+        'concurrency_max': mim_conf.get('snow_concurrency_max', DEFAULT_CONCURRENCY_MAX),
+        'max_retries': mim_conf.get('snow_max_retries', DEFAULT_MAX_RETRIES),
+        'retry_base_delay': mim_conf.get('snow_retry_base_delay', DEFAULT_RETRY_BASE_DELAY),
+        'retry_max_delay': mim_conf.get('snow_retry_max_delay', DEFAULT_RETRY_MAX_DELAY)
+    }
@@ -0,0 +1,678 @@
+import os
+import re
+import sys
+import json
+import time
+import base64
+import random
+import argparse
+import datetime
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_batch import BATCH_PATH
+from itsm.snow_stats import STATS_PATH
+from itsm.snow_attachments import ATTACHMENT_FILE_PATH
+
+TABLE_PATH = '/api/now/table/'
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}$')
+
+# Reference columns: (table, column) -> referenced table
+REFERENCES = {
+    ('incident', 'assignment_group'): 'sys_user_group',
+    ('incident', 'cmdb_ci'): 'cmdb_ci',
+    ('change_request', 'assignment_group'): 'sys_user_group',
+    ('change_request', 'cmdb_ci'): 'cmdb_ci',
+    ('change_task', 'assignment_group'): 'sys_user_group',
+    ('change_task', 'change_request'): 'change_request',
+    ('kb_knowledge', 'kb_knowledge_base'): 'kb_knowledge_base',
+    ('cmdb_rel_ci', 'parent'): 'cmdb_ci',
+    ('cmdb_rel_ci', 'child'): 'cmdb_ci',
+    ('cmdb_rel_ci', 'type'): 'cmdb_rel_type'
+}
+
+# Column shown for a reference when display values are requested
+DISPLAY_FIELDS = ['name', 'number', 'title', 'label', 'user_name']
+
+NUMBER_PREFIXES = {'incident': 'INC', 'change_request': 'CHG', 'change_task': 'CTASK', 'kb_knowledge': 'KB'}
+
+CI_CLASSES = ['cmdb_ci_appl', 'cmdb_ci_linux_server', 'cmdb_ci_win_server', 'cmdb_ci_db_instance', 'cmdb_ci_lb']
+REL_TYPES = ['Depends on::Used by', 'Runs on::Runs', 'Hosted on::Hosts', 'Connects to::Connected by']
+
+QUERY_OPERATORS = ['NOT IN', 'NOTLIKE', 'STARTSWITH', 'ENDSWITH', 'BETWEEN', 'ISNOTEMPTY', 'ISEMPTY', 'LIKE', 'IN',
+                   '>=', '<=', '!=', '>', '<', '=']
+QUERY_TERM = re.compile(r'^([A-Za-z_][A-Za-z0-9_.]*?)(' + '|'.join([re.escape(op) for op in QUERY_OPERATORS]) + r')(.*)$', re.S)
+DATE_GENERATE = re.compile(r"javascript:gs\.dateGenerate\('([^']*)','([^']*)'\)")
+
+# Largest sysparm_limit the instance honours
+DEFAULT_MAX_PAGE_SIZE = 10000
+
+
+def _sys_id(rand):
+    return '%032x' % rand.getrandbits(128)
+
+
+def _value(value, utc_offset = 0):
+    # javascript:gs.dateGenerate('2024-01-01','00:00:00') -> '2024-01-01 00:00:00', read in the user's timezone
+    def to_utc(match):
+        local = datetime.datetime.strptime(match.group(1) + ' ' + match.group(2), TS_FORMAT)
+        return (local - datetime.timedelta(hours = utc_offset)).strftime(TS_FORMAT)
+
+    return DATE_GENERATE.sub(to_utc, value)
+
+
+class SnowStandIn:
+    """
+        Local stand-in for the parts of a ServiceNow instance the ITSM code uses.
+
+        Serves the Table API (keyset-pageable encoded queries with IN, LIKE,
+        BETWEEN, comparisons, ^OR, ^NQ and ORDERBY, dot-walked fields and
+        reference links), the Attachment and Batch APIs and the Aggregate
+        (stats) API over seeded synthetic data: tickets, change tasks, KB
+        articles, user groups and a CMDB graph of roots x fanout^depth CIs with
+        optional cross links.
+
+        Every request waits latency_ms (plus up to jitter_ms, plus row_cost_ms
+        per returned row), sysparm_limit is capped at max_page_size, and
+        throttle_rate of the requests are answered 429 with Retry-After, so
+        client paging, retries and concurrency can be measured offline.
+
+        With batch_api off the Batch API answers 404, as on instances that do
+        not expose it; batch_max_requests leaves the rest of a batch
+        unserviced, as when the batch time limit runs out. Inserts missing a
+        field listed for their table in mandatory_fields fail with a 403 data
+        policy error.
+
+        Like an instance, timestamps are stored and compared in UTC, while
+        display values and gs.dateGenerate() use the session user's timezone
+        (utc_offset hours) and display_format.
+    """
+    def __init__(self, host = '127.0.0.1', port = 0, latency_ms = 0.0, jitter_ms = 0.0, row_cost_ms = 0.0,
+                 max_page_size = DEFAULT_MAX_PAGE_SIZE, throttle_rate = 0.0, retry_after = 1, incidents = 1000,
+                 change_requests = 200, kb_articles = 200, kb_article_bytes = 4000, groups = 20, cmdb_roots = 5,
+                 cmdb_fanout = 4, cmdb_depth = 4, cmdb_cross_links = 0, ke_category = 'Knowledge', seed = 7,
+                 utc_offset = 0, display_format = TS_FORMAT, batch_api = True, batch_max_requests = 0,
+                 mandatory_fields = None):
+        self.host = host
+        self.port = port
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.row_cost_ms = row_cost_ms
+        self.max_page_size = max_page_size
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.utc_offset = utc_offset
+        self.display_format = display_format
+        self.batch_api = batch_api
+        self.batch_max_requests = batch_max_requests
+        self.mandatory_fields = mandatory_fields or {}
+
+        self._rand = random.Random(seed)
+        self._lock = threading.RLock()
+        self._tables = {}
+        self._by_id = {}
+        self._numbers = {}
+        self._clock = datetime.datetime(2024, 1, 1)
+
+        self._stats = {'requests': 0, 'throttled': 0, 'rows_returned': 0}
+        self._server = None
+        self._thread = None
+
+        self._generate(incidents, change_requests, kb_articles, kb_article_bytes, groups, cmdb_roots, cmdb_fanout,
+                       cmdb_depth, cmdb_cross_links, ke_category)
+
+    # Synthetic data
+
+    def insert(self, table, record):
+        """Add a record with the system fields ServiceNow would fill in and return it."""
+        with self._lock:
+            record = dict(record)
+            record.setdefault('sys_id', _sys_id(self._rand))
+
+            self._clock += datetime.timedelta(seconds = 1)
+            record.setdefault('sys_created_on', self._clock.strftime(TS_FORMAT))
+            record.setdefault('sys_updated_on', record['sys_created_on'])
+
+            if table in NUMBER_PREFIXES and not record.get('number'):
+                self._numbers[table] = self._numbers.get(table, 10000) + 1
+                record['number'] = NUMBER_PREFIXES[table] + '%07d' % self._numbers[table]
+
+            self._tables.setdefault(table, []).append(record)
+            self._by_id.setdefault(table, {})[record['sys_id']] = record
+
+            return record
+
+    def _generate(self, incidents, change_requests, kb_articles, kb_article_bytes, groups, cmdb_roots, cmdb_fanout,
+                  cmdb_depth, cmdb_cross_links, ke_category):
+        rand = self._rand
+
+        group_ids = [self.insert('sys_user_group', {'name': 'Group %02d' % ind})['sys_id'] for ind in range(1, groups + 1)]
+        for ind in range(1, groups + 1):
+            self.insert('sys_user', {'name': 'User %02d' % ind, 'user_name': 'user%02d' % ind})
+        for ci_class in CI_CLASSES + ['cmdb_ci']:
+            self.insert('sys_db_object', {'name': ci_class, 'label': ci_class.replace('cmdb_ci_', '').replace('_', ' ').title(),
+                                          'super_class': 'cmdb_ci'})
+        type_ids = [self.insert('cmdb_rel_type', {'name': name})['sys_id'] for name in REL_TYPES]
+
+        # CMDB: cmdb_roots trees of cmdb_fanout children per CI, cmdb_depth levels deep
+        ci_ids = []
+
+        def add_ci(level):
+            ind = len(ci_ids) + 1
+            ci = self.insert('cmdb_ci', {'name': '%s-%05d' % (['app', 'srv', 'db', 'lb'][level % 4], ind),
+                                         'sys_class_name': CI_CLASSES[level % len(CI_CLASSES)],
+                                         'ip_address': '10.%d.%d.%d' % (ind // 65536 % 256, ind // 256 % 256, ind % 256)})
+            ci_ids.append(ci['sys_id'])
+            return ci['sys_id']
+
+        def add_relation(parent, child):
+            self.insert('cmdb_rel_ci', {'parent': parent, 'child': child, 'type': rand.choice(type_ids)})
+
+        level_ids = [add_ci(0) for ind in range(cmdb_roots)]
+        for level in range(1, cmdb_depth + 1):
+            next_ids = []
+            for parent in level_ids:
+                for ind in range(cmdb_fanout):
+                    child = add_ci(level)
+                    add_relation(parent, child)
+                    next_ids.append(child)
+            level_ids = next_ids
+
+        for ind in range(cmdb_cross_links):
+            (parent, child) = rand.sample(ci_ids, 2)
+            add_relation(parent, child)
+
+        # Tickets, oldest first as sys_created_on grows with every insert
+        words = ['disk', 'latency', 'login', 'outage', 'backup', 'certificate', 'memory', 'network', 'patch', 'queue']
+
+        def sentence(count):
+            return ' '.join([rand.choice(words) for ind in range(count)]).capitalize()
+
+        for ind in range(incidents):
+            self.insert('incident', {'short_description': sentence(6), 'description': sentence(40), 'close_notes': sentence(20),
+                                     'state': rand.choice(['New', 'In Progress', 'Resolved', 'Closed']),
+                                     'priority': rand.choice(['1 - Critical', '2 - High', '3 - Moderate', '4 - Low']),
+                                     'category': rand.choice(['Software', 'Hardware', 'Network', 'Database']),
+                                     'assignment_group': rand.choice(group_ids), 'cmdb_ci': rand.choice(ci_ids) if ci_ids else ''})
+
+        for ind in range(change_requests):
+            start = self._clock + datetime.timedelta(days = rand.randint(1, 30))
+            change = self.insert('change_request', {'short_description': sentence(6), 'description': sentence(40),
+                                                    'implementation_plan': sentence(60), 'backout_plan': sentence(30),
+                                                    'test_plan': sentence(30), 'assignment_group': rand.choice(group_ids),
+                                                    'start_date': start.strftime(TS_FORMAT),
+                                                    'end_date': (start + datetime.timedelta(hours = 2)).strftime(TS_FORMAT),
+                                                    'state': rand.choice(['New', 'Assess', 'Scheduled', 'Closed']),
+                                                    'chg_model': rand.choice(['normal', 'standard', 'emergency']),
+                                                    'approval': rand.choice(['requested', 'approved', 'not requested']),
+                                                    'cmdb_ci': rand.choice(ci_ids) if ci_ids else ''})
+
+            for task in range(rand.randint(1, 3)):
+                self.insert('change_task', {'change_request': change['sys_id'], 'short_description': sentence(5),
+                                            'description': sentence(20), 'assignment_group': rand.choice(group_ids)})
+
+        kb_base = self.insert('kb_knowledge_base', {'title': ke_category})
+        for ind in range(kb_articles):
+            paragraphs = []
+            size = 0
+            while size < kb_article_bytes:
+                paragraph = '<p>' + sentence(30) + '</p>'
+                paragraphs.append(paragraph)
+                size += len(paragraph)
+
+            self.insert('kb_knowledge', {'short_description': sentence(6), 'category': rand.choice(['Software', 'Network', 'Database']),
+                                         'text': '<h2>' + sentence(4) + '</h2>' + ''.join(paragraphs),
+                                         'workflow_state': 'published', 'kb_knowledge_base': kb_base['sys_id']})
+
+    # Field access
+
+    def _resolve(self, table, record, path):
+        """(table, value) of a possibly dot-walked field; table is the referenced one for reference columns."""
+        (field, _, rest) = path.partition('.')
+        value = record.get(field, '')
+        ref_table = REFERENCES.get((table, field))
+
+        if not rest:
+            return (ref_table, value)
+
+        target = self._by_id.get(ref_table, {}).get(value) if ref_table else None
+        if target is None:
+            return (None, '')
+
+        return self._resolve(ref_table, target, rest)
+
+    def _display(self, ref_table, sys_id):
+        target = self._by_id.get(ref_table, {}).get(sys_id)
+        if target is None:
+            return ''
+
+        for field in DISPLAY_FIELDS:
+            if target.get(field):
+                return target[field]
+
+        return sys_id
+
+    def _display_ts(self, value):
+        local = datetime.datetime.strptime(value, TS_FORMAT) + datetime.timedelta(hours = self.utc_offset)
+        return local.strftime(self.display_format)
+
+    def _render(self, table, record, fields, display_value, exclude_links):
+        output = {}
+        for field in fields or list(record.keys()):
+            (ref_table, value) = self._resolve(table, record, field)
+
+            if ref_table and value:
+                link = 'http://' + self.host + ':' + str(self.port) + TABLE_PATH + ref_table + '/' + value
+                display = self._display(ref_table, value)
+
+                if display_value == 'true':
+                    value = display if exclude_links else {'display_value': display, 'link': link}
+                elif display_value == 'all':
+                    value = {'display_value': display, 'value': value} if exclude_links else \
+                            {'display_value': display, 'value': value, 'link': link}
+                elif not exclude_links:
+                    value = {'link': link, 'value': value}
+
+            elif display_value in ('true', 'all'):
+                display = self._display_ts(value) if isinstance(value, str) and TIMESTAMP.match(value) else value
+                value = {'display_value': display, 'value': value} if display_value == 'all' else display
+
+            output[field] = value
+
+        return output
+
+    # Encoded queries
+
+    def _term_matches(self, table, record, term):
+        match = QUERY_TERM.match(term)
+        if match is None:
+            return True
+
+        (field, op, expected) = match.groups()
+        expected = _value(expected, self.utc_offset)
+        (ref_table, value) = self._resolve(table, record, field)
+        value = '' if value is None else str(value)
+
+        # Reference columns also match on their display value
+        candidates = [value, self._display(ref_table, value)] if ref_table and value else [value]
+
+        for value in candidates:
+            if op == '=' and value == expected: return True
+            if op == '!=' and value != expected: return True
+            if op == 'IN' and value in expected.split(','): return True
+            if op == 'NOT IN' and value not in expected.split(','): return True
+            if op == 'LIKE' and expected.lower() in value.lower(): return True
+            if op == 'NOTLIKE' and expected.lower() not in value.lower(): return True
+            if op == 'STARTSWITH' and value.lower().startswith(expected.lower()): return True
+            if op == 'ENDSWITH' and value.lower().endswith(expected.lower()): return True
+            if op == 'ISEMPTY' and value == '': return True
+            if op == 'ISNOTEMPTY' and value != '': return True
+            if op == '>' and value > expected: return True
+            if op == '>=' and value >= expected: return True
+            if op == '<' and value < expected: return True
+            if op == '<=' and value <= expected: return True
+            if op == 'BETWEEN':
+                (low, _, high) = expected.partition('@')
+                if low <= value <= high: return True
+
+        return False
+
+    def _parse_query(self, query):
+        """([[[or-term, ...], ...] per ^NQ group], [(field, descending)])"""
+        groups = []
+        order = []
+
+        for group_query in (query or '').split('^NQ'):
+            clauses = []
+            for term in group_query.split('^'):
+                if not term:
+                    continue
+
+                if term.startswith('ORDERBYDESC'):
+                    order.append((term[11:], True))
+                elif term.startswith('ORDERBY'):
+                    order.append((term[7:], False))
+                elif term.startswith('OR') and clauses:
+                    clauses[-1].append(term[2:])
+                else:
+                    clauses.append([term])
+
+            if clauses:
+                groups.append(clauses)
+
+        return (groups, order)
+
+    def select(self, table, query = '', filters = None):
+        (groups, order) = self._parse_query(query)
+
+        with self._lock:
+            records = list(self._tables.get(table, []))
+
+        def matches(record):
+            for (field, expected) in (filters or {}).items():
+                if not self._term_matches(table, record, field + '=' + expected):
+                    return False
+
+            if not groups:
+                return True
+
+            return any([all([any([self._term_matches(table, record, term) for term in clause]) for clause in clauses])
+                        for clauses in groups])
+
+        records = [record for record in records if matches(record)]
+
+        for (field, descending) in reversed(order):
+            records.sort(key = lambda record: str(self._resolve(table, record, field)[1]), reverse = descending)
+
+        return records
+
+    # Request handling
+
+    def handle(self, method, path, params, body):
+        """(status, headers, body) for one API call, used by the HTTP handler and for Batch API items."""
+        if path.startswith(TABLE_PATH):
+            return self._table(method, path[len(TABLE_PATH):].strip('/'), params, body)
+
+        if path == ATTACHMENT_FILE_PATH and method == 'POST':
+            return self._attachment(params, body)
+
+        if path == BATCH_PATH and method == 'POST' and self.batch_api:
+            return self._batch(body)
+
+        if path.startswith(STATS_PATH) and method == 'GET':
+            return self._aggregate(path[len(STATS_PATH):].strip('/'), params)
+
+        return (404, {}, {'error': {'message': 'No such endpoint ' + path}})
+
+    def _table(self, method, resource, params, body):
+        (table, _, sys_id) = resource.partition('/')
+
+        if method == 'GET' and not sys_id:
+            filters = {name: value for (name, value) in params.items() if not name.startswith('sysparm_')}
+            records = self.select(table, params.get('sysparm_query', ''), filters)
+
+            offset = int(params.get('sysparm_offset', 0))
+            limit = min(int(params.get('sysparm_limit', self.max_page_size)), self.max_page_size)
+            page = records[offset:offset + limit]
+
+            fields = [field.strip() for field in params.get('sysparm_fields', '').split(',') if field.strip()]
+            result = [self._render(table, record, fields, params.get('sysparm_display_value', 'false'),
+                                   params.get('sysparm_exclude_reference_link') == 'true') for record in page]
+
+            headers = {}
+            if params.get('sysparm_no_count') != 'true':
+                headers['X-Total-Count'] = str(len(records))
+
+            self._count(rows_returned = len(result))
+            self._row_cost(len(result))
+
+            return (200, headers, {'result': result})
+
+        if method == 'POST' and not sys_id:
+            try:
+                record = json.loads(body or b'{}')
+            except ValueError:
+                return (400, {}, {'error': {'message': 'Invalid JSON body'}})
+
+            missing = [field for field in self.mandatory_fields.get(table, []) if not record.get(field)]
+            if missing:
+                return (403, {}, {'error': {'message': 'Operation Failed', 'detail': 'Data Policy Exception: ' +
+                                            ', '.join(missing) + ' mandatory'}, 'status': 'failure'})
+
+            record = self.insert(table, {name: str(value) for (name, value) in record.items()})
+            return (201, {}, {'result': self._render(table, record, None, 'false', True)})
+
+        with self._lock:
+            record = self._by_id.get(table, {}).get(sys_id)
+        if record is None:
+            return (404, {}, {'error': {'message': 'No Record found'}})
+
+        if method in ['PATCH', 'PUT']:
+            try:
+                changes = json.loads(body or b'{}')
+            except ValueError:
+                return (400, {}, {'error': {'message': 'Invalid JSON body'}})
+
+            with self._lock:
+                record.update({name: str(value) for (name, value) in changes.items()})
+                self._clock += datetime.timedelta(seconds = 1)
+                record['sys_updated_on'] = self._clock.strftime(TS_FORMAT)
+
+        elif method == 'DELETE':
+            with self._lock:
+                self._tables[table].remove(record)
+                del self._by_id[table][sys_id]
+            return (204, {}, None)
+
+        fields = [field.strip() for field in params.get('sysparm_fields', '').split(',') if field.strip()]
+        return (200, {}, {'result': self._render(table, record, fields, params.get('sysparm_display_value', 'false'),
+                                                 params.get('sysparm_exclude_reference_link') == 'true')})
+
+    def _attachment(self, params, body):
+        if not params.get('table_name') or not params.get('table_sys_id'):
+            return (400, {}, {'error': {'message': 'table_name and table_sys_id are required'}})
+
+        record = self.insert('sys_attachment', {'table_name': params['table_name'], 'table_sys_id': params['table_sys_id'],
+                                                'file_name': params.get('file_name', ''), 'size_bytes': str(len(body or b''))})
+
+        return (201, {}, {'result': record})
+
+    def _batch(self, body):
+        try:
+            payload = json.loads(body or b'{}')
+        except ValueError:
+            return (400, {}, {'error': {'message': 'Invalid JSON body'}})
+
+        rest_requests = payload.get('rest_requests', [])
+        limit = self.batch_max_requests or len(rest_requests)
+
+        serviced = []
+        for item in rest_requests[:limit]:
+            url = urlsplit(item.get('url', ''))
+            params = {name: values[-1] for (name, values) in parse_qs(url.query, keep_blank_values = True).items()}
+            item_body = base64.b64decode(item['body']) if item.get('body') else b''
+
+            started = time.perf_counter()
+            (status, headers, result) = self.handle(item.get('method', 'GET').upper(), url.path, params, item_body)
+            content = json.dumps(result).encode('utf-8') if result is not None else b''
+
+            serviced.append({'id': item.get('id'), 'status_code': status, 'status_text': 'OK' if status < 400 else 'Error',
+                             'headers': [{'name': name, 'value': value} for (name, value) in headers.items()],
+                             'body': base64.b64encode(content).decode('ascii'),
+                             'execution_time': int((time.perf_counter() - started) * 1000)})
+
+        return (200, {}, {'batch_request_id': payload.get('batch_request_id'), 'serviced_requests': serviced,
+                          'unserviced_requests': [item.get('id') for item in rest_requests[limit:]]})
+
+    def _aggregate(self, table, params):
+        records = self.select(table, params.get('sysparm_query', ''))
+        group_by = [field.strip() for field in params.get('sysparm_group_by', '').split(',') if field.strip()]
+
+        if not group_by:
+            return (200, {}, {'result': {'stats': {'count': str(len(records))}}})
+
+        groups = {}
+        for record in records:
+            key = tuple([self._resolve(table, record, field) for field in group_by])
+            groups[key] = groups.get(key, 0) + 1
+
+        result = []
+        for (key, count) in sorted(groups.items(), key = lambda item: [str(value) for (_, value) in item[0]]):
+            fields = [{'field': field, 'value': value, 'display_value': self._display(ref_table, value) if ref_table and value else value}
+                      for (field, (ref_table, value)) in zip(group_by, key)]
+            result.append({'stats': {'count': str(count)}, 'groupby_fields': fields})
+
+        return (200, {}, {'result': result})
+
+    # Simulated instance behaviour
+
+    def _count(self, **counts):
+        with self._lock:
+            for (name, value) in counts.items():
+                self._stats[name] += value
+
+    def _row_cost(self, rows):
+        if self.row_cost_ms:
+            time.sleep(self.row_cost_ms * rows / 1000.0)
+
+    def delay(self):
+        latency = self.latency_ms + (self._rand.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if latency > 0:
+            time.sleep(latency / 1000.0)
+
+    def throttled(self):
+        with self._lock:
+            self._stats['requests'] += 1
+            if self.throttle_rate and self._rand.random() < self.throttle_rate:
+                self._stats['throttled'] += 1
+                return True
+
+        return False
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, tables = {table: len(records) for (table, records) in self._tables.items()})
+
+    # Server
+
+    @property
+    def url(self):
+        return 'http://' + self.host + ':' + str(self.port)
+
+    def start(self):
+        """Serve on a background thread; port 0 picks a free port, see url."""
+        self._server = ThreadingHTTPServer((self.host, self.port), _handler(self))
+        self._server.daemon_threads = True
+        self.port = self._server.server_address[1]
+
+        self._thread = threading.Thread(target = self._server.serve_forever, name = 'snow-standin', daemon = True)
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+def _handler(standin):
+    class Handler(BaseHTTPRequestHandler):
+        # Keep-alive, so pooled client connections are reused as against a real instance
+        protocol_version = 'HTTP/1.1'
+
+        def _body(self):
+            if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+                body = b''
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return body
+
+                    body += self.rfile.read(size)
+                    self.rfile.readline()
+
+            length = int(self.headers.get('Content-Length') or 0)
+            return self.rfile.read(length) if length else b''
+
+        def _send(self, status, headers, result):
+            content = json.dumps(result).encode('utf-8') if result is not None else b''
+
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(content)))
+            for (name, value) in headers.items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            if content:
+                self.wfile.write(content)
+
+        def _serve(self):
+            url = urlsplit(self.path)
+            params = {name: values[-1] for (name, values) in parse_qs(url.query, keep_blank_values = True).items()}
+            body = self._body()
+
+            standin.delay()
+
+            if standin.throttled():
+                self._send(429, {'Retry-After': str(standin.retry_after)},
+                           {'error': {'message': 'Rate limit exceeded', 'detail': 'Too many requests'}})
+                return
+
+            try:
+                (status, headers, result) = standin.handle(self.command, url.path, params, body)
+            except Exception as e:
+                (status, headers, result) = (500, {}, {'error': {'message': str(e)}})
+
+            self._send(status, headers, result)
+
+        do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = _serve
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+# Stand-in options shared by the command line of this module and snow_benchmark.py
+def add_standin_arguments(parser):
+    parser.add_argument('--latency-ms', type = float, default = 0.0, help = 'Fixed delay per request')
+    parser.add_argument('--jitter-ms', type = float, default = 0.0, help = 'Extra random delay per request, up to this value')
+    parser.add_argument('--row-cost-ms', type = float, default = 0.0, help = 'Extra delay per row returned by the Table API')
+    parser.add_argument('--max-page-size', type = int, default = DEFAULT_MAX_PAGE_SIZE, help = 'Cap on sysparm_limit')
+    parser.add_argument('--throttle-rate', type = float, default = 0.0, help = 'Share of requests answered 429 (0-1)')
+    parser.add_argument('--retry-after', type = int, default = 1, help = 'Retry-After seconds sent with a 429')
+    parser.add_argument('--incidents', type = int, default = 1000)
+    parser.add_argument('--change-requests', type = int, default = 200)
+    parser.add_argument('--kb-articles', type = int, default = 200)
+    parser.add_argument('--kb-article-bytes', type = int, default = 4000)
+    parser.add_argument('--cmdb-roots', type = int, default = 5)
+    parser.add_argument('--cmdb-fanout', type = int, default = 4)
+    parser.add_argument('--cmdb-depth', type = int, default = 4)
+    parser.add_argument('--cmdb-cross-links', type = int, default = 0, help = 'Random extra relations between CIs')
+    parser.add_argument('--seed', type = int, default = 7)
+    parser.add_argument('--utc-offset', type = float, default = 0, help = "Session user's timezone, hours from UTC")
+    parser.add_argument('--display-format', default = TS_FORMAT, help = 'strftime format of displayed timestamps')
+    parser.add_argument('--no-batch-api', dest = 'batch_api', action = 'store_false', help = 'Answer Batch API calls with 404')
+    parser.add_argument('--batch-max-requests', type = int, default = 0, help = 'Requests serviced per batch, the rest left unserviced (0 = all)')
+
+
+def standin_options(args):
+    return {name: getattr(args, name) for name in ['latency_ms', 'jitter_ms', 'row_cost_ms', 'max_page_size', 'throttle_rate',
+                                                   'retry_after', 'incidents', 'change_requests', 'kb_articles',
+                                                   'kb_article_bytes', 'cmdb_roots', 'cmdb_fanout', 'cmdb_depth',
+                                                   'cmdb_cross_links', 'seed', 'utc_offset', 'display_format', 'batch_api',
+                                                   'batch_max_requests']}
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Serve a local ServiceNow stand-in with synthetic data')
+    parser.add_argument('--host', default = '127.0.0.1')
+    parser.add_argument('--port', type = int, default = 8780)
+    parser.add_argument('--ke-category', default = 'Knowledge', help = 'Title of the generated knowledge base')
+    add_standin_arguments(parser)
+    args = parser.parse_args(argv)
+
+    standin = SnowStandIn(host = args.host, port = args.port, ke_category = args.ke_category, **standin_options(args)).start()
+    print('ServiceNow stand-in on', standin.url, '-', standin.stats()['tables'])
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        standin.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+import datetime
+
+STATS_PATH = '/api/now/stats/'
+
+# Supported time buckets; months are calendar months
+STATS_INTERVALS = ['hour', 'day', 'week', 'month']
+
+# Upper bound on buckets per request; each bucket is one Aggregate API call, so wider
+# windows should use a coarser interval (48 covers two days by hour or a month by day)
+MAX_STATS_BUCKETS = 48
+
+TS_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# Start of the bucket containing ts
+def _bucket_start(ts, interval):
+    if interval == 'hour':
+        return ts.replace(minute = 0, second = 0, microsecond = 0)
+
+    day = ts.replace(hour = 0, minute = 0, second = 0, microsecond = 0)
+    if interval == 'week':
+        return day - datetime.timedelta(days = day.weekday())
+
+    if interval == 'month':
+        return day.replace(day = 1)
+
+    return day
+
+
+def _next_bucket(ts, interval):
+    if interval == 'hour':
+        return ts + datetime.timedelta(hours = 1)
+
+    if interval == 'week':
+        return ts + datetime.timedelta(weeks = 1)
+
+    if interval == 'month':
+        return (ts.replace(day = 28) + datetime.timedelta(days = 4)).replace(day = 1)
+
+    return ts + datetime.timedelta(days = 1)
+
+
+def time_buckets(start_ts, end_ts, interval):
+    """
+        Split [start_ts, end_ts] into (bucket_start, bucket_end) pairs aligned to interval.
+
+        The first and last buckets are clipped to the window; bucket_end is
+        exclusive except for the last one, which ends one second after end_ts.
+    """
+    if interval not in STATS_INTERVALS:
+        raise ValueError('interval should be one of ' + ', '.join(STATS_INTERVALS))
+
+    start = datetime.datetime.strptime(start_ts, TS_FORMAT)
+    end = datetime.datetime.strptime(end_ts, TS_FORMAT) + datetime.timedelta(seconds = 1)
+
+    buckets = []
+    current = _bucket_start(start, interval)
+    while current < end:
+        following = _next_bucket(current, interval)
+        buckets.append((max(current, start).strftime(TS_FORMAT), min(following, end).strftime(TS_FORMAT)))
+        current = following
+
+        if len(buckets) > MAX_STATS_BUCKETS:
+            raise ValueError('Time window has more than ' + str(MAX_STATS_BUCKETS) + ' ' + interval + ' buckets, use a coarser interval')
+
+    return buckets
+
+
+# Query parameters for one Aggregate API count
+def stats_params(query, group_by = None):
+    params = {'sysparm_count': 'true', 'sysparm_display_value': 'true'}
+
+    if query:
+        params['sysparm_query'] = query.strip('^')
+
+    if group_by:
+        params['sysparm_group_by'] = ','.join(group_by)
+        params['sysparm_orderby'] = ','.join(group_by)
+
+    return params
+
+
+def parse_stats(result, group_by = None):
+    """
+        Normalise an Aggregate API result to {total, groups}.
+
+        Each group is {'group': {field: display value}, 'count': n}; groups is
+        empty without group_by.
+    """
+    if not group_by:
+        stats = result.get('stats', {}) if isinstance(result, dict) else {}
+        return {'total': int(stats.get('count', 0)), 'groups': []}
+
+    if isinstance(result, dict):
+        result = [result]
+
+    groups = []
+    for row in result or []:
+        group = {}
+        for field in row.get('groupby_fields', []):
+            group[field['field']] = field.get('display_value') or field.get('value', '')
+
+        groups.append({'group': group, 'count': int(row.get('stats', {}).get('count', 0))})
+
+    return {'total': sum([group['count'] for group in groups]), 'groups': groups}
+
+
+# Overall {total, groups} from per-bucket stats, groups keyed by their field values
+def merge_buckets(buckets):
+    merged = {}
+    for bucket in buckets:
+        for group in bucket['groups']:
+            key = tuple(sorted(group['group'].items()))
+            if key not in merged:
+                merged[key] = {'group': group['group'], 'count': 0}
+            merged[key]['count'] += group['count']
+
+    return {'total': sum([bucket['total'] for bucket in buckets]), 'groups': list(merged.values())}
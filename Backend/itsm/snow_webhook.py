@@ -0,0 +1,222 @@
+import os
+import sys
+import hmac
+import time
+import queue
+import base64
+import hashlib
+import threading
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import get_snow_client, _load_pool_conf
+from itsm.snow_cache import get_snow_cache
+from itsm.cmdb_mirror import get_cmdb_mirror
+from itsm.ticket_mirror import get_ticket_mirror
+
+# Header carrying HMAC-SHA256 of the raw request body, hex or base64, optionally prefixed with sha256=
+SIGNATURE_HEADER = 'X-ServiceNow-Signature'
+
+WEBHOOK_TABLES = ['incident', 'change_request', 'kb_knowledge', 'cmdb_ci', 'cmdb_rel_ci']
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_KB_COLLECTION = 'kb_articles'
+
+# Events arriving this close together are applied as one batch
+COALESCE_SECONDS = 1.0
+MAX_BATCH_EVENTS = 1000
+
+
+def verify_signature(secret, body, signature):
+    if not secret or not signature:
+        return False
+
+    signature = signature.strip()
+    if signature.lower().startswith('sha256='):
+        signature = signature[7:]
+
+    digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+
+    return hmac.compare_digest(signature.lower(), digest.hex()) or \
+            hmac.compare_digest(signature, base64.b64encode(digest).decode('ascii'))
+
+
+class WebhookProcessor:
+    """
+        Applies ServiceNow record-change events in the background.
+
+        The receiving route only validates and queues events. A worker thread
+        takes whatever has arrived within COALESCE_SECONDS, keeps the last
+        event per record, drops the cached reads of each touched table and
+        updates the local copies:
+
+            incident, change_request -> ticket mirror
+            cmdb_ci, cmdb_rel_ci     -> CMDB mirror (and its CI name index)
+            kb_knowledge             -> KB vector collection
+
+        Events carry only the record identity. Changed records are read back in
+        one sys_idIN call per table, so the local copies keep the same shape
+        as a regular sync whatever the sender put in the payload.
+    """
+    def __init__(self, queue_size = DEFAULT_QUEUE_SIZE, kb_collection = DEFAULT_KB_COLLECTION):
+        self.queue_size = queue_size
+        self.kb_collection = kb_collection
+
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._kb_pipeline = None
+
+        self._stats = {'received': 0, 'rejected': 0, 'applied': 0, 'failed': 0, 'batches': 0, 'last_applied_at': None}
+
+    def submit(self, events):
+        """Queue events for the worker; False when the queue is full so the sender retries later."""
+        with self._lock:
+            if self._queue.qsize() + len(events) > self.queue_size:
+                self._stats['rejected'] += len(events)
+                return False
+
+            for event in events:
+                self._queue.put(event)
+
+            self._stats['received'] += len(events)
+
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target = self._run, name = 'snow-webhook', daemon = True)
+                self._thread.start()
+
+        return True
+
+    def _run(self):
+        while True:
+            events = [self._queue.get()]
+
+            deadline = time.monotonic() + COALESCE_SECONDS
+            while len(events) < MAX_BATCH_EVENTS:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                try:
+                    events.append(self._queue.get(timeout = remaining))
+                except queue.Empty:
+                    break
+
+            self.apply(events)
+
+    def apply(self, events):
+        # Only the last event per record matters
+        latest = {}
+        for event in events:
+            latest[(event['table'], event['sys_id'])] = event
+
+        tables = {}
+        for event in latest.values():
+            changes = tables.setdefault(event['table'], {'upsert': [], 'delete': []})
+            changes['delete' if event['operation'] == 'delete' else 'upsert'].append(event)
+
+        cache = get_snow_cache()
+        for (table, changes) in tables.items():
+            cache.invalidate(table)
+
+            count = len(changes['upsert']) + len(changes['delete'])
+            try:
+                self._apply_table(table, changes['upsert'], changes['delete'])
+                self._count(applied = count)
+            except Exception as e:
+                print(f"Webhook events for {table} not applied - {str(e)}")
+                self._count(failed = count)
+
+        with self._lock:
+            self._stats['batches'] += 1
+            self._stats['last_applied_at'] = time.time()
+
+    def _count(self, **counts):
+        with self._lock:
+            for (name, value) in counts.items():
+                self._stats[name] += value
+
+    def _apply_table(self, table, upserts, deletes):
+        upsert_ids = [event['sys_id'] for event in upserts]
+        delete_ids = [event['sys_id'] for event in deletes]
+
+        if table in ['incident', 'change_request']:
+            mirror = get_ticket_mirror()
+
+            # A mirror that was never synced is not in use
+            if mirror.store.get_watermark(table)[1] is None:
+                return
+
+            if upsert_ids:
+                mirror.refresh(table, upsert_ids)
+            if delete_ids:
+                mirror.delete(table, delete_ids)
+
+        elif table in ['cmdb_ci', 'cmdb_rel_ci']:
+            mirror = get_cmdb_mirror()
+            if mirror.store.get_watermark(table)[1] is None:
+                return
+
+            if upsert_ids:
+                mirror.refresh(table, upsert_ids)
+            if delete_ids:
+                mirror.delete(table, delete_ids)
+
+        elif table == 'kb_knowledge':
+            self._apply_kb(upserts, deletes)
+
+    def _kb(self):
+        if self._kb_pipeline is None:
+            # Loaded on first use: both pull in the embedding model stack
+            from kb_data.kb_ingest import KBIngestPipeline, ingest_conf
+            from database.vectordb_connector import VectorDatabase
+
+            self._kb_pipeline = KBIngestPipeline(get_snow_client(), VectorDatabase(), collection = self.kb_collection,
+                                                 **ingest_conf(_load_pool_conf()))
+
+        return self._kb_pipeline
+
+    def _apply_kb(self, upserts, deletes):
+        from kb_data.kb_ingest import KB_FIELDS
+
+        pipeline = self._kb()
+
+        published = []
+        if upserts:
+            published = list(pipeline.client.iter_table('kb_knowledge', query = 'workflow_state=published^sys_idIN' + ','.join([event['sys_id'] for event in upserts]),
+                                                        fields = KB_FIELDS, params = {'sysparm_exclude_reference_link': 'true'}))
+            pipeline.ingest_articles(published)
+
+        # Deleted articles, and updated ones that are no longer published, leave the collection
+        published_ids = set([article['sys_id'] for article in published])
+        removed = deletes + [event for event in upserts if event['sys_id'] not in published_ids]
+
+        if removed:
+            pipeline.db.delete_documents(self.kb_collection, key = 'sys_id', values = [event['sys_id'] for event in removed])
+
+            # Rows loaded before sys_id was stored in the metadata are found by number
+            numbers = [event['number'] for event in removed if event.get('number')]
+            pipeline.db.delete_documents(self.kb_collection, key = 'number', values = numbers)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, queued = self._queue.qsize(), queue_size = self.queue_size)
+
+
+_processor = None
+_processor_lock = threading.Lock()
+
+
+def get_webhook_processor():
+    global _processor
+
+    with _processor_lock:
+        if _processor is None:
+            mim_conf = _load_pool_conf()
+            _processor = WebhookProcessor(queue_size = mim_conf.get('snow_webhook_queue_size', DEFAULT_QUEUE_SIZE),
+                                          kb_collection = mim_conf.get('snow_webhook_kb_collection', DEFAULT_KB_COLLECTION))
+
+        return _processor
@@ -0,0 +1,479 @@
+import os
+import sys
+import json
+import time
+import datetime
+import threading
+from zoneinfo import ZoneInfo
+from concurrent.futures import ThreadPoolExecutor
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/itsm')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import CustomError, get_snow_client, get_mim_conf
+from itsm.local_store import get_local_store
+
+DEFAULT_MAX_STALENESS = 300
+DEFAULT_SYNC_INTERVAL = 60
+DEFAULT_WINDOW_DAYS = 30
+DEFAULT_BACKFILL_WORKERS = 8
+
+# Rows written per transaction while syncing
+SYNC_BATCH_SIZE = 1000
+
+# sys_ids per sys_idIN query when refreshing single records
+REFRESH_BATCH_SIZE = 100
+
+# Changes made on the instance while a backfill runs are picked up by the first
+# incremental sync; the margin covers clock skew between this host and the instance
+WATERMARK_MARGIN = datetime.timedelta(minutes = 5)
+
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Instance timezone when the session user has none of their own
+DEFAULT_TZ_PROPERTY = 'glide.sys.default.tz'
+
+# Mirrored columns per table, a superset of the fields ITSM reads
+TICKET_FIELDS = {
+    'incident': ['number', 'short_description', 'description', 'close_notes', 'state', 'priority', 'category',
+                 'assignment_group', 'cmdb_ci', 'opened_at', 'resolved_at', 'closed_at'],
+    'change_request': ['number', 'short_description', 'description', 'implementation_plan', 'backout_plan',
+                       'test_plan', 'assignment_group', 'start_date', 'end_date', 'state', 'chg_model', 'approval',
+                       'type', 'risk', 'category', 'cmdb_ci']
+}
+
+INDEXED_FIELDS = ['number', 'state', 'assignment_group', 'cmdb_ci']
+
+KEY_FIELDS = ['sys_id', 'sys_created_on', 'sys_updated_on']
+
+
+def mirror_table_name(table):
+    return 'mirror_' + table
+
+
+# Value as the live reads return it with sysparm_display_value=true
+def _display_value(value):
+    if not isinstance(value, dict):
+        return value
+
+    if value.get('link'):
+        return {'display_value': value.get('display_value', ''), 'link': value['link']}
+
+    return value.get('display_value', '')
+
+
+def _raw_value(value):
+    if isinstance(value, dict):
+        return value.get('value', '')
+
+    return value if value is not None else ''
+
+
+# Encoded query for records created between two raw (UTC) timestamps, unlike gs.dateGenerate() which reads them in the user's timezone
+def _utc_window_query(start_ts, end_ts, column = 'sys_created_on'):
+    return column + '>=' + start_ts + '^' + column + '<=' + end_ts
+
+
+def _zone(timezone):
+    if timezone is None or isinstance(timezone, datetime.tzinfo):
+        return timezone
+
+    return ZoneInfo(timezone)
+
+
+# Timezone the instance reads gs.dateGenerate() in for the client's user, None when it cannot be told
+def session_timezone(client):
+    try:
+        for user in client.iter_table('sys_user', query = 'user_name=' + (client.snow_username or ''), fields = 'time_zone',
+                                      display_value = 'false', page_size = 1):
+            if user.get('time_zone'):
+                return ZoneInfo(user['time_zone'])
+
+        for prop in client.iter_table('sys_properties', query = 'name=' + DEFAULT_TZ_PROPERTY, fields = 'value',
+                                      display_value = 'false', page_size = 1):
+            return ZoneInfo(prop.get('value') or 'UTC')
+
+    except Exception as e:
+        print(f"Ticket mirror could not read the instance timezone - {str(e)}")
+
+    return None
+
+
+def _is_number(value):
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+# Translate [{"param", "op", "val"}] encoded-query conditions into a SQL where clause.
+# Returns None when a condition cannot be answered from the mirror.
+def conditions_to_sql(conditions, columns):
+    conditional_query = []
+    params = []
+
+    for condition in conditions:
+        col = condition.get('param', '')
+        op = condition.get('op', '')
+        val = condition.get('val', '')
+
+        if col not in columns:
+            return None
+
+        # Equals and Not equal
+        if op == '=':
+            conditional_query.append(col + ' = ?')
+        elif op == '!=':
+            conditional_query.append(col + ' != ?')
+
+        # Numeric or timestamp comparisons
+        elif op in ['>', '>=', '<', '<=']:
+            if _is_number(val):
+                conditional_query.append('CAST(' + col + ' AS REAL) ' + op + ' ?')
+                val = float(val)
+            else:
+                conditional_query.append(col + ' ' + op + ' ?')
+
+        # Contains, starts with and ends with
+        elif op == 'LIKE':
+            conditional_query.append(col + ' LIKE ?')
+            val = '%' + val + '%'
+        elif op == 'NOTLIKE':
+            conditional_query.append(col + ' NOT LIKE ?')
+            val = '%' + val + '%'
+        elif op == 'STARTSWITH':
+            conditional_query.append(col + ' LIKE ?')
+            val = val + '%'
+        elif op == 'ENDSWITH':
+            conditional_query.append(col + ' LIKE ?')
+            val = '%' + val
+
+        # In and Not in, comma separated as in encoded queries
+        elif op in ['IN', 'NOT IN']:
+            values = [value.strip() for value in val.split(',')]
+            conditional_query.append(col + ' ' + op + ' (' + ', '.join(['?'] * len(values)) + ')')
+            params += values
+            continue
+
+        # Empty checks take no value
+        elif op == 'ISEMPTY':
+            conditional_query.append("(" + col + " IS NULL OR " + col + " = '')")
+            continue
+        elif op == 'ISNOTEMPTY':
+            conditional_query.append("(" + col + " IS NOT NULL AND " + col + " != '')")
+            continue
+
+        else:
+            return None
+
+        params.append(val)
+
+    return (conditional_query, params)
+
+
+class TicketMirror:
+    """
+        Local copy of the incident and change_request tables.
+
+        backfill() splits the history into sys_created_on windows read in
+        parallel, then sync() keeps the copy current from the sys_updated_on
+        watermark. Each row keeps raw values in indexed columns, which is what
+        conditions are matched against, and the display values the live reads
+        return in a JSON column. query() serves ticket searches from the copy,
+        or returns None when it cannot answer them exactly as the instance would.
+
+        Raw timestamps are UTC, as are backfill bounds. The start_ts/end_ts of
+        query() are in the session user's timezone, as gs.dateGenerate() reads
+        them on the live path; timezone names it, and is read from the instance
+        on the first sync when not given. Until it is known, time windows are
+        left to the live path.
+    """
+    def __init__(self, store = None, client = None, max_staleness = DEFAULT_MAX_STALENESS,
+                 window_days = DEFAULT_WINDOW_DAYS, workers = DEFAULT_BACKFILL_WORKERS, backfill_start = None,
+                 timezone = None):
+        self.store = store or get_local_store()
+        self.client = client or get_snow_client()
+        self.max_staleness = max_staleness
+        self.window_days = window_days
+        self.workers = workers
+        self.backfill_start = backfill_start
+        self.timezone = _zone(timezone)
+
+        with self.store.connection() as conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS mirror_coverage (
+                    table_name TEXT PRIMARY KEY,
+                    covered_from TEXT,
+                    backfilled_at REAL
+                )
+            ''')
+
+            for (table, fields) in TICKET_FIELDS.items():
+                name = mirror_table_name(table)
+                conn.execute('CREATE TABLE IF NOT EXISTS ' + name + ' (sys_id TEXT PRIMARY KEY, sys_created_on TEXT, ' +
+                             'sys_updated_on TEXT, ' + ', '.join([field + ' TEXT' for field in fields]) + ', record TEXT)')
+
+                for field in ['sys_created_on', 'sys_updated_on'] + [field for field in INDEXED_FIELDS if field in fields]:
+                    conn.execute('CREATE INDEX IF NOT EXISTS idx_' + name + '_' + field + ' ON ' + name + ' (' + field + ')')
+
+        self._sync_lock = threading.Lock()
+        self._sync_thread = None
+        self._stop_event = threading.Event()
+
+    def _check_table(self, table):
+        if table not in TICKET_FIELDS:
+            raise CustomError(table + ' is not mirrored')
+
+    def apply_records(self, table, records):
+        """Upsert records read with sysparm_display_value=all."""
+        self._check_table(table)
+
+        fields = TICKET_FIELDS[table]
+        columns = KEY_FIELDS + fields + ['record']
+
+        rows = []
+        for record in records:
+            display = {field: _display_value(record.get(field, '')) for field in ['sys_id'] + fields}
+            rows.append([_raw_value(record.get(field)) for field in KEY_FIELDS + fields] + [json.dumps(display)])
+
+        with self.store.connection() as conn:
+            conn.executemany('INSERT INTO ' + mirror_table_name(table) + ' (' + ', '.join(columns) + ') VALUES (' +
+                             ', '.join(['?'] * len(columns)) + ') ON CONFLICT(sys_id) DO UPDATE SET ' +
+                             ', '.join([column + ' = excluded.' + column for column in columns[1:]]), rows)
+
+        return max([row[2] for row in rows] or [''])
+
+    def delete(self, table, sys_ids):
+        self._check_table(table)
+
+        with self.store.connection() as conn:
+            conn.executemany('DELETE FROM ' + mirror_table_name(table) + ' WHERE sys_id = ?', [(sys_id,) for sys_id in sys_ids])
+
+    def refresh(self, table, sys_ids):
+        """Re-read the given records, e.g. after a webhook reported them changed."""
+        self._check_table(table)
+
+        sys_ids = list(sys_ids)
+        for ind in range(0, len(sys_ids), REFRESH_BATCH_SIZE):
+            self._read(table, 'sys_idIN' + ','.join(sys_ids[ind:ind + REFRESH_BATCH_SIZE]))
+
+    def _read(self, table, query):
+        """Read matching rows into the mirror in batches, returning the newest raw sys_updated_on."""
+        newest = ''
+        batch = []
+        for record in self.client.iter_table(table, query = query, fields = ','.join(KEY_FIELDS + TICKET_FIELDS[table]),
+                                             display_value = 'all'):
+            batch.append(record)
+
+            if len(batch) >= SYNC_BATCH_SIZE:
+                newest = max(newest, self.apply_records(table, batch))
+                batch = []
+
+        if batch:
+            newest = max(newest, self.apply_records(table, batch))
+
+        return newest
+
+    def _earliest_created_on(self, table):
+        for record in self.client.iter_table(table, fields = 'sys_created_on', display_value = 'false', page_size = 1):
+            return record['sys_created_on']
+
+        return None
+
+    def _to_utc(self, ts):
+        local = datetime.datetime.strptime(ts, TIMESTAMP_FORMAT).replace(tzinfo = self.timezone)
+
+        return local.astimezone(datetime.timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+    def backfill(self, table, start_ts = None, end_ts = None):
+        """Load every record created between start_ts and end_ts (UTC), one window per worker."""
+        self._check_table(table)
+
+        with self._sync_lock:
+            started = datetime.datetime.utcnow()
+
+            start_ts = start_ts or self.backfill_start
+            covered_from = start_ts
+            if start_ts is None:
+                start_ts = self._earliest_created_on(table)
+
+            end = datetime.datetime.strptime(end_ts, TIMESTAMP_FORMAT) if end_ts else started
+            windows = []
+            if start_ts is not None:
+                window_start = datetime.datetime.strptime(start_ts, TIMESTAMP_FORMAT)
+                while window_start <= end:
+                    window_end = min(window_start + datetime.timedelta(days = self.window_days), end)
+                    windows.append(_utc_window_query(window_start.strftime(TIMESTAMP_FORMAT),
+                                                     window_end.strftime(TIMESTAMP_FORMAT)))
+                    window_start = window_end + datetime.timedelta(seconds = 1)
+
+            with ThreadPoolExecutor(max_workers = self.workers) as executor:
+                newest = max(list(executor.map(lambda query: self._read(table, query), windows)) or [''])
+
+            # Only a backfill up to now sets where incremental syncs start
+            (watermark, _) = self.store.get_watermark(table)
+            if watermark is None and end_ts is None:
+                self.store.set_watermark(table, (started - WATERMARK_MARGIN).strftime(TIMESTAMP_FORMAT))
+
+            with self.store.connection() as conn:
+                conn.execute('''
+                    INSERT INTO mirror_coverage (table_name, covered_from, backfilled_at) VALUES (?, ?, ?)
+                    ON CONFLICT(table_name) DO UPDATE SET covered_from = excluded.covered_from, backfilled_at = excluded.backfilled_at
+                ''', (table, covered_from, time.time()))
+
+        return {'table': table, 'windows': len(windows), 'newest': newest}
+
+    def sync(self, table = None):
+        """Pull changes since the watermark; tables never backfilled are backfilled first."""
+        if self.timezone is None:
+            self.timezone = session_timezone(self.client)
+
+        for table in [table] if table else list(TICKET_FIELDS.keys()):
+            self._check_table(table)
+
+            if self.coverage(table) is None:
+                self.backfill(table)
+
+            with self._sync_lock:
+                (watermark, _) = self.store.get_watermark(table)
+                started = time.time()
+
+                newest = self._read(table, 'sys_updated_on>=' + watermark if watermark else '')
+                self.store.set_watermark(table, max(newest, watermark or ''), synced_at = started)
+
+        return self.status()
+
+    def coverage(self, table):
+        row = self.store.connection().execute('SELECT covered_from, backfilled_at FROM mirror_coverage WHERE table_name = ?',
+                                              (table,)).fetchone()
+        if row is None or row['backfilled_at'] is None:
+            return None
+
+        return row['covered_from'] or ''
+
+    def is_fresh(self, table):
+        (_, synced_at) = self.store.get_watermark(table)
+
+        return self.coverage(table) is not None and synced_at is not None and \
+                time.time() - synced_at <= self.max_staleness
+
+    def status(self):
+        tables = {}
+        for table in TICKET_FIELDS.keys():
+            (watermark, synced_at) = self.store.get_watermark(table)
+            tables[table] = {
+                'rows': self.store.connection().execute('SELECT COUNT(*) FROM ' + mirror_table_name(table)).fetchone()[0],
+                'watermark': watermark,
+                'synced_at': synced_at,
+                'covered_from': self.coverage(table),
+                'fresh': self.is_fresh(table)
+            }
+
+        return {'tables': tables, 'max_staleness': self.max_staleness}
+
+    def query(self, table, fields, start_ts = None, end_ts = None, conditions = []):
+        """
+            Iterator over matching records shaped like the live read, or None
+            when the mirror is stale or cannot answer the query exactly.
+        """
+        if table not in TICKET_FIELDS or not self.is_fresh(table):
+            return None
+
+        covered_from = self.coverage(table)
+        columns = KEY_FIELDS + TICKET_FIELDS[table]
+
+        requested_fields = [field.strip() for field in fields.split(',') if field.strip()]
+        if [field for field in requested_fields if field not in columns]:
+            return None
+
+        where = []
+        params = []
+
+        # Conditions replace the time window, as they do for the live reads
+        if conditions:
+            translated = conditions_to_sql(conditions, columns)
+            if translated is None or covered_from != '':
+                return None
+
+            (where, params) = translated
+
+        elif start_ts != None and end_ts != None:
+            # The live path reads the window in the user's timezone, the stored values are UTC
+            if self.timezone is None:
+                return None
+
+            (start_ts, end_ts) = (self._to_utc(start_ts), self._to_utc(end_ts))
+            if covered_from != '' and start_ts < covered_from:
+                return None
+
+            where.append('sys_created_on BETWEEN ? AND ?')
+            params += [start_ts, end_ts]
+
+        elif covered_from != '':
+            return None
+
+        sql = 'SELECT record FROM ' + mirror_table_name(table)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY sys_created_on, sys_id'
+
+        cursor = self.store.connection().execute(sql, params)
+
+        def records():
+            for row in cursor:
+                record = json.loads(row['record'])
+                yield {field: record.get(field, '') for field in requested_fields}
+
+        return records()
+
+    def start_background_sync(self, interval = DEFAULT_SYNC_INTERVAL):
+        if self._sync_thread is not None and self._sync_thread.is_alive():
+            return
+
+        self._stop_event.clear()
+
+        def run():
+            while not self._stop_event.is_set():
+                try:
+                    self.sync()
+                except Exception as e:
+                    print(f"Ticket mirror sync failed - {str(e)}")
+
+                self._stop_event.wait(interval)
+
+        self._sync_thread = threading.Thread(target = run, name = 'ticket-mirror-sync', daemon = True)
+        self._sync_thread.start()
+
+    def stop_background_sync(self):
+        self._stop_event.set()
+
+
+_mirror = None
+_mirror_lock = threading.Lock()
+
+
+def get_ticket_mirror():
+    global _mirror
+
+    with _mirror_lock:
+        if _mirror is None:
+            mim_conf = get_mim_conf()
+            _mirror = TicketMirror(max_staleness = mim_conf.get('ticket_mirror_max_staleness', DEFAULT_MAX_STALENESS),
+                                   window_days = mim_conf.get('ticket_mirror_window_days', DEFAULT_WINDOW_DAYS),
+                                   workers = mim_conf.get('ticket_mirror_workers', DEFAULT_BACKFILL_WORKERS),
+                                   backfill_start = mim_conf.get('ticket_mirror_backfill_start') or None,
+                                   timezone = mim_conf.get('snow_timezone') or None)
+
+        return _mirror
+
+
+# Records from the local mirror when it can serve the query, otherwise None
+def mirror_ticket_records(table, fields, start_ts = None, end_ts = None, conditions = []):
+    try:
+        return get_ticket_mirror().query(table, fields, start_ts = start_ts, end_ts = end_ts, conditions = conditions)
+    except Exception as e:
+        print(f"Ticket mirror unavailable - {str(e)}")
+        return None
@@ -0,0 +1,343 @@
+import os
+import sys
+import time
+import json
+import queue
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+SCRIPT_PATH = os.path.dirname(__file__)
+ROOT_PATH = SCRIPT_PATH.split('/kb_data')[0]
+
+sys.path.append(ROOT_PATH)
+
+from itsm.snow_client import KEYSET_FIELDS, _load_pool_conf, _raw_value, display_record
+from itsm.snow_query import kb_link
+from itsm.html_text import get_html_converter
+
+# Defaults, overridable from mim_conf.json
+DEFAULT_FETCH_BATCH = 100
+DEFAULT_EMBED_BATCH = 64
+DEFAULT_QUEUE_SIZE = 4
+DEFAULT_CHUNK_SIZE = 1500
+DEFAULT_CHUNK_OVERLAP = 150
+DEFAULT_CHECKPOINT_PATH = SCRIPT_PATH + '/kb_ingest_checkpoint.json'
+
+KB_FIELDS = 'sys_id,number,category,short_description,text,sys_updated_on,sys_created_on'
+
+# End of stream marker passed down the queues
+_DONE = object()
+
+
+class KBIngestPipeline:
+    """
+        Load published ServiceNow KB articles into a pgvector collection.
+
+        Five stages run at the same time on their own threads, connected by
+        bounded queues so a slow stage holds the others back instead of letting
+        memory grow:
+
+            fetch (keyset-paged Table API) -> parse (HTML to text on a process pool)
+            -> chunk -> embed (embed_documents per batch) -> insert (one transaction per batch)
+
+        Embedding batches always hold whole articles. After each batch is
+        committed the position of its last article is written to the checkpoint
+        file, and a run started with the checkpoint present resumes after it.
+        The checkpoint is removed once the run completes.
+    """
+    def __init__(self, client, db, collection = 'kb_articles', fetch_batch = DEFAULT_FETCH_BATCH,
+                 embed_batch = DEFAULT_EMBED_BATCH, queue_size = DEFAULT_QUEUE_SIZE, chunk_size = DEFAULT_CHUNK_SIZE,
+                 chunk_overlap = DEFAULT_CHUNK_OVERLAP, checkpoint_path = DEFAULT_CHECKPOINT_PATH):
+        self.client = client
+        self.db = db
+        self.collection = collection
+        self.fetch_batch = fetch_batch
+        self.embed_batch = embed_batch
+        self.queue_size = queue_size
+        self.checkpoint_path = checkpoint_path or DEFAULT_CHECKPOINT_PATH
+
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size = chunk_size, chunk_overlap = chunk_overlap)
+        self.converter = get_html_converter()
+
+        self._stop = threading.Event()
+        self._errors = []
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def load_checkpoint(self):
+        try:
+            with open(self.checkpoint_path) as checkpoint_f:
+                checkpoint = json.load(checkpoint_f)
+        except (OSError, ValueError):
+            return None
+
+        if checkpoint.get('collection') != self.collection:
+            return None
+
+        return checkpoint
+
+    def save_checkpoint(self, position):
+        with self._stats_lock:
+            checkpoint = {'collection': self.collection, 'start_after': position, 'articles': self._stats['inserted_articles'],
+                          'chunks': self._stats['inserted_chunks'], 'updated_at': time.strftime('%Y-%m-%d %H:%M:%S')}
+
+        tmp_path = self.checkpoint_path + '.tmp'
+        with open(tmp_path, 'w') as checkpoint_f:
+            json.dump(checkpoint, checkpoint_f)
+
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def clear_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+    def _count(self, **counts):
+        with self._stats_lock:
+            for (name, value) in counts.items():
+                self._stats[name] += value
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        elapsed = time.time() - stats['started_at']
+        stats['elapsed_s'] = round(elapsed, 1)
+        stats['articles_per_s'] = round(stats['inserted_articles'] / elapsed, 2) if elapsed > 0 else 0.0
+
+        return stats
+
+    # Queue helpers that give up once another stage has failed
+    def _put(self, out_q, item):
+        while not self._stop.is_set():
+            try:
+                out_q.put(item, timeout = 0.5)
+                return True
+            except queue.Full:
+                continue
+
+        return False
+
+    def _get(self, in_q):
+        while not self._stop.is_set():
+            try:
+                return in_q.get(timeout = 0.5)
+            except queue.Empty:
+                continue
+
+        return _DONE
+
+    def _stage(self, name, target, *args):
+        def run():
+            try:
+                target(*args)
+            except Exception as e:
+                print(f'KB ingest {name} stage failed - {str(e)}')
+                self._errors.append(e)
+                self._stop.set()
+
+        return threading.Thread(target = run, name = 'kb-ingest-' + name, daemon = True)
+
+    def _fetch(self, out_q, start_after):
+        batch = []
+        # Display values, except the keyset columns: the checkpoint needs the raw UTC position
+        for article in self.client.iter_table('kb_knowledge', query = 'workflow_state=published', fields = KB_FIELDS,
+                                              display_value = 'all', params = {'sysparm_exclude_reference_link': 'true'},
+                                              start_after = start_after):
+            batch.append(display_record(article, raw_fields = KEYSET_FIELDS))
+
+            if len(batch) >= self.fetch_batch:
+                self._count(fetched = len(batch))
+                if not self._put(out_q, batch):
+                    return
+                batch = []
+
+        if batch:
+            self._count(fetched = len(batch))
+            self._put(out_q, batch)
+
+        self._put(out_q, _DONE)
+
+    def _parse(self, in_q, out_q, executor):
+        while True:
+            batch = self._get(in_q)
+            if batch is _DONE:
+                break
+
+            self.converter.convert_articles(batch, executor = executor)
+            self._count(parsed = len(batch))
+
+            if not self._put(out_q, batch):
+                return
+
+        self._put(out_q, _DONE)
+
+    def _documents(self, article):
+        if article.get('text') is None:
+            return []
+
+        header = 'Short Description - ' + (article.get('short_description') or '') + '\n\n' + 'Content - \n'
+        metadata = {'number': article['number'], 'sys_id': _raw_value(article['sys_id']),
+                    'kb_link': kb_link(self.client.snow_url, _raw_value(article['sys_id']))}
+
+        documents = []
+        for (ind, chunk) in enumerate(self.splitter.split_text(article['text']) or ['']):
+            documents.append((header + chunk, dict(metadata, chunk = ind)))
+
+        return documents
+
+    def _chunk(self, in_q, out_q):
+        # Groups of whole articles with at least embed_batch chunks
+        documents = []
+        articles = 0
+        position = None
+
+        while True:
+            batch = self._get(in_q)
+            if batch is _DONE:
+                break
+
+            for article in batch:
+                documents.extend(self._documents(article))
+                articles += 1
+                position = [_raw_value(article['sys_created_on']), _raw_value(article['sys_id'])]
+
+                if len(documents) >= self.embed_batch:
+                    self._count(chunks = len(documents))
+                    if not self._put(out_q, (documents, articles, position)):
+                        return
+                    documents = []
+                    articles = 0
+
+        if articles:
+            self._count(chunks = len(documents))
+            self._put(out_q, (documents, articles, position))
+
+        self._put(out_q, _DONE)
+
+    def _embed(self, in_q, out_q):
+        while True:
+            item = self._get(in_q)
+            if item is _DONE:
+                break
+
+            (documents, articles, position) = item
+
+            embeddings = self.db.em_model.embed_documents([content for (content, _) in documents]) if documents else []
+            rows = [(content, embedding, metadata) for ((content, metadata), embedding) in zip(documents, embeddings)]
+            self._count(embedded = len(rows))
+
+            if not self._put(out_q, (rows, articles, position)):
+                return
+
+        self._put(out_q, _DONE)
+
+    def _insert(self, in_q):
+        while True:
+            item = self._get(in_q)
+            if item is _DONE:
+                break
+
+            (rows, articles, position) = item
+
+            self.db.replace_embeddings(rows, self.collection, key = 'number')
+            self._count(inserted_articles = articles, inserted_chunks = len(rows))
+            self.save_checkpoint(position)
+
+            stats = self.stats()
+            print(f"KB ingest: {stats['inserted_articles']} articles / {stats['inserted_chunks']} chunks stored, "
+                  f"{stats['fetched']} fetched, {stats['articles_per_s']} articles/s")
+
+    def ingest_articles(self, articles):
+        """Parse, chunk, embed and store a few already fetched articles on the calling thread, e.g. from a webhook."""
+        self.converter.convert_articles(articles)
+
+        documents = [document for article in articles for document in self._documents(article)]
+        if not documents:
+            return 0
+
+        embeddings = self.db.em_model.embed_documents([content for (content, _) in documents])
+
+        return self.db.replace_embeddings([(content, embedding, metadata) for ((content, metadata), embedding) in zip(documents, embeddings)],
+                                          self.collection, key = 'number')
+
+    def run(self, restart = False):
+        """Run the pipeline to completion and return its stats; raises the first stage failure."""
+        if restart:
+            self.clear_checkpoint()
+
+        checkpoint = self.load_checkpoint()
+        start_after = tuple(checkpoint['start_after']) if checkpoint else None
+
+        self._stop.clear()
+        self._errors = []
+        self._stats = {'started_at': time.time(), 'resumed_after': start_after, 'fetched': 0, 'parsed': 0, 'chunks': 0,
+                       'embedded': 0, 'inserted_articles': 0, 'inserted_chunks': 0}
+
+        if start_after:
+            print(f"KB ingest: resuming after article created {start_after[0]} ({checkpoint['articles']} articles already stored)")
+
+        queues = [queue.Queue(maxsize = self.queue_size) for ind in range(4)]
+
+        # One pool for the whole run; spawn keeps worker start-up independent of the stage threads
+        with ProcessPoolExecutor(max_workers = self.converter.workers, mp_context = multiprocessing.get_context('spawn')) as executor:
+            stages = [
+                self._stage('fetch', self._fetch, queues[0], start_after),
+                self._stage('parse', self._parse, queues[0], queues[1], executor),
+                self._stage('chunk', self._chunk, queues[1], queues[2]),
+                self._stage('embed', self._embed, queues[2], queues[3]),
+                self._stage('insert', self._insert, queues[3])
+            ]
+
+            for stage in stages:
+                stage.start()
+
+            for stage in stages:
+                stage.join()
+
+        if self._errors:
+            raise self._errors[0]
+
+        self.clear_checkpoint()
+
+        return self.stats()
+
+
+# Pipeline settings from mim_conf.json
+def ingest_conf(mim_conf):
+    return {
+        'fetch_batch': mim_conf.get('kb_ingest_fetch_batch', DEFAULT_FETCH_BATCH),
+        'embed_batch': mim_conf.get('kb_ingest_embed_batch', DEFAULT_EMBED_BATCH),
+        'queue_size': mim_conf.get('kb_ingest_queue_size', DEFAULT_QUEUE_SIZE),
+        'chunk_size': mim_conf.get('kb_ingest_chunk_size', DEFAULT_CHUNK_SIZE),
+        'chunk_overlap': mim_conf.get('kb_ingest_chunk_overlap', DEFAULT_CHUNK_OVERLAP),
+        'checkpoint_path': mim_conf.get('kb_ingest_checkpoint_path') or DEFAULT_CHECKPOINT_PATH
+    }
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Load published ServiceNow KB articles into pgvector')
+    parser.add_argument('--collection', default = 'kb_articles', help = 'pgvector collection (table) to load')
+    parser.add_argument('--restart', action = 'store_true', help = 'Ignore the checkpoint and reload every article')
+    args = parser.parse_args(argv)
+
+    from kb_data.snow_kb_articles import ServiceNowKBArticles
+    from database.vectordb_connector import VectorDatabase
+
+    db = VectorDatabase()
+    pipeline = KBIngestPipeline(ServiceNowKBArticles().client, db, collection = args.collection,
+                                **ingest_conf(_load_pool_conf()))
+    stats = pipeline.run(restart = args.restart)
+
+    # The ANN index is built once the bulk load is in, not per write
+    db.ensure_vector_index(args.collection)
+
+    print(stats['inserted_articles'], 'articles /', stats['inserted_chunks'], 'chunks inserted into', args.collection,
+          'in', stats['elapsed_s'], 's')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,10 +3,8 @@ import sys
 import datetime
 
 import json
-import requests
 
 from langchain.schema import Document
-from langchain_community.document_loaders import UnstructuredHTMLLoader
 
 SCRIPT_PATH = os.path.dirname(__file__)
 ROOT_PATH = SCRIPT_PATH.split('/kb_data')[0]
@@ -14,7 +12,10 @@ print(ROOT_PATH)
 
 sys.path.append(ROOT_PATH)
 
-from vault import Vault
+from vault import get_vault
+from itsm.snow_client import get_snow_client
+from itsm.records import KBArticle
+from itsm.html_text import get_html_converter
 from database.vectordb_connector import VectorDatabase
 
 class ServiceNowKBArticles:
@@ -29,14 +30,7 @@ class ServiceNowKBArticles:
         app_conf_file.close()
 
         # Initiate vault
-        vault_path = ROOT_PATH + '/config/.vault_token'
-
-        vault_file = open(vault_path, 'r')
-        vault_token = vault_file.read().strip()
-        vault_file.close()
-
-        vault_url = app_conf['vault_url']
-        self.vault_session = Vault(vault_url, vault_token)
+        self.vault_session = get_vault(app_conf['vault_url'])
 
         # Fetch ServiceNow credentials
         self.snow_url = app_conf['snow_url']
@@ -56,6 +50,9 @@ class ServiceNowKBArticles:
 
         self.headers = {'content-type': 'application/json'}
 
+        # Pooled session shared with every other ITSM code path
+        self.client = get_snow_client(self.snow_url, self.snow_username, self.snow_password)
+
     # Fetch list of change requests
     def get_kb_articles_details(self, number = None):
         target_url = self.snow_url + '/api/now/table/kb_knowledge'
@@ -67,7 +64,7 @@ class ServiceNowKBArticles:
         if number != None:
             filters['sysparm_query'] = 'number=' + number
 
-        filters['sysparm_fields'] = 'sys_id,number,category,short_description,text'
+        filters['sysparm_fields'] = 'sys_id,number,category,short_description,text,sys_updated_on'
 
         filters['sysparm_display_value'] = 'true'
         filters['sysparm_exclude_reference_link'] = 'true'
@@ -84,8 +81,7 @@ class ServiceNowKBArticles:
             target_url += '&' + fl_nm + '=' + fl_val
 
         try:
-            response = requests.get(target_url, auth = (self.snow_username, self.snow_password), \
-                    headers = self.headers, verify = False)
+            response = self.client.get(target_url)
 
             kb_articles = response.json()['result']
             print(len(kb_articles))
@@ -93,52 +89,16 @@ class ServiceNowKBArticles:
             print(str(e))
             return []
 
-        for ind in range(len(kb_articles)):
-            f_path = SCRIPT_PATH + '/' + kb_articles[ind]['number'] + '.html'
-            f = open(f_path, 'w+')
-            try:
-                f.write(kb_articles[ind]['text'])
-                f.close()
-            except:
-                #os.remove(f_path)
-                continue
+        # Convert the HTML bodies in memory, spread over all CPUs for large runs
+        get_html_converter().convert_articles(kb_articles)
 
-            # Parse HTML content of the document using langchain document loader
-            loader = UnstructuredHTMLLoader(f_path)
-            data = loader.load()
-            kb_articles[ind]['text'] = data[0].page_content
-            kb_articles[ind]['kb_link'] = self.snow_url + '/now/nav/ui/classic/params/target/kb_view.do%3Fsys_kb_id%3D' + kb_articles[ind]['sys_id']
+        for kb_article in kb_articles:
+            kb_article.pop('sys_updated_on', None)
 
-            os.remove(f_path)
-
-        return kb_articles
+        return [KBArticle.from_dict(kb_article, self.snow_url) for kb_article in kb_articles]
 
 if __name__ == '__main__':
-    sn_kb_art_obj = ServiceNowKBArticles()
-    kb_articles = sn_kb_art_obj.get_kb_articles_details()
-
-    # for kb_article in kb_articles:
-    #     print(kb_article['number'])
-    # exit()
-
-    kb_documents = []
-    for kb_article in kb_articles:
-
-        if kb_article['text'] != None:
-            content = 'Short Description - ' + kb_article['short_description'] + '\n\n'
-            content += 'Content - \n' + kb_article['text']
-            try:
-                metadata = {'number': kb_article['number'], 'kb_link': kb_article['kb_link']}
-            except:
-                metadata = {'number': kb_article['number'], 'kb_link': "NA"}
-
-        kb_documents.append(
-            {
-                "content": content,
-                "metadata": metadata
-            }
-        )
-    db = VectorDatabase()
-    count = db.insert_data(kb_documents, 'kb_articles')
-    print(count, 'documents inserted into kb_articles table')
- 
+    # Full loads go through the pipelined, resumable ingest in kb_ingest.py
+    from kb_data.kb_ingest import main
+
+    main()
@@ -2,6 +2,7 @@ import os
 import traceback
 
 from fastapi import APIRouter
+from starlette.concurrency import run_in_threadpool
 from typing import List, Optional 
 from pydantic import Field, BaseModel
 from fastapi.responses import JSONResponse
@@ -25,7 +26,7 @@ async def get_contextual_response(payload: KnowledgeAssistantPayload) -> dict:
     response = {}
     try:
         ka_obj = KnowledgeAssistant()
-        data = ka_obj.get_contextual_response(query = payload.query)
+        data = await run_in_threadpool(ka_obj.get_contextual_response, query = payload.query)
 
         response['output'] = {"data": data, "message": 'Contextual response retrieved successfully.'}
         response['code'] = 200
@@ -17,6 +17,10 @@ ROOT_PATH = os.path.abspath(os.path.join(SCRIPT_PATH, "../itsm"))
 # Add ROOT_PATH to sys.path if needed
 sys.path.append(ROOT_PATH)
 
+# Backend/, for the shared vault module
+BACKEND_PATH = os.path.abspath(os.path.join(SCRIPT_PATH, ".."))
+sys.path.append(BACKEND_PATH)
+
 # ----------------------------
 # Load mim_conf.json
 # ----------------------------
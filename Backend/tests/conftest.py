@@ -0,0 +1,25 @@
+import os
+import sys
+
+import pytest
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_PATH)
+
+from itsm.snow_standin import SnowStandIn
+
+
+@pytest.fixture
+def standin_factory():
+    """Start ServiceNow stand-ins with the given options, stopped after the test."""
+    started = []
+
+    def start(**options):
+        standin = SnowStandIn(**options).start()
+        started.append(standin)
+        return standin
+
+    yield start
+
+    for standin in started:
+        standin.stop()
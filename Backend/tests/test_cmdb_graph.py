@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from itsm import snow_client, cmdb_lookup
+from itsm.snow_client import SnowClient, configure_snow_settings
+from itsm.snow_async_client import AsyncSnowClient
+from itsm.cmdb_graph import build_service_map, async_build_service_map, fetch_relations, async_fetch_relations
+
+
+def _fetch(client):
+    return lambda frontier, target: fetch_relations(client, frontier, target)
+
+
+def _root(standin):
+    children = set([relation['child'] for relation in standin.select('cmdb_rel_ci')])
+    return [relation['parent'] for relation in standin.select('cmdb_rel_ci') if relation['parent'] not in children][0]
+
+
+def _close_cycle(standin):
+    # Leaf -> root, so walking towards children comes back to where it started
+    relations = standin.select('cmdb_rel_ci')
+    parents = set([relation['parent'] for relation in relations])
+    leaf = [relation['child'] for relation in relations if relation['child'] not in parents][0]
+    root = _root(standin)
+
+    standin.insert('cmdb_rel_ci', {'parent': leaf, 'child': root, 'type': relations[0]['type']})
+
+    return root
+
+
+def test_walk_terminates_on_cycles(standin_factory):
+    standin = standin_factory(cmdb_roots = 1, cmdb_fanout = 2, cmdb_depth = 3)
+    root = _close_cycle(standin)
+    client = SnowClient(standin.url, 'test', 'test')
+
+    graph = build_service_map(_fetch(client), [root], 'child', max_depth = 10)
+
+    sys_ids = [node['sys_id'] for node in graph['nodes']]
+    assert len(sys_ids) == len(set(sys_ids)) == 1 + 2 + 4 + 8
+    assert len(graph['edges']) == 14 + 1
+    assert graph['depth'] == 4
+    assert graph['truncated'] is False
+
+
+def test_walk_stops_at_max_depth(standin_factory):
+    standin = standin_factory(cmdb_roots = 1, cmdb_fanout = 2, cmdb_depth = 4)
+    client = SnowClient(standin.url, 'test', 'test')
+
+    graph = build_service_map(_fetch(client), [_root(standin)], 'child', max_depth = 2)
+
+    assert len(graph['nodes']) == 1 + 2 + 4
+    assert max([node['depth'] for node in graph['nodes']]) == 2
+    assert graph['depth'] == 2
+    assert graph['truncated'] is True
+
+
+def test_walk_caps_fanout_per_ci(standin_factory):
+    standin = standin_factory(cmdb_roots = 1, cmdb_fanout = 4, cmdb_depth = 2)
+    client = SnowClient(standin.url, 'test', 'test')
+
+    graph = build_service_map(_fetch(client), [_root(standin)], 'child', max_fanout = 2)
+
+    assert [len([node for node in graph['nodes'] if node['depth'] == depth]) for depth in range(3)] == [1, 2, 4]
+    assert all([len([edge for edge in graph['edges'] if edge['source'] == node['sys_id']]) <= 2 for node in graph['nodes']])
+    assert graph['truncated'] is True
+
+
+def test_async_walk_matches_sync_walk(standin_factory):
+    standin = standin_factory(cmdb_roots = 3, cmdb_fanout = 3, cmdb_depth = 3, cmdb_cross_links = 40)
+    roots = sorted(set([relation['parent'] for relation in standin.select('cmdb_rel_ci')]))[:3]
+
+    graph = build_service_map(_fetch(SnowClient(standin.url, 'test', 'test')), roots, 'child', max_depth = 6, max_fanout = 5)
+
+    async def walk():
+        client = AsyncSnowClient(standin.url, 'test', 'test')
+        try:
+            return await async_build_service_map(lambda frontier, target: async_fetch_relations(client, frontier, target),
+                                                 roots, 'child', max_depth = 6, max_fanout = 5)
+        finally:
+            await client.close()
+
+    assert asyncio.run(walk()) == graph
+
+
+def test_parents_children_does_not_share_its_default(standin_factory, monkeypatch):
+    from itsm.itsm_connector import ITSM
+
+    standin = standin_factory(cmdb_roots = 1, cmdb_fanout = 2, cmdb_depth = 2)
+    monkeypatch.setattr(snow_client, '_snow_settings', None)
+    monkeypatch.setattr(cmdb_lookup, 'mirror_relation_fetcher', lambda: None)
+    configure_snow_settings(standin.url, 'test', 'test', mim_conf = {'ke_category_name': 'Knowledge'})
+
+    itsm = ITSM()
+    first = itsm.get_parents_children(_root(standin), 'child')
+    second = itsm.get_parents_children(_root(standin), 'child')
+
+    assert len(first) == 1 + 2
+    assert second == first
+    assert second is not first
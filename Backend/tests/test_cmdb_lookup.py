@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from itsm import cmdb_lookup
+from itsm.snow_client import SnowClient
+from itsm.snow_async_client import AsyncSnowClient
+from itsm.snow_cache import SnowCache
+
+
+class _EmptyIndex:
+    def resolve(self, values, limit):
+        return {value: [] for value in values}
+
+
+@pytest.fixture
+def no_mirror(monkeypatch):
+    monkeypatch.setattr(cmdb_lookup, 'mirror_relation_fetcher', lambda: None)
+    monkeypatch.setattr(cmdb_lookup, 'mirror_ci_index', lambda: _EmptyIndex())
+
+
+def _failing_name_in(get):
+    # The batched nameIN read fails; nameLIKE reads still go through
+    def failing_get(path, **kwargs):
+        if kwargs.get('params', {}).get('sysparm_query', '').startswith('nameIN'):
+            raise ConnectionError('nameIN read failed')
+        return get(path, **kwargs)
+
+    return failing_get
+
+
+def test_resolve_falls_back_when_batched_read_fails(standin_factory, no_mirror):
+    standin = standin_factory()
+    ci = standin.select('cmdb_ci')[0]
+    client = SnowClient(standin.url, 'test', 'test')
+    client.get = _failing_name_in(client.get)
+
+    resolved = cmdb_lookup.resolve_cmdb_cis(client, SnowCache(), [ci['name'], 'no-such-ci'], limit = 1)
+
+    assert [match['sys_id'] for match in resolved[ci['name']]] == [ci['sys_id']]
+    assert resolved['no-such-ci'] == []
+
+
+def test_async_resolve_falls_back_when_batched_read_fails(standin_factory, no_mirror):
+    standin = standin_factory()
+    ci = standin.select('cmdb_ci')[0]
+
+    async def resolve():
+        client = AsyncSnowClient(standin.url, 'test', 'test')
+        get = client.get
+
+        async def failing_get(path, **kwargs):
+            if kwargs.get('params', {}).get('sysparm_query', '').startswith('nameIN'):
+                raise ConnectionError('nameIN read failed')
+            return await get(path, **kwargs)
+
+        client.get = failing_get
+        try:
+            return await cmdb_lookup.async_resolve_cmdb_cis(client, SnowCache(), [ci['name'], 'no-such-ci'], limit = 1)
+        finally:
+            await client.close()
+
+    resolved = asyncio.run(resolve())
+
+    assert [match['sys_id'] for match in resolved[ci['name']]] == [ci['sys_id']]
+    assert resolved['no-such-ci'] == []
+
+
+def test_failed_service_map_returns_roots_only_and_is_not_cached(standin_factory, no_mirror):
+    standin = standin_factory(cmdb_roots = 1, cmdb_fanout = 2, cmdb_depth = 2)
+    root = standin.select('cmdb_rel_ci')[0]['parent']
+    client = SnowClient(standin.url, 'test', 'test')
+    cache = SnowCache()
+
+    iter_table = client.iter_table
+    client.iter_table = lambda *args, **kwargs: (_ for _ in ()).throw(ConnectionError('cmdb_rel_ci read failed'))
+
+    graph = cmdb_lookup.get_service_map_graph(client, cache, [root], 'child', 10, 50)
+    assert [node['sys_id'] for node in graph['nodes']] == [root]
+    assert graph['edges'] == []
+    assert 'cmdb_rel_ci read failed' in graph['error']
+
+    client.iter_table = iter_table
+    graph = cmdb_lookup.get_service_map_graph(client, cache, [root], 'child', 10, 50)
+    assert len(graph['edges']) == 2 + 4
+    assert 'error' not in graph
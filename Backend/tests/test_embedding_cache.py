@@ -0,0 +1,106 @@
+import pytest
+
+pytest.importorskip('langchain_core')
+
+from database import embedding_cache
+from database.embedding_cache import EmbeddingCache, CachedEmbeddings, DISK_EVICT_TARGET
+
+DIMENSIONS = 256
+VECTOR_BYTES = DIMENSIONS * 4
+
+
+def _vector(value):
+    return [float(value)] * DIMENSIONS
+
+
+def _mb(vectors):
+    return vectors * VECTOR_BYTES / 1024 / 1024
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(embedding_cache.time, 'time', lambda: now[0])
+
+    return now
+
+
+def test_memory_tier_evicts_least_recently_used_by_size(tmp_path):
+    cache = EmbeddingCache(path = str(tmp_path / 'cache.sqlite3'), memory_mb = _mb(3), disk_mb = 0)
+
+    cache.put_many('model', [('a', _vector(1)), ('b', _vector(2)), ('c', _vector(3))])
+    cache.get_many(['a'])
+    cache.put_many('model', [('d', _vector(4))])
+
+    assert sorted(cache.get_many(['a', 'b', 'c', 'd']).keys()) == ['a', 'c', 'd']
+    assert cache.stats()['memory_evictions'] == 1
+    assert cache._memory_used == 3 * VECTOR_BYTES
+
+
+def test_disk_tier_trims_to_target_by_last_use(tmp_path, clock):
+    cache = EmbeddingCache(path = str(tmp_path / 'cache.sqlite3'), memory_mb = 0, disk_mb = _mb(10))
+
+    for ind in range(10):
+        clock[0] += 1
+        cache.put_many('model', [(str(ind), _vector(ind))])
+
+    # A read older than the last_used resolution refreshes the row, so '0' outlives '1' to '3'
+    clock[0] += 120
+    assert list(cache.get_many(['0']).keys()) == ['0']
+
+    clock[0] += 1
+    cache.put_many('model', [('10', _vector(10))])
+
+    assert cache._disk_used <= cache.disk_bytes * DISK_EVICT_TARGET
+    assert cache._disk_used == cache._disk_size()
+    assert sorted(cache.get_many([str(ind) for ind in range(11)]).keys(), key = int) == ['0'] + [str(ind) for ind in range(3, 11)]
+    assert cache.stats()['disk_evictions'] == 2
+
+
+def test_disk_reads_only_refresh_stale_last_used(tmp_path, clock):
+    cache = EmbeddingCache(path = str(tmp_path / 'cache.sqlite3'), memory_mb = 0, disk_mb = _mb(10))
+    cache.put_many('model', [('a', _vector(1))])
+
+    last_used = lambda: cache.connection().execute("SELECT last_used FROM embeddings WHERE key = 'a'").fetchone()[0]
+
+    clock[0] += 30
+    cache.get_many(['a'])
+    assert last_used() == 1000.0
+
+    clock[0] += 60
+    cache.get_many(['a'])
+    assert last_used() == 1090.0
+
+
+def test_replaced_rows_are_not_counted_twice(tmp_path):
+    cache = EmbeddingCache(path = str(tmp_path / 'cache.sqlite3'), memory_mb = 0, disk_mb = _mb(10))
+
+    cache.put_many('model', [('a', _vector(1)), ('b', _vector(2))])
+    cache.put_many('model', [('a', _vector(3))])
+
+    assert cache._disk_used == 2 * VECTOR_BYTES == cache._disk_size()
+
+
+class _CountingModel:
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [_vector(len(text)) for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append([text])
+        return _vector(len(text))
+
+
+def test_embed_documents_sends_each_miss_once(tmp_path):
+    model = _CountingModel()
+    embeddings = CachedEmbeddings(model, 'model', EmbeddingCache(path = str(tmp_path / 'cache.sqlite3'), memory_mb = 1, disk_mb = 0))
+
+    first = embeddings.embed_documents(['alpha', 'beta', 'alpha', ' alpha  '])
+    second = embeddings.embed_documents(['beta', 'gamma', 'gamma'])
+
+    assert model.calls == [['alpha', 'beta'], ['gamma']]
+    assert first == [_vector(5), _vector(4), _vector(5), _vector(5)]
+    assert second == [_vector(4), _vector(5), _vector(5)]
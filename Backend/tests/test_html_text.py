@@ -0,0 +1,32 @@
+from itsm.html_text import PROCESS_POOL_THRESHOLD, HTMLTextConverter
+
+
+def _articles(count, version):
+    return [{'sys_id': 'kb%04d' % ind, 'sys_updated_on': version, 'text': '<p>Step <b>%d</b></p><p>Done</p>' % ind}
+            for ind in range(count)]
+
+
+def test_bulk_conversions_share_one_process_pool():
+    converter = HTMLTextConverter(workers = 2)
+    try:
+        first = converter.convert_articles(_articles(PROCESS_POOL_THRESHOLD, '2024-01-01 00:00:00'))
+        pool = converter._pool
+
+        # Edited articles miss the cache and go through the same workers
+        second = converter.convert_articles(_articles(PROCESS_POOL_THRESHOLD, '2024-01-02 00:00:00'))
+
+        assert pool is not None and converter._pool is pool
+        assert [article['text'] for article in first] == [article['text'] for article in second]
+        assert 'Step 3' in first[3]['text'] and 'Done' in first[3]['text']
+    finally:
+        converter.close()
+
+    assert converter._pool is None
+
+
+def test_small_batches_skip_the_pool():
+    converter = HTMLTextConverter(workers = 2)
+
+    converter.convert_articles(_articles(PROCESS_POOL_THRESHOLD - 1, '2024-01-01 00:00:00'))
+
+    assert converter._pool is None
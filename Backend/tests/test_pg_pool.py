@@ -0,0 +1,126 @@
+from types import SimpleNamespace
+
+import pytest
+
+psycopg2 = pytest.importorskip('psycopg2')
+import psycopg2.extensions
+
+from database import pg_pool
+from database.pg_pool import PgPool
+
+
+class _FakeConnection:
+    def __init__(self, alive):
+        self.alive = alive
+        self.closed = 0
+        self.info = SimpleNamespace(transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE)
+
+    def cursor(self):
+        connection = self
+
+        class Cursor:
+            def __enter__(self):
+                return self
+
+            def __exit__(self, *args):
+                return False
+
+            def execute(self, sql):
+                if not connection.alive[0]:
+                    raise ConnectionError('server closed the connection')
+
+        return Cursor()
+
+    def rollback(self):
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def close(self):
+        self.closed = 1
+
+
+@pytest.fixture
+def opened(monkeypatch):
+    connections = []
+    alive = [True]
+
+    def connect(**kwargs):
+        connections.append(_FakeConnection(alive))
+        return connections[-1]
+
+    monkeypatch.setattr(pg_pool.psycopg2, 'connect', connect)
+
+    return SimpleNamespace(connections = connections, alive = alive)
+
+
+def test_returned_connections_are_reused(opened):
+    pool = PgPool({}, min_size = 1, max_size = 3)
+    assert len(opened.connections) == 1
+
+    with pool.connection() as first, pool.connection() as second:
+        assert first is opened.connections[0]
+        assert second is opened.connections[1]
+        second.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+
+    assert pool.stats()['idle'] == 2
+    assert pool.stats()['in_use'] == 0
+
+    # Most recently returned first, rolled back, and nothing new opened
+    with pool.connection() as conn:
+        assert conn is opened.connections[0]
+    with pool.connection() as conn, pool.connection() as other:
+        assert {conn, other} == set(opened.connections)
+        assert other.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    assert len(opened.connections) == 2
+
+
+def test_stale_idle_connection_is_replaced(opened):
+    pool = PgPool({}, min_size = 0, max_size = 2, check_idle = 0)
+
+    with pool.connection():
+        pass
+
+    opened.alive[0] = False
+    with pool.connection() as conn:
+        assert conn is opened.connections[1]
+
+    assert opened.connections[0].closed
+    assert pool.stats()['discarded'] == 1
+
+
+def test_retire_closes_idle_now_and_borrowed_on_return(opened):
+    pool = PgPool({}, min_size = 0, max_size = 2)
+
+    with pool.connection():
+        pass
+
+    borrowed = pool.getconn()
+    with pool.connection():
+        pass
+    pool.retire()
+
+    assert pool.stats()['idle'] == 0
+    assert [conn.closed for conn in opened.connections] == [0, 1]
+
+    pool.putconn(borrowed)
+    assert borrowed.closed
+
+
+def test_pool_settings_are_reused_within_ttl(opened, monkeypatch):
+    calls = []
+
+    def settings():
+        calls.append(1)
+        return {'connect': {'host': 'db', 'port': 5432, 'dbname': 'itops', 'user': 'app', 'password': 'secret', 'options': ''},
+                'min_size': 0, 'max_size': 2, 'timeout': 1, 'check_idle': 60, 'settings_ttl': 60}
+
+    monkeypatch.setattr(pg_pool, 'pool_settings', settings)
+    monkeypatch.setattr(pg_pool, '_pg_pool', None)
+    monkeypatch.setattr(pg_pool, '_pg_pool_settings', None)
+
+    pool = pg_pool.get_pg_pool()
+
+    assert pg_pool.get_pg_pool() is pool
+    assert len(calls) == 1
+
+    pg_pool.close_pg_pools()
+    assert pg_pool.pg_pool_stats() is None
@@ -0,0 +1,23 @@
+import pickle
+import multiprocessing
+
+from itsm.records import ChangeTask
+
+
+def _keys(record):
+    return sorted(record.to_dict().keys())
+
+
+def test_missing_fields_survive_pickling():
+    record = ChangeTask.from_dict({'number': 'CTASK0010001', 'short_description': 'Patch'})
+    copied = pickle.loads(pickle.dumps(record))
+
+    assert copied.to_dict() == record.to_dict() == {'number': 'CTASK0010001', 'short_description': 'Patch'}
+    assert 'assignment_group.name' not in copied
+
+
+def test_missing_fields_survive_spawn():
+    record = ChangeTask.from_dict({'number': 'CTASK0010001'})
+
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        assert pool.apply(_keys, (record,)) == ['number']
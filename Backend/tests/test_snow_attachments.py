@@ -0,0 +1,40 @@
+import asyncio
+
+from itsm.snow_async_client import AsyncSnowClient
+from itsm.snow_attachments import UPLOAD_CHUNK_SIZE, async_upload_file
+
+
+def test_async_upload_streams_file(standin_factory, tmp_path):
+    standin = standin_factory(incidents = 1)
+    incident = standin.select('incident')[0]
+
+    file_path = tmp_path / 'runbook.txt'
+    file_path.write_bytes(b'x' * (UPLOAD_CHUNK_SIZE * 2 + 17))
+
+    async def upload():
+        client = AsyncSnowClient(standin.url, 'test', 'test')
+        try:
+            return await async_upload_file(client, 'incident', incident['sys_id'], str(file_path))
+        finally:
+            await client.close()
+
+    result = asyncio.run(upload())
+
+    assert result['error'] is None
+    assert result['result']['file_name'] == 'runbook.txt'
+    assert result['result']['size_bytes'] == str(UPLOAD_CHUNK_SIZE * 2 + 17)
+
+
+def test_async_upload_reports_missing_file(standin_factory, tmp_path):
+    standin = standin_factory(incidents = 1)
+
+    async def upload():
+        client = AsyncSnowClient(standin.url, 'test', 'test')
+        try:
+            return await async_upload_file(client, 'incident', 'abc', str(tmp_path / 'missing.txt'))
+        finally:
+            await client.close()
+
+    result = asyncio.run(upload())
+
+    assert result['status_code'] == 0 and 'missing.txt' in result['error']
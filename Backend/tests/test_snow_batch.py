@@ -0,0 +1,144 @@
+import json
+
+import pytest
+
+from itsm.snow_client import SnowClient
+from itsm.snow_batch import BATCH_PATH, execute_batch, table_insert
+from change_management.snow_ctask import ServiceNowTasks
+
+ITEMS = 23
+BATCH_SIZE = 5
+
+
+def _inserts(count, table = 'change_task'):
+    return [table_insert(table, {'short_description': 'Task ' + str(ind), 'assignment_group': 'group'})
+            for ind in range(count)]
+
+
+def _batch_calls(client):
+    calls = []
+    post = client.post
+
+    def recording_post(path, **kwargs):
+        if path == BATCH_PATH:
+            calls.append(len(json.loads(kwargs['data'])['rest_requests']))
+        return post(path, **kwargs)
+
+    client.post = recording_post
+    return calls
+
+
+def test_execute_batch_splits_into_batches(standin_factory):
+    standin = standin_factory()
+    client = SnowClient(standin.url, 'test', 'test', batch_size = BATCH_SIZE, batch_workers = 3)
+    calls = _batch_calls(client)
+
+    results = execute_batch(client, _inserts(ITEMS))
+
+    assert sorted(calls) == [3, 5, 5, 5, 5]
+    assert standin.stats()['requests'] == 5
+
+    # One result per item, in input order
+    assert [result['status_code'] for result in results] == [201] * ITEMS
+    assert [result['result']['short_description'] for result in results] == ['Task ' + str(ind) for ind in range(ITEMS)]
+    assert len(standin.select('change_task', 'short_descriptionSTARTSWITHTask ')) == ITEMS
+
+
+def test_execute_batch_reports_item_failures(standin_factory):
+    standin = standin_factory(mandatory_fields = {'change_task': ['assignment_group']})
+    client = SnowClient(standin.url, 'test', 'test', batch_size = BATCH_SIZE)
+
+    items = _inserts(4)
+    items[2] = table_insert('change_task', {'short_description': 'No group'})
+
+    results = execute_batch(client, items)
+
+    assert [result['status_code'] for result in results] == [201, 201, 403, 201]
+    assert 'Data Policy Exception' in results[2]['error']
+    assert results[2]['result'] is None
+    assert all([result['error'] is None for (ind, result) in enumerate(results) if ind != 2])
+
+
+def test_execute_batch_falls_back_without_batch_api(standin_factory):
+    standin = standin_factory(batch_api = False)
+    client = SnowClient(standin.url, 'test', 'test', batch_size = BATCH_SIZE)
+
+    results = execute_batch(client, _inserts(7))
+
+    assert [result['status_code'] for result in results] == [201] * 7
+    assert client.batch_supported is False
+
+    # Later calls skip the Batch API altogether
+    before = standin.stats()['requests']
+    execute_batch(client, _inserts(3))
+    assert standin.stats()['requests'] - before == 3
+
+
+def test_execute_batch_sends_unserviced_items_individually(standin_factory):
+    standin = standin_factory(batch_max_requests = 2)
+    client = SnowClient(standin.url, 'test', 'test', batch_size = BATCH_SIZE)
+
+    results = execute_batch(client, _inserts(BATCH_SIZE))
+
+    assert [result['status_code'] for result in results] == [201] * BATCH_SIZE
+    assert [result['result']['short_description'] for result in results] == ['Task ' + str(ind) for ind in range(BATCH_SIZE)]
+    # One batch call, then the three items it did not get to
+    assert standin.stats()['requests'] == 1 + BATCH_SIZE - 2
+
+
+@pytest.fixture
+def tasks_factory(standin_factory, monkeypatch):
+    def start(**options):
+        standin = standin_factory(**options)
+        monkeypatch.setattr(ServiceNowTasks, 'snow_url', standin.url)
+        monkeypatch.setattr(ServiceNowTasks, 'snow_username', 'test')
+        monkeypatch.setattr(ServiceNowTasks, 'snow_password', 'test')
+
+        return (standin, ServiceNowTasks())
+
+    return start
+
+
+def _tasks(standin, count):
+    # Groups as sys_ids, so no reference data lookup is needed
+    groups = [group['sys_id'] for group in standin.select('sys_user_group')]
+    return [{'short_description': 'Step ' + str(ind), 'description': 'Do step ' + str(ind),
+             'assignment_group': groups[ind % len(groups)]} for ind in range(count)]
+
+
+def test_create_tasks_one_output_per_task(tasks_factory):
+    (standin, tasks) = tasks_factory()
+    change = standin.select('change_request')[0]
+
+    outputs = tasks.create_tasks(_tasks(standin, ITEMS), sys_id = change['sys_id'])
+
+    assert len(outputs) == ITEMS
+    assert all([output['number'].startswith('CTASK') for output in outputs])
+    assert all([output['target_link'].startswith(standin.url + '/api/now/table/change_task?sys_id=') for output in outputs])
+
+    created = standin.select('change_task', 'change_request=' + change['sys_id'] + '^short_descriptionSTARTSWITHStep ')
+    assert sorted([record['number'] for record in created]) == sorted([output['number'] for output in outputs])
+
+    # Far fewer round trips than one POST per task
+    assert standin.stats()['requests'] < ITEMS
+
+
+def test_create_tasks_keeps_positions_of_failed_tasks(tasks_factory):
+    (standin, tasks) = tasks_factory(mandatory_fields = {'change_task': ['assignment_group']})
+
+    task_list = _tasks(standin, 6)
+    task_list[1]['assignment_group'] = ''
+    task_list[4]['assignment_group'] = ''
+
+    outputs = tasks.create_tasks(task_list, sys_id = standin.select('change_request')[0]['sys_id'])
+
+    assert [bool(output) for output in outputs] == [True, False, True, True, False, True]
+
+
+def test_create_tasks_without_batch_api(tasks_factory):
+    (standin, tasks) = tasks_factory(batch_api = False)
+
+    outputs = tasks.create_tasks(_tasks(standin, 4), sys_id = standin.select('change_request')[0]['sys_id'])
+
+    assert len(outputs) == 4
+    assert all([output['number'].startswith('CTASK') for output in outputs])
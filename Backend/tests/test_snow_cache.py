@@ -0,0 +1,26 @@
+from itsm.snow_client import SnowClient
+from itsm.snow_cache import SnowCache, cache_key
+
+
+def test_cache_keys_are_scoped_to_instance_and_user():
+    cache = SnowCache()
+    clients = [SnowClient('https://one.service-now.com', 'integration', 'secret'),
+               SnowClient('https://two.service-now.com/', 'integration', 'secret'),
+               SnowClient('https://one.service-now.com', 'readonly', 'secret')]
+
+    for (ind, client) in enumerate(clients):
+        assert cache.cached('cmdb_ci', cache_key(client, 'cmdb_ci', 'web01'), lambda: ind) == ind
+
+    assert [cache.get('cmdb_ci', cache_key(client, 'cmdb_ci', 'web01')) for client in clients] == [(True, 0), (True, 1), (True, 2)]
+    assert cache_key(clients[1], 'cmdb_ci', 'web01') == cache_key(SnowClient('https://two.service-now.com', 'integration', 'other'),
+                                                                 'cmdb_ci', 'web01')
+
+
+def test_cache_keys_ignore_condition_key_order():
+    client = SnowClient('https://one.service-now.com', 'integration', 'secret')
+
+    first = [{'param': 'priority', 'op': '=', 'val': '1'}, {'param': 'state', 'op': 'IN', 'val': ['1', '2']}]
+    second = [{'val': '1', 'op': '=', 'param': 'priority'}, {'op': 'IN', 'val': ['1', '2'], 'param': 'state'}]
+
+    assert cache_key(client, 'stats', ['state'], 'day', None, None, first) == cache_key(client, 'stats', ['state'], 'day', None, None, second)
+    assert cache_key(client, 'stats', ['state'], 'day', None, None, first) != cache_key(client, 'stats', ['priority'], 'day', None, None, first)
@@ -0,0 +1,116 @@
+import threading
+from types import SimpleNamespace
+
+import vault
+from itsm import snow_client
+from itsm.snow_client import get_snow_client, configure_snow_settings
+from change_management.snow_ctask import ServiceNowTasks
+
+
+def test_clients_are_keyed_by_credential(standin_factory):
+    standin = standin_factory(incidents = 0)
+
+    client = get_snow_client(standin.url, 'integration', 'first')
+
+    assert get_snow_client(standin.url + '/', 'integration', 'first') is client
+    assert get_snow_client(standin.url, 'integration', 'rotated') is not client
+    assert get_snow_client(standin.url, 'integration', 'rotated').snow_password == 'rotated'
+
+
+def test_settings_read_does_not_hold_client_lookups(standin_factory, monkeypatch):
+    standin = standin_factory(incidents = 0)
+    client = get_snow_client(standin.url, 'integration', 'secret')
+
+    # A slow Vault read in progress on another thread
+    monkeypatch.setattr(snow_client, '_snow_settings', None)
+    reading = threading.Event()
+    release = threading.Event()
+
+    def slow_vault(*args, **kwargs):
+        reading.set()
+        release.wait(5)
+        raise RuntimeError('Vault unavailable')
+
+    monkeypatch.setattr(snow_client, 'get_vault', slow_vault)
+    reader = threading.Thread(target = lambda: _ignore_errors(snow_client.get_snow_settings))
+    reader.start()
+    reading.wait(5)
+
+    looked_up = []
+    lookup = threading.Thread(target = lambda: looked_up.append(get_snow_client(standin.url, 'integration', 'secret')))
+    lookup.start()
+    lookup.join(2)
+
+    release.set()
+    reader.join(5)
+
+    assert looked_up == [client]
+
+
+def _ignore_errors(function):
+    try:
+        function()
+    except Exception:
+        pass
+
+
+def test_tasks_without_snow_url_use_configured_instance(standin_factory, monkeypatch):
+    standin = standin_factory(incidents = 0)
+
+    monkeypatch.setattr(ServiceNowTasks, 'snow_url', None)
+    monkeypatch.setattr(snow_client, '_snow_settings', None)
+    configure_snow_settings(standin.url, 'integration', 'secret', mim_conf = {})
+
+    tasks = ServiceNowTasks()
+
+    assert tasks.snow_url == standin.url
+    assert tasks.client is get_snow_client(standin.url, 'integration', 'secret')
+
+
+class _FakeKV:
+    def __init__(self, secrets):
+        self.secrets = secrets
+
+    def read_secret_version(self, path):
+        if path not in self.secrets:
+            raise ConnectionError('Vault unavailable')
+        return {'data': {'data': dict(self.secrets[path])}}
+
+
+def _vault_settings(standin, monkeypatch, secrets):
+    monkeypatch.setattr(vault, '_hvac_client', lambda vault_url, vault_token: SimpleNamespace(secrets = SimpleNamespace(kv = _FakeKV(secrets))))
+    monkeypatch.setattr(vault, '_secret_cache', vault.SecretCache())
+
+    session = vault.Vault('https://vault.test', 'token')
+    monkeypatch.setattr(snow_client, 'get_vault', lambda *args, **kwargs: session)
+    monkeypatch.setattr(snow_client, '_snow_settings', {'mim_conf': {'vault_url': 'https://vault.test', 'snow_tag': 'snow'},
+                                                        'snow_url': standin.url, 'proxies': None, 'credentials': None})
+
+    return session
+
+
+def test_rotated_secret_gets_new_client(standin_factory, monkeypatch):
+    standin = standin_factory(incidents = 0)
+    secrets = {'snow': {'integration': 'first'}}
+    session = _vault_settings(standin, monkeypatch, secrets)
+
+    client = get_snow_client()
+    assert get_snow_client() is client
+
+    secrets['snow'] = {'integration': 'rotated'}
+    session.invalidate('snow')
+
+    rotated = get_snow_client()
+    assert rotated is not client
+    assert rotated.snow_password == 'rotated'
+
+
+def test_failed_secret_read_is_retried(standin_factory, monkeypatch):
+    standin = standin_factory(incidents = 0)
+    secrets = {}
+    _vault_settings(standin, monkeypatch, secrets)
+
+    assert snow_client.get_snow_settings()['snow_password'] is None
+
+    secrets['snow'] = {'integration': 'secret'}
+    assert snow_client.get_snow_settings()['snow_password'] == 'secret'
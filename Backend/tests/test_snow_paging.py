@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from itsm.snow_client import SnowClient
+from itsm.snow_async_client import AsyncSnowClient
+
+INCIDENTS = 57
+PAGE_SIZE = 10
+
+
+@pytest.mark.parametrize('utc_offset', [5.5, -8])
+def test_iter_table_pages_on_raw_timestamps(standin_factory, utc_offset):
+    # Display values in a non-UTC timezone and a non-ISO format must not move the keyset cursor
+    standin = standin_factory(incidents = INCIDENTS, utc_offset = utc_offset, display_format = '%d-%m-%Y %I:%M:%S %p')
+    client = SnowClient(standin.url, 'test', 'test', page_size = PAGE_SIZE)
+
+    records = []
+    for record in client.iter_table('incident', fields = 'number,sys_created_on,assignment_group'):
+        records.append(record)
+        assert len(records) <= INCIDENTS, 'paging repeated records'
+
+    assert len(records) == INCIDENTS
+    assert len(set([record['number'] for record in records])) == INCIDENTS
+
+    # Callers still get display values, shaped as with sysparm_display_value=true
+    assert records[0]['sys_created_on'].endswith(('AM', 'PM'))
+    assert set(records[0]['assignment_group'].keys()) == {'display_value', 'link'}
+    assert 'sys_id' not in records[0]
+
+
+def test_iter_table_resumes_after_raw_position(standin_factory):
+    standin = standin_factory(incidents = INCIDENTS, utc_offset = 3)
+    client = SnowClient(standin.url, 'test', 'test', page_size = PAGE_SIZE)
+
+    raw = list(client.iter_table('incident', fields = 'number', display_value = 'false'))
+    position = (None, None)
+    for record in client.iter_table('incident', fields = 'number,sys_created_on,sys_id', display_value = 'false'):
+        if record['number'] == raw[19]['number']:
+            position = (record['sys_created_on'], record['sys_id'])
+            break
+
+    resumed = list(client.iter_table('incident', fields = 'number', start_after = position))
+
+    assert [record['number'] for record in resumed] == [record['number'] for record in raw[20:]]
+
+
+def test_async_iter_table_pages_on_raw_timestamps(standin_factory):
+    standin = standin_factory(incidents = INCIDENTS, utc_offset = 9, display_format = '%m/%d/%Y %H:%M:%S')
+
+    async def read():
+        client = AsyncSnowClient(standin.url, 'test', 'test', page_size = PAGE_SIZE)
+        try:
+            return [record async for record in client.iter_table('incident', fields = 'number,sys_created_on')]
+        finally:
+            await client.close()
+
+    records = asyncio.run(read())
+
+    assert len(records) == INCIDENTS
+    assert len(set([record['number'] for record in records])) == INCIDENTS
@@ -0,0 +1,25 @@
+import pytest
+
+from itsm.snow_scheduler import RequestScheduler
+
+
+@pytest.mark.parametrize('method', ['GET', 'HEAD'])
+@pytest.mark.parametrize('status_code', [0, 429, 500, 503])
+def test_reads_retry_transient_failures(method, status_code):
+    assert RequestScheduler().should_retry(method, status_code, 0)
+
+
+@pytest.mark.parametrize('method', ['POST', 'PUT', 'PATCH', 'DELETE'])
+def test_writes_retry_only_rate_limits(method):
+    scheduler = RequestScheduler()
+
+    assert scheduler.should_retry(method, 429, 0)
+    for status_code in [0, 500, 502, 503, 504]:
+        assert not scheduler.should_retry(method, status_code, 0)
+
+
+def test_retries_stop_at_max_retries():
+    scheduler = RequestScheduler(max_retries = 2)
+
+    assert scheduler.should_retry('GET', 503, 1)
+    assert not scheduler.should_retry('GET', 503, 2)
@@ -0,0 +1,22 @@
+import pytest
+
+from itsm.snow_stats import MAX_STATS_BUCKETS, time_buckets
+
+
+def test_time_buckets_are_aligned_and_clipped():
+    buckets = time_buckets('2024-03-30 10:15:00', '2024-04-02 08:00:00', 'day')
+
+    assert buckets == [('2024-03-30 10:15:00', '2024-03-31 00:00:00'), ('2024-03-31 00:00:00', '2024-04-01 00:00:00'),
+                       ('2024-04-01 00:00:00', '2024-04-02 00:00:00'), ('2024-04-02 00:00:00', '2024-04-02 08:00:01')]
+
+
+def test_time_buckets_reject_windows_over_the_cap():
+    assert len(time_buckets('2024-01-01 00:00:00', '2024-01-02 23:59:59', 'hour')) == MAX_STATS_BUCKETS
+
+    with pytest.raises(ValueError, match = 'coarser interval'):
+        time_buckets('2024-01-01 00:00:00', '2024-01-03 00:00:00', 'hour')
+
+    with pytest.raises(ValueError):
+        time_buckets('2024-01-01 00:00:00', '2024-12-31 00:00:00', 'day')
+
+    assert len(time_buckets('2024-01-01 00:00:00', '2024-12-31 00:00:00', 'month')) == 12
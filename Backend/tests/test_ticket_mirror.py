@@ -0,0 +1,50 @@
+import datetime
+
+import pytest
+
+from itsm.snow_client import SnowClient
+from itsm.snow_query import build_time_window_query
+from itsm.local_store import LocalStore
+from itsm.ticket_mirror import TicketMirror
+
+INCIDENTS = 300
+
+
+def _mirror(standin, tmp_path, timezone):
+    client = SnowClient(standin.url, 'test', 'test', page_size = 50)
+    mirror = TicketMirror(store = LocalStore(str(tmp_path / 'store.sqlite3')), client = client, window_days = 365,
+                          workers = 2, timezone = timezone)
+
+    return (client, mirror)
+
+
+@pytest.mark.parametrize('utc_offset', [5.5, -8])
+def test_mirror_window_matches_live_read(standin_factory, tmp_path, utc_offset):
+    standin = standin_factory(incidents = INCIDENTS, change_requests = 0, utc_offset = utc_offset)
+    (client, mirror) = _mirror(standin, tmp_path, datetime.timezone(datetime.timedelta(hours = utc_offset)))
+
+    mirror.sync('incident')
+    assert mirror.status()['tables']['incident']['rows'] == INCIDENTS
+
+    created = sorted([record['sys_created_on'] for record in standin.select('incident')])
+    start = datetime.datetime.strptime(created[40], '%Y-%m-%d %H:%M:%S') + datetime.timedelta(hours = utc_offset)
+    end = datetime.datetime.strptime(created[120], '%Y-%m-%d %H:%M:%S') + datetime.timedelta(hours = utc_offset)
+    (start_ts, end_ts) = (start.strftime('%Y-%m-%d %H:%M:%S'), end.strftime('%Y-%m-%d %H:%M:%S'))
+
+    live = [record['number'] for record in client.iter_table('incident', query = build_time_window_query(start_ts, end_ts),
+                                                             fields = 'number')]
+    mirrored = [record['number'] for record in mirror.query('incident', 'number', start_ts = start_ts, end_ts = end_ts)]
+
+    assert len(live) == 81
+    assert mirrored == live
+
+
+def test_mirror_leaves_windows_to_live_path_without_timezone(standin_factory, tmp_path):
+    standin = standin_factory(incidents = 20, change_requests = 0)
+    (client, mirror) = _mirror(standin, tmp_path, None)
+
+    mirror.backfill('incident')
+    mirror.store.set_watermark('incident', '', synced_at = datetime.datetime.now().timestamp())
+
+    assert mirror.query('incident', 'number', start_ts = '2024-01-01 00:00:00', end_ts = '2024-02-01 00:00:00') is None
+    assert len(list(mirror.query('incident', 'number'))) == 20
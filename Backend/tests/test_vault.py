@@ -0,0 +1,168 @@
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import vault
+from vault import SecretCache, Vault, REFRESH_RETRY_SECONDS
+
+
+class _FakeHvac:
+    """hvac.Client stand-in serving KV v2 secrets from a dict and counting reads."""
+    def __init__(self, secrets, lease_duration = 0):
+        self.store = secrets
+        self.lease_duration = lease_duration
+        self.available = True
+        self.reads = []
+        self.lists = 0
+
+        self.secrets = SimpleNamespace(kv = SimpleNamespace(read_secret_version = self.read_secret_version,
+                                                            v2 = SimpleNamespace(list_secrets = self.list_secrets,
+                                                                                 create_or_update_secret = self.create_or_update_secret)))
+
+    def read_secret_version(self, path):
+        self.reads.append((path, threading.current_thread().name))
+        if not self.available:
+            raise ConnectionError('Vault unavailable')
+
+        return {'data': {'data': dict(self.store[path])}, 'lease_duration': self.lease_duration}
+
+    def list_secrets(self, path):
+        self.lists += 1
+        return {'data': {'keys': sorted(self.store.keys())}}
+
+    def create_or_update_secret(self, path, secret):
+        self.store[path] = dict(secret)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(vault, 'time', SimpleNamespace(monotonic = lambda: now[0]))
+
+    return now
+
+
+@pytest.fixture
+def vault_factory(monkeypatch):
+    def start(secrets, lease_duration = 0, refresh_thread = False, **cache_options):
+        hvac_client = _FakeHvac(secrets, lease_duration = lease_duration)
+        cache = SecretCache(**cache_options)
+        if not refresh_thread:
+            # Request-path behaviour only
+            monkeypatch.setattr(cache, '_start', lambda: None)
+
+        monkeypatch.setattr(vault, '_hvac_client', lambda vault_url, vault_token: hvac_client)
+        monkeypatch.setattr(vault, '_secret_cache', cache)
+
+        return (Vault('https://vault.test', 'token'), hvac_client, cache)
+
+    return start
+
+
+def test_secret_is_read_once_per_ttl(vault_factory, clock):
+    (session, hvac_client, cache) = vault_factory({'snow': {'integration': 'first'}}, ttl = 300)
+
+    assert session.retrieve_secret('snow') == (True, {'integration': 'first'})
+    hvac_client.store['snow'] = {'integration': 'rotated'}
+
+    clock[0] += 299
+    assert session.retrieve_secret('snow') == (True, {'integration': 'first'})
+    assert len(hvac_client.reads) == 1
+
+    clock[0] += 2
+    assert session.retrieve_secret('snow') == (True, {'integration': 'rotated'})
+    assert len(hvac_client.reads) == 2
+    assert cache.stats()['hits'] == 1
+
+
+def test_lease_shorter_than_ttl_wins(vault_factory, clock):
+    (session, hvac_client, cache) = vault_factory({'db': {'app': 'secret'}}, lease_duration = 10, ttl = 300)
+
+    session.retrieve_secret('db')
+    clock[0] += 11
+    session.retrieve_secret('db')
+
+    assert len(hvac_client.reads) == 2
+
+
+def test_expired_secret_is_served_while_vault_is_down(vault_factory, clock):
+    (session, hvac_client, cache) = vault_factory({'snow': {'integration': 'first'}}, ttl = 300)
+    session.retrieve_secret('snow')
+
+    hvac_client.available = False
+    clock[0] += 301
+
+    assert session.retrieve_secret('snow') == (True, {'integration': 'first'})
+    assert session.retrieve_secret('snow') == (True, {'integration': 'first'})
+    assert cache.stats()['stale_reads'] == 1
+    assert len(hvac_client.reads) == 2
+
+    # Retried once the back-off has passed
+    clock[0] += REFRESH_RETRY_SECONDS
+    session.retrieve_secret('snow')
+    assert len(hvac_client.reads) == 3
+
+    # Nothing cached to fall back on
+    assert session.retrieve_secret('other')[0] is False
+
+
+def test_invalidate_forces_the_next_read(vault_factory, clock):
+    (session, hvac_client, cache) = vault_factory({'snow': {'integration': 'first'}, 'db': {'app': 'secret'}}, ttl = 300)
+
+    session.retrieve_secret('snow')
+    session.retrieve_secret('db')
+    assert session.list_secrets('/') == ['db', 'snow']
+
+    hvac_client.store['snow'] = {'integration': 'rotated'}
+    session.invalidate('snow')
+
+    assert session.retrieve_secret('snow') == (True, {'integration': 'rotated'})
+    assert session.retrieve_secret('db') == (True, {'app': 'secret'})
+    assert [path for (path, thread) in hvac_client.reads] == ['snow', 'db', 'snow']
+
+    # The name list goes with the path, insert_secret invalidates too, and no path drops every entry
+    session.list_secrets('/')
+    assert hvac_client.lists == 2
+
+    session.insert_secret('kb', {'svc': 'token'})
+    assert session.list_secrets('/') == ['db', 'kb', 'snow']
+
+    session.invalidate()
+    session.retrieve_secret('db')
+    assert [path for (path, thread) in hvac_client.reads][-1] == 'db'
+    assert cache.stats()['entries'] == 1
+
+
+def test_invalidate_is_scoped_to_the_token(vault_factory, clock):
+    (session, hvac_client, cache) = vault_factory({'snow': {'integration': 'first'}}, ttl = 300)
+    other = Vault('https://vault.test', 'other-token')
+
+    session.retrieve_secret('snow')
+    other.retrieve_secret('snow')
+    other.invalidate()
+
+    session.retrieve_secret('snow')
+    assert len(hvac_client.reads) == 2
+    assert cache.stats()['entries'] == 1
+
+
+def test_refresh_thread_reloads_before_expiry(vault_factory):
+    (session, hvac_client, cache) = vault_factory({'snow': {'integration': 'first'}}, refresh_thread = True, ttl = 1,
+                                                  refresh_ahead = 0.5)
+
+    session.retrieve_secret('snow')
+    hvac_client.store['snow'] = {'integration': 'rotated'}
+
+    deadline = time.monotonic() + 5
+    while cache.stats()['refreshes'] == 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+
+    assert cache.stats()['refreshes'] >= 1
+    assert ('snow', 'vault-secret-refresh') in hvac_client.reads
+
+    # The request path finds the reloaded value without a read of its own
+    reads = len([read for read in hvac_client.reads if read[1] != 'vault-secret-refresh'])
+    assert session.retrieve_secret('snow') == (True, {'integration': 'rotated'})
+    assert len([read for read in hvac_client.reads if read[1] != 'vault-secret-refresh']) == reads
@@ -2,37 +2,352 @@
 # Created On - April 28, 2023
 # Version - 1.0
 
+import os
 import sys
+import json
+import time
+import bisect
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import hvac
 
+SCRIPT_PATH = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_TOKEN_PATH = SCRIPT_PATH + '/config/.vault_token'
+
+# Secret cache defaults, overridable from config/mim_conf.json
+DEFAULT_SECRET_TTL = 300
+DEFAULT_REFRESH_AHEAD = 0.2
+DEFAULT_IDLE_TIMEOUT = 3600
+
+# Wait before retrying a failed background refresh
+REFRESH_RETRY_SECONDS = 30
+
+# Concurrent Vault reads when fetching a batch of secrets
+DEFAULT_FETCH_WORKERS = 8
+
+# One hvac client (and HTTP session) per Vault address and token
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _token_key(vault_token):
+  return hashlib.sha256((vault_token or '').encode('utf-8')).hexdigest()
+
+
+def _hvac_client(vault_url, vault_token):
+  key = (vault_url, _token_key(vault_token))
+
+  with _clients_lock:
+    client = _clients.get(key)
+    if client is None:
+      client = hvac.Client(url = vault_url, token = vault_token, verify = False)
+      _clients[key] = client
+
+    return client
+
+
+class SecretCache:
+  """
+    Process-wide cache of Vault reads.
+
+    A secret is kept for its lease duration when Vault sets one, capped at
+    ttl (KV secrets have no lease and use ttl). A background thread reloads
+    entries once they are within refresh_ahead of expiry, so reads on the
+    request path find a fresh value and make no network call. Entries not read
+    for idle_timeout are dropped instead of refreshed. If a reload fails the
+    last value keeps being served and the reload is retried.
+  """
+  def __init__(self, ttl = DEFAULT_SECRET_TTL, refresh_ahead = DEFAULT_REFRESH_AHEAD, idle_timeout = DEFAULT_IDLE_TIMEOUT):
+    self.ttl = ttl
+    self.refresh_ahead = refresh_ahead
+    self.idle_timeout = idle_timeout
+
+    self._entries = {}
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._thread = None
+
+    self._stats = {'hits': 0, 'misses': 0, 'refreshes': 0, 'refresh_failures': 0, 'stale_reads': 0, 'evictions': 0}
+
+  def _store(self, key, loader, value, lease_duration):
+    ttl = min(lease_duration, self.ttl) if lease_duration else self.ttl
+    now = time.monotonic()
+
+    with self._lock:
+      previous = self._entries.get(key)
+      self._entries[key] = {
+        'value': value,
+        'loader': loader,
+        'expires_at': now + ttl,
+        'refresh_at': now + ttl * (1 - self.refresh_ahead),
+        'last_read': previous['last_read'] if previous else now
+      }
+
+    self._start()
+    self._wake.set()
+
+  def get(self, key, loader):
+    """Cached value for key; loader() returns (value, lease_duration) and raises on failure."""
+    now = time.monotonic()
+
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None:
+        entry['last_read'] = now
+
+        if now < entry['expires_at']:
+          self._stats['hits'] += 1
+          return entry['value']
+
+      self._stats['misses'] += 1
+
+    try:
+      (value, lease_duration) = loader()
+    except Exception:
+      # Vault unreachable: an expired value beats no value, and later reads skip the call for a while
+      if entry is None:
+        raise
+
+      with self._lock:
+        self._stats['stale_reads'] += 1
+        entry['expires_at'] = time.monotonic() + REFRESH_RETRY_SECONDS
+      return entry['value']
+
+    self._store(key, loader, value, lease_duration)
+
+    return value
+
+  def invalidate(self, key = None):
+    """Drop one key, the keys a callable accepts, or everything."""
+    with self._lock:
+      if key is None:
+        self._entries.clear()
+      elif callable(key):
+        for cached_key in [cached_key for cached_key in self._entries if key(cached_key)]:
+          del self._entries[cached_key]
+      else:
+        self._entries.pop(key, None)
+
+  def _start(self):
+    with self._lock:
+      if self._thread is not None and self._thread.is_alive():
+        return
+
+      self._thread = threading.Thread(target = self._run, name = 'vault-secret-refresh', daemon = True)
+      self._thread.start()
+
+  def _run(self):
+    while True:
+      now = time.monotonic()
+      due = []
+
+      with self._lock:
+        for (key, entry) in list(self._entries.items()):
+          if now - entry['last_read'] > self.idle_timeout:
+            del self._entries[key]
+            self._stats['evictions'] += 1
+          elif now >= entry['refresh_at']:
+            due.append((key, entry))
+
+        next_at = min([entry['refresh_at'] for entry in self._entries.values()] or [now + self.ttl])
+
+      for (key, entry) in due:
+        try:
+          (value, lease_duration) = entry['loader']()
+        except Exception as e:
+          print(f"Vault secret refresh failed - {str(e)}")
+          with self._lock:
+            self._stats['refresh_failures'] += 1
+            entry['refresh_at'] = time.monotonic() + REFRESH_RETRY_SECONDS
+          continue
+
+        with self._lock:
+          self._stats['refreshes'] += 1
+          if key not in self._entries:
+            continue
+
+        self._store(key, entry['loader'], value, lease_duration)
+
+      if due:
+        continue
+
+      self._wake.clear()
+      self._wake.wait(max(next_at - time.monotonic(), 1))
+
+  def stats(self):
+    with self._lock:
+      lookups = self._stats['hits'] + self._stats['misses']
+      return dict(self._stats, entries = len(self._entries), ttl = self.ttl,
+                  hit_ratio = round(self._stats['hits'] / lookups, 3) if lookups else None)
+
+
+_secret_cache = None
+_secret_cache_lock = threading.Lock()
+
+
+def get_secret_cache():
+  global _secret_cache
+
+  with _secret_cache_lock:
+    if _secret_cache is None:
+      try:
+        with open(SCRIPT_PATH + '/config/mim_conf.json') as conf_f:
+          mim_conf = json.load(conf_f)
+      except Exception:
+        mim_conf = {}
+
+      _secret_cache = SecretCache(ttl = mim_conf.get('vault_secret_ttl', DEFAULT_SECRET_TTL),
+                                  refresh_ahead = mim_conf.get('vault_refresh_ahead', DEFAULT_REFRESH_AHEAD),
+                                  idle_timeout = mim_conf.get('vault_idle_timeout', DEFAULT_IDLE_TIMEOUT))
+
+    return _secret_cache
+
+
+def vault_cache_stats():
+  return get_secret_cache().stats()
+
+
+_fetch_executor = None
+_fetch_executor_lock = threading.Lock()
+
+
+def _get_fetch_executor():
+  global _fetch_executor
+
+  with _fetch_executor_lock:
+    if _fetch_executor is None:
+      _fetch_executor = ThreadPoolExecutor(max_workers = DEFAULT_FETCH_WORKERS, thread_name_prefix = 'vault-fetch')
+
+    return _fetch_executor
+
+
+class CredentialCatalogue:
+  """
+    Secret names at / of one Vault, kept sorted so the names under a prefix
+    are a bisect away.
+
+    The name list comes from the cached list_secrets(), and the index is
+    rebuilt only when that list changes (after its TTL, or at once when
+    insert_secret or invalidate touches it). credentials() reads every secret
+    under a prefix concurrently; reads the secret cache already holds cost no
+    Vault call.
+  """
+  def __init__(self, vault):
+    self.vault = vault
+
+    self._lock = threading.Lock()
+    self._listed = None
+    self._names = []
+
+  def _index(self):
+    listed = self.vault.list_secrets('/')
+
+    with self._lock:
+      if listed != self._listed:
+        self._listed = listed
+        self._names = sorted(listed)
+
+      return self._names
+
+  def names(self, prefix):
+    names = self._index()
+
+    matches = []
+    for name in names[bisect.bisect_left(names, prefix):]:
+      if not name.startswith(prefix):
+        break
+      matches.append(name)
+
+    return matches
+
+  def credentials(self, prefix):
+    """[(secret name, {key: value})] for the readable secrets whose name starts with prefix."""
+    names = self.names(prefix)
+    if not names:
+      return []
+
+    results = _get_fetch_executor().map(self.vault.retrieve_secret, names)
+
+    return [(name, secret) for (name, (status, secret)) in zip(names, results) if status]
+
+
 class Vault:
   def __init__(self, vault_url, vault_token):
-    self.client = hvac.Client(url = vault_url,
-                              token = vault_token,
-                              verify = False)
+    self.client = _hvac_client(vault_url, vault_token)
+    self.cache = get_secret_cache()
+
+    # Cache entries are scoped to the address and token they were read with
+    self._cache_scope = (vault_url, _token_key(vault_token))
+    self._catalogue = None
+
+  def credential_catalogue(self):
+    if self._catalogue is None:
+      self._catalogue = CredentialCatalogue(self)
+
+    return self._catalogue
+
+  def invalidate(self, path = None):
+    """Forget a changed secret (and the name list) so the next read goes to Vault; all of this Vault's entries without path."""
+    if path is None:
+      self.cache.invalidate(lambda key: key[:2] == self._cache_scope)
+    else:
+      self.cache.invalidate(self._cache_scope + ('read', path))
+      self.cache.invalidate(self._cache_scope + ('list', '/'))
 
   def insert_secret(self, path, secret_dict = {}):
     try:
       secret = self.client.secrets.kv.v2.create_or_update_secret(path = path, secret = secret_dict)
+      self.invalidate(path)
       return (True, 'Secret inserted successfully')
     except Exception as e:
       return (False, 'Secret insertion failed - ' + str(e))
 
+  def _read_secret(self, path):
+    secret = self.client.secrets.kv.read_secret_version(path = path)
+    return (secret['data']['data'], secret.get('lease_duration') or 0)
+
   def retrieve_secret(self, path, secret_name = None):
     try:
-      secret = self.client.secrets.kv.read_secret_version(path = path)
+      data = self.cache.get(self._cache_scope + ('read', path), lambda: self._read_secret(path))
       if secret_name == None:
-          return (True, secret['data']['data'])
+          return (True, dict(data))
       else:
-          return (True, {secret_name: secret['data']['data'][secret_name]})
+          return (True, {secret_name: data[secret_name]})
     except Exception as e:
       return (False, 'Secret retrieval failed - ' + str(e))
 
+  def _list_secrets(self):
+    response = self.client.secrets.kv.v2.list_secrets('/')
+    return (response['data']['keys'], response.get('lease_duration') or 0)
+
   def list_secrets(self, path):
     try:
-      secrets = self.client.secrets.kv.v2.list_secrets('/')['data']['keys']
-      return secrets
+      secrets = self.cache.get(self._cache_scope + ('list', '/'), self._list_secrets)
+      return list(secrets)
     except Exception as e:
       print(str(e))
       return []
 
+
+# Shared Vault for an address, with the token file read again only when it changes
+_vaults = {}
+_vaults_lock = threading.Lock()
+
+
+def get_vault(vault_url, token_path = DEFAULT_TOKEN_PATH):
+  mtime = os.path.getmtime(token_path)
+
+  with _vaults_lock:
+    cached = _vaults.get((vault_url, token_path))
+    if cached is not None and cached[0] == mtime:
+      return cached[1]
+
+    with open(token_path, 'r') as vault_file:
+      vault_token = vault_file.read().strip()
+
+    vault = Vault(vault_url, vault_token)
+    _vaults[(vault_url, token_path)] = (mtime, vault)
+
+    return vault